@@ -23,13 +23,23 @@ class StatusFileError(Exception):
     """Exception regarding Status File Format"""
 
 
-def hil_client_connect(endpoint_ip, name, pw):
-    """Returns a HIL client object"""
+def hil_client_connect(endpoint_ip, name, pw, admin=False):
+    """Returns a HIL client object
+
+    The client uses `name` and `pw` only to obtain a short-lived api token,
+    which it sends with subsequent requests; verifying a token is much
+    cheaper for the server than verifying a password. The token only grants
+    admin access if `admin` is True, which requires `name` to be an admin.
+    """
 
     hil_http_client = RequestsHTTPClient()
     hil_http_client.auth = (name, pw)
+    hil_client = Client(endpoint_ip, hil_http_client)
 
-    return Client(endpoint_ip, hil_http_client)
+    token = hil_client.user.create_token(ttl=3600, admin=admin)['token']
+    hil_http_client.auth = None
+    hil_http_client.headers['Authorization'] = 'Bearer ' + token
+    return hil_client
 
 
 def load_node_info(statusfile):
@@ -177,7 +187,9 @@ if __name__ == "__main__":
         hil_client = hil_client_connect(
                         config.get('hil', 'endpoint'),
                         config.get('hil', 'user_name'),
-                        config.get('hil', 'password')
+                        config.get('hil', 'password'),
+                        config.has_option('hil', 'admin') and
+                        config.getboolean('hil', 'admin')
                         )
         release_nodes(
             config.get('hil', 'status_file'),
@@ -3,13 +3,15 @@
 TODO: Spec out and document what sanitization is required.
 """
 import json
+import flask
 import requests
 import uuid
 
-from schema import Schema, And, Optional, SchemaError
+from schema import Schema, And, Optional, SchemaError, Use
 from urlparse import urlparse
 
-from hil import model, errors
+from hil import model, deferred, errors, events, inventory, notifications, \
+    obm_jobs, console_supervisor
 from hil.model import db
 from hil.auth import get_auth_backend
 from hil.config import cfg
@@ -18,10 +20,14 @@ from hil.class_resolver import concrete_class_for
 from hil.network_allocator import get_network_allocator
 import logging
 
+# The longest (in seconds) that a client may ask `show_networking_action` (or
+# `show_obm_action`) to wait for an action to complete:
+MAX_NETWORKING_ACTION_WAIT = 60
+
 
 # Project Code #
 ################
-@rest_call('GET', '/projects', Schema({}))
+@rest_call('GET', '/projects', Schema({}), depends_on=[model.Project])
 def list_projects():
     """List all projects.
 
@@ -255,31 +261,121 @@ def node_power_cycle(node, force=False):
 
     Force indicates whether the node should be forced off, or allowed
     to respond to the shutdown signal.
+
+    The node is rebooted in the background (see `hil.obm_jobs`); the
+    response contains a status id which can be passed to `show_obm_action`
+    to find out how it went.
     """
     node = get_or_404(model.Node, node)
     get_auth_backend().require_project_access(node.project)
-    node.obm.power_cycle(force)
+    return _queue_obm_action(node, 'power_cycle', {'force': force})
 
 
 @rest_call('POST', '/node/<node>/power_off', Schema({'node': basestring}))
 def node_power_off(node):
-    """Power off the node."""
+    """Power off the node.
+
+    As with `node_power_cycle`, this happens in the background.
+    """
     node = get_or_404(model.Node, node)
     get_auth_backend().require_project_access(node.project)
-    node.obm.power_off()
+    return _queue_obm_action(node, 'power_off', {})
+
+
+@rest_call('POST', '/nodes/power', Schema({
+    'nodes': [basestring],
+    'operation': And(basestring,
+                     lambda op: op in ('power_cycle', 'power_off')),
+    Optional('force'): bool,
+}))
+def nodes_power(nodes, operation, force=False):
+    """Power cycle or power off several nodes at once.
+
+    ``operation`` is either 'power_cycle' or 'power_off'; ``force`` has the
+    same meaning as for `node_power_cycle`. The operations are carried out
+    in the background (see `hil.obm_jobs`); the response contains a job id
+    which can be passed to `show_nodes_power` to find out how they went.
+
+    If any of the nodes does not exist, a NotFoundError will be raised, and
+    nothing is done.
+    """
+    labels = sorted(set(nodes))
+    if not labels:
+        raise errors.BadArgumentError('No nodes specified')
+    node_objs = model.Node.query.filter(model.Node.label.in_(labels)).all()
+    missing = set(labels) - set(n.label for n in node_objs)
+    if missing:
+        raise errors.NotFoundError('Nodes not found: %s' %
+                                   ', '.join(sorted(missing)))
+    auth_backend = get_auth_backend()
+    for node in node_objs:
+        auth_backend.require_project_access(node.project)
+
+    args = {'force': force} if operation == 'power_cycle' else {}
+    job = str(uuid.uuid4())
+    actions = [model.ObmAction(node, operation, args, job=job)
+               for node in node_objs]
+    obm_jobs.queue(actions)
+    return json.dumps(_power_job_info(job, actions), sort_keys=True), 202
+
+
+@rest_call('GET', '/nodes/power/<job_id>', Schema({'job_id': basestring}))
+def show_nodes_power(job_id):
+    """Show the progress of a bulk power operation started by `nodes_power`.
+
+    The result includes the status of the operation on each node: one of
+    'PENDING', 'RUNNING', 'DONE' or 'ERROR'.
+
+    If there is no such job, a NotFoundError will be raised.
+    """
+    actions = model.ObmAction.query.filter_by(job=job_id).all()
+    if not actions:
+        raise errors.NotFoundError('Power job %r not found' % job_id)
+    auth_backend = get_auth_backend()
+    for action in actions:
+        auth_backend.require_project_access(action.node.project)
+    return json.dumps(_power_job_info(job_id, actions), sort_keys=True)
+
+
+def _power_job_info(job, actions):
+    """Return the info for `show_nodes_power` about `job`'s `actions`."""
+    return {
+        'job_id': job,
+        'operation': actions[0].type,
+        'nodes': dict((action.node.label, {
+            'status': action.status,
+            'error': action.error,
+        }) for action in actions),
+    }
 
 
 @rest_call('PUT', '/node/<node>/boot_device', Schema({
     'node': basestring, 'bootdev': basestring,
 }))
 def node_set_bootdev(node, bootdev):
-    """Set the node's boot device."""
+    """Set the node's boot device.
+
+    As with `node_power_cycle`, this happens in the background. If the boot
+    device is not valid for the node, a BadArgumentError is raised straight
+    away.
+    """
     node = get_or_404(model.Node, node)
     get_auth_backend().require_project_access(node.project)
 
     node.obm.require_legal_bootdev(bootdev)
 
-    node.obm.set_bootdev(bootdev)
+    return _queue_obm_action(node, 'set_bootdev', {'dev': bootdev})
+
+
+def _queue_obm_action(node, type, args):
+    """Queue an OBM action on `node`, and return the api response.
+
+    See `model.ObmAction` for the meaning of the arguments.
+    """
+    # pylint: disable=redefined-builtin
+    action = model.ObmAction(node, type, args)
+    obm_jobs.queue([action])
+    return json.dumps({'status_id': action.uuid}), 202
 
 
 @rest_call('DELETE', '/node/<node>', Schema({'node': basestring}))
@@ -298,6 +394,13 @@ def node_delete(node):
         raise errors.BlockedError(
             "Node %r has nics; remove them before deleting %r." % (node.label,
                                                                    node.label))
+    obm_jobs.cancel_pending(node)
+    running = model.ObmAction.query \
+        .filter_by(node_id=node.id, status='RUNNING').count()
+    if running:
+        raise errors.BlockedError(
+            "Node %r has power operations in progress; wait for them to "
+            "finish before deleting." % node.label)
     node.obm.stop_console()
     node.obm.delete_console()
     db.session.delete(node)
@@ -688,7 +791,8 @@ def headnode_detach_network(headnode, hnic):
 # Network Code #
 ################
 
-@rest_call('GET', '/networks', Schema({}))
+@rest_call('GET', '/networks', Schema({}),
+           depends_on=[model.Network, model.Project])
 def list_networks():
     """Lists all networks"""
     result = {}
@@ -712,7 +816,8 @@ def list_networks():
 
 @rest_call('GET', '/network/<network>/attachments', schema=Schema({
     'network': basestring, Optional('project'): basestring,
-}))
+}), depends_on=[model.Network, model.Project, model.NetworkAttachment,
+                model.Nic, model.Node])
 def list_network_attachments(network, project=None):
     """Lists all the attachments from <project> for <network>
 
@@ -763,8 +868,9 @@ def list_network_attachments(network, project=None):
     'owner': basestring,
     'access': basestring,
     'net_id': basestring,
+    Optional('pool'): basestring,
 }))
-def network_create(network, owner, access, net_id):
+def network_create(network, owner, access, net_id, pool=None):
     """Create a network.
 
     If the network with that name already exists, a DuplicateError will be
@@ -778,7 +884,11 @@ def network_create(network, owner, access, net_id):
 
     Pass 'admin' as owner for an administrator-owned network.  Pass '' as
     access for a publicly accessible network.  Pass '' as net_id if you wish
-    to use the HIL's network-id allocation pool.
+    to use the HIL's network-id allocation pool; ``pool`` names the pool to
+    use, if the network allocator has several.
+
+    If the owner has used up its quota of network IDs from the pool, a
+    QuotaExceededError will be raised.
 
     Details of the various combinations of network attributes are in
     docs/networks.md
@@ -810,9 +920,13 @@ def network_create(network, owner, access, net_id):
 
     # Allocate net_id, if requested
     if net_id == "":
-        net_id = get_network_allocator().get_new_network_id()
+        net_id = get_network_allocator().get_new_network_id(pool=pool,
+                                                            project=owner)
         if net_id is None:
             raise errors.AllocationError('No more networks')
+    elif pool is not None:
+        raise errors.BadArgumentError(
+            "A pool may only be given when allocating a network ID")
     else:
         if not get_network_allocator().validate_network_id(net_id):
             raise errors.BadArgumentError("Invalid net_id")
@@ -849,7 +963,20 @@ def network_delete(network):
     db.session.commit()
 
 
-@rest_call('GET', '/network/<network>', Schema({'network': basestring}))
+@rest_call('GET', '/network_allocator/usage', Schema({}))
+def show_network_allocator_usage():
+    """Show how many network IDs are free and in use, by pool.
+
+    Returns a JSON object mapping the names of the network allocator's pools
+    to objects with keys "free" and "used".
+    """
+    get_auth_backend().require_admin()
+    return json.dumps(get_network_allocator().usage(), sort_keys=True)
+
+
+@rest_call('GET', '/network/<network>', Schema({'network': basestring}),
+           depends_on=[model.Network, model.Project, model.NetworkAttachment,
+                       model.Nic, model.Node])
 def show_network(network):
     """Show details of a network.
 
@@ -862,10 +989,8 @@ def show_network(network):
     network = get_or_404(model.Network, network)
 
     if network.access:
-        authorized = False
-        for proj in network.access:
-            authorized = authorized or auth_backend.have_project_access(proj)
-
+        authorized = any(auth_backend.have_project_access(proj)
+                         for proj in network.access)
         if not authorized:
             raise errors.AuthorizationError(
                 "You do not have access to this network.")
@@ -884,9 +1009,10 @@ def show_network(network):
     else:
         result['access'] = None
 
+    owner_access = auth_backend.have_project_access(network.owner)
     connected_nodes = {}
     for n in network.attachments:
-        if auth_backend.have_project_access(network.owner) or \
+        if owner_access or \
                 auth_backend.have_project_access(n.nic.owner.project):
             node, nic = n.nic.owner.label, n.nic.label
             # build a dictonary mapping a node to list of nics
@@ -982,7 +1108,7 @@ def switch_delete_port(switch, port):
 
 @rest_call('GET', '/switch/<switch>', Schema({
     'switch': basestring,
-}))
+}), depends_on=[model.Switch, model.Port])
 def show_switch(switch):
     """Show details of a switch.
 
@@ -1003,7 +1129,9 @@ def show_switch(switch):
 
 
 @rest_call('GET', '/switch/<switch>/port/<path:port>', Schema({
-    'switch': basestring, 'port': basestring}))
+    'switch': basestring, 'port': basestring}),
+    depends_on=[model.Switch, model.Port, model.Nic, model.Node,
+                model.NetworkAttachment, model.Network])
 def show_port(switch, port):
     """show port details on a switch.
 
@@ -1023,7 +1151,7 @@ def show_port(switch, port):
     return json.dumps(return_obj)
 
 
-@rest_call('GET', '/switches', Schema({}))
+@rest_call('GET', '/switches', Schema({}), depends_on=[model.Switch])
 def list_switches():
     """List all switches.
 
@@ -1123,33 +1251,104 @@ def port_revert(switch, port):
 
 
 @rest_call('GET', '/networking_action/<status_id>', Schema({
-    'status_id': basestring}))
-def show_networking_action(status_id):
+    'status_id': basestring,
+    Optional('wait'): And(Use(float),
+                          lambda w: 0 <= w <= MAX_NETWORKING_ACTION_WAIT),
+}), use_replica=False)
+def show_networking_action(status_id, wait=0):
     """Returns the status of the networking action by finding the status_id
     in the networking actions table.
+
+    If ``wait`` is non-zero and the action is pending, block for up to
+    ``wait`` seconds for it to finish before returning.
     """
-    action = model.NetworkingAction.query.filter_by(uuid=status_id).first()
-    if action is None:
-        raise errors.NotFoundError('status_id not found')
+    [action] = _get_networking_actions([status_id])
+    get_auth_backend().require_project_access(
+        _networking_action_project(action))
 
-    project = action.nic.owner.project
-    get_auth_backend().require_project_access(project)
+    if wait and action.status == 'PENDING':
+        _wait_for_networking_actions([status_id], wait)
+        [action] = _get_networking_actions([status_id])
 
-    action_info = {'status': action.status,
-                   'node': action.nic.owner.label,
-                   'nic': action.nic.label,
-                   'type': action.type,
-                   'channel': action.channel}
+    return json.dumps(_networking_action_info(action))
 
-    if action.new_network is None:
-        action_info['new_network'] = None
-    else:
-        action_info['new_network'] = action.new_network.label
 
-    return json.dumps(action_info)
+@rest_call('GET', '/networking_actions', Schema({
+    'status_ids': basestring,
+    Optional('wait'): And(Use(float),
+                          lambda w: 0 <= w <= MAX_NETWORKING_ACTION_WAIT),
+}), use_replica=False)
+def show_networking_actions(status_ids, wait=0):
+    """Returns the status of several networking actions at once.
+
+    ``status_ids`` is a comma-separated list of status ids. The result is
+    a JSON object mapping each status id to the information returned by
+    `show_networking_action`.
+
+    If ``wait`` is non-zero and any of the actions are pending, block for up
+    to ``wait`` seconds for all of them to finish before returning.
+    """
+    status_ids = sorted(set(s for s in status_ids.split(',') if s))
+    if not status_ids:
+        raise errors.BadArgumentError('No status_ids specified')
+
+    auth_backend = get_auth_backend()
+    actions = _get_networking_actions(status_ids)
+    for action in actions:
+        auth_backend.require_project_access(
+            _networking_action_project(action))
+
+    if wait and any(a.status == 'PENDING' for a in actions):
+        _wait_for_networking_actions(status_ids, wait)
+        actions = _get_networking_actions(status_ids)
 
+    return json.dumps(dict((action.uuid, _networking_action_info(action))
+                           for action in actions), sort_keys=True)
 
-@rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}))
+
+@rest_call('GET', '/obm_action/<status_id>', Schema({
+    'status_id': basestring,
+    Optional('wait'): And(Use(float),
+                          lambda w: 0 <= w <= MAX_NETWORKING_ACTION_WAIT),
+}), use_replica=False)
+def show_obm_action(status_id, wait=0):
+    """Returns the status of an OBM action, such as a power cycle.
+
+    The status is one of 'PENDING', 'RUNNING', 'DONE' or 'ERROR'; if it is
+    'ERROR', ``error`` says what went wrong.
+
+    If ``wait`` is non-zero and the action hasn't finished, block for up to
+    ``wait`` seconds for it to finish before returning.
+    """
+    action = model.ObmAction.query.filter_by(uuid=status_id).first()
+    if action is None:
+        raise errors.NotFoundError('status_id %s not found' % status_id)
+    get_auth_backend().require_project_access(action.node.project)
+
+    if wait and action.finished is None:
+        def _done():
+            row = db.session.query(model.ObmAction.finished) \
+                .filter_by(uuid=status_id).first()
+            # As in _wait_for_networking_actions, end the transaction:
+            db.session.commit()
+            # The action is gone if its node has been deleted:
+            return row is None or row.finished is not None
+        notifications.wait_until(_done,
+                                 obm_jobs.CHANNEL_FINISHED,
+                                 payloads=[status_id],
+                                 timeout=wait)
+        action = model.ObmAction.query.filter_by(uuid=status_id).first()
+        if action is None:
+            raise errors.NotFoundError('status_id %s not found' % status_id)
+
+    return json.dumps({'status': action.status,
+                       'error': action.error,
+                       'node': action.node.label,
+                       'type': action.type})
+
+
+@rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}),
+           depends_on=[model.Node])
 def list_nodes(is_free):
     """List all nodes or all free nodes
 
@@ -1166,7 +1365,8 @@ def list_nodes(is_free):
     return json.dumps(nodes)
 
 
-@rest_call('GET', '/project/<project>/nodes', Schema({'project': basestring}))
+@rest_call('GET', '/project/<project>/nodes', Schema({'project': basestring}),
+           depends_on=[model.Project, model.Node])
 def list_project_nodes(project):
     """List all nodes belonging the given project.
 
@@ -1183,7 +1383,7 @@ def list_project_nodes(project):
 
 @rest_call('GET', '/project/<project>/networks', Schema({
     'project': basestring,
-}))
+}), depends_on=[model.Project, model.Network])
 def list_project_networks(project):
     """List all private networks the project can access.
 
@@ -1198,7 +1398,10 @@ def list_project_networks(project):
     return json.dumps(networks)
 
 
-@rest_call('GET', '/node/<nodename>', Schema({'nodename': basestring}))
+@rest_call('GET', '/node/<nodename>', Schema({'nodename': basestring}),
+           depends_on=[model.Node, model.Project, model.Nic, model.Port,
+                       model.Switch, model.NetworkAttachment, model.Network,
+                       model.Metadata])
 def show_node(nodename):
     """Show the details of a node.
 
@@ -1293,17 +1496,106 @@ def list_active_extensions():
     return json.dumps(extensions)
 
 
+# Inventory code #
+##################
+@rest_call('GET', '/inventory/export', Schema({}))
+def export_inventory():
+    """Export every object in the inventory as newline-delimited JSON.
+
+    The body is streamed as it is generated; see `hil.inventory` for the
+    format of the records. The output can be loaded into a fresh database
+    with ``hil-admin import-inventory``.
+    """
+    get_auth_backend().require_admin()
+    return flask.Response(flask.stream_with_context(inventory.export_ndjson()),
+                          mimetype='application/x-ndjson')
+
+
+# Events code #
+###############
+# Events are announced as soon as they commit on the primary, which the
+# replica may not have caught up with:
+@rest_call('GET', '/events', Schema({
+    Optional('last_event_id'): And(Use(int), lambda i: i >= 0),
+}), use_replica=False)
+def stream_events(last_event_id=None):
+    """Stream changes to HIL's state as server-sent events.
+
+    The response never ends; events are sent as they are committed, and
+    only those the caller has access to are included. See `hil.events` for
+    what is reported.
+
+    If the ``Last-Event-ID`` header or the ``last_event_id`` parameter is
+    given (the header takes precedence, as browsers send it when they
+    reconnect), the stream starts with the events after that one;
+    otherwise it starts with the next new event.
+    """
+    header = flask.request.headers.get('Last-Event-ID')
+    if header is not None:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise errors.BadArgumentError(
+                'Invalid Last-Event-ID header: %r' % header)
+    response = flask.Response(
+        flask.stream_with_context(events.stream(last_event_id)),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the response:
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Console code #
 ################
-@rest_call('GET', '/node/<nodename>/console', Schema({'nodename': basestring}))
-def show_console(nodename):
-    """Show the contents of the console log."""
+@rest_call('GET', '/node/<nodename>/console', Schema({
+    'nodename': basestring,
+    Optional('offset'): And(Use(int), lambda i: i >= 0),
+    Optional('tail'): And(Use(int), lambda i: i >= 0),
+}))
+def show_console(nodename, offset=None, tail=None):
+    """Show the contents of the console log.
+
+    If `offset` is given, only the part of the log after that (byte) offset
+    is shown. If `tail` is given, at most that many bytes from the end of the
+    log are shown. The log is streamed to the client, and the offset of the
+    end of what was sent is returned in the ``X-Console-Offset`` header;
+    passing it as `offset` next time shows only what has been logged since.
+    """
     node = get_or_404(model.Node, nodename)
-    log = node.obm.get_console()
+    log = node.obm.get_console(offset, tail)
     if log is None:
         raise errors.NotFoundError(
             'The console log for %s does not exist.' % nodename)
-    return log
+    end, chunks = log
+    response = flask.Response(chunks, mimetype='text/plain')
+    response.headers['X-Console-Offset'] = str(end)
+    return response
+
+
+@rest_call('GET', '/node/<nodename>/console/follow', Schema({
+    'nodename': basestring,
+    Optional('offset'): And(Use(int), lambda i: i >= 0),
+    Optional('tail'): And(Use(int), lambda i: i >= 0),
+}))
+def follow_console(nodename, offset=None, tail=None):
+    """Stream the console log, and then its output as it arrives.
+
+    `offset` and `tail` select where to start, as for `show_console`. The
+    response carries on until the client disconnects, or the console log
+    is deleted; NUL bytes are sent while the console is quiet, to notice
+    clients which have gone away.
+    """
+    node = get_or_404(model.Node, nodename)
+    chunks = node.obm.follow_console(offset, tail)
+    if chunks is None:
+        raise errors.NotFoundError(
+            'The console log for %s does not exist.' % nodename)
+    response = flask.Response(chunks, mimetype='text/plain')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the response:
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @rest_call('PUT', '/node/<nodename>/console', Schema({'nodename': basestring}))
@@ -1323,6 +1615,23 @@ def stop_console(nodename):
     node.obm.delete_console()
 
 
+@rest_call('GET', '/consoles', Schema({}))
+def list_consoles():
+    """List the nodes whose consoles are being logged.
+
+    Returns a JSON object mapping the nodes' names to the status reported
+    by the console supervisor (see `console_supervisor.status`).
+    """
+    get_auth_backend().require_admin()
+    sessions = console_supervisor.status()
+    result = {}
+    for node in model.Node.query:
+        session = sessions.get(node.obm.get_console_log_filename())
+        if session is not None:
+            result[node.label] = session
+    return json.dumps(result, sort_keys=True)
+
+
 # Helper functions #
 ####################
 def absent_or_conflict(cls, name):
@@ -1418,7 +1727,7 @@ def get_child_or_404(obj_outer, cls_inner, name_inner):
 
 def _maintain(project, node, node_label):
     """Helper function to execute maintenance tasks.
-    Powers off the node, checks for the existence of maintenance pool
+    Queues powering off the node, checks for the existence of maintenance pool
     config options, and posts to the maintenance URL if
     they exist."""
     logger = logging.getLogger(__name__)
@@ -1438,9 +1747,11 @@ def _maintain(project, node, node_label):
     else:
         return
 
-    if (cfg.has_option('maintenance', 'shutdown')):
-        node.obm.power_off()
     maintenance_proj.nodes.append(node)
+    if (cfg.has_option('maintenance', 'shutdown')):
+        # This commits the transaction, as the OBM server needs to see the
+        # action:
+        obm_jobs.queue([model.ObmAction(node, 'power_off', {})])
     url = cfg.get('maintenance', 'url')
     payload = json.dumps({'node': node_label})
     try:
@@ -1455,13 +1766,91 @@ def _maintain(project, node, node_label):
                     ' failed with response: %s', response.text)
 
 
+def _get_networking_actions(status_ids):
+    """Return the networking actions with the given status ids.
+
+    Actions which are no longer in the journal are looked up in the archive,
+    and returned as `model.ArchivedNetworkingAction`s. Raises NotFoundError
+    if any of the actions don't exist.
+    """
+    actions = model.NetworkingAction.query \
+        .filter(model.NetworkingAction.uuid.in_(status_ids)).all()
+    missing = set(status_ids) - set(a.uuid for a in actions)
+    if missing:
+        actions += model.ArchivedNetworkingAction.query \
+            .filter(model.ArchivedNetworkingAction.uuid.in_(missing)).all()
+    found = set(a.uuid for a in actions)
+    for status_id in status_ids:
+        if status_id not in found:
+            raise errors.NotFoundError('status_id %s not found' % status_id)
+    return actions
+
+
+def _networking_action_project(action):
+    """Return the project of the node affected by a networking action.
+
+    `action` may be archived, in which case this is the project the node
+    belonged to at the time, if that still exists.
+    """
+    if isinstance(action, model.ArchivedNetworkingAction):
+        if action.project_id is None:
+            return None
+        return model.Project.query.get(action.project_id)
+    return action.nic.owner.project
+
+
+def _networking_action_info(action):
+    """Build the JSON-able description of a networking action."""
+    if isinstance(action, model.ArchivedNetworkingAction):
+        return {'status': action.status,
+                'node': action.node,
+                'nic': action.nic,
+                'type': action.type,
+                'channel': action.channel,
+                'new_network': action.new_network}
+    action_info = {'status': action.status,
+                   'node': action.nic.owner.label,
+                   'nic': action.nic.label,
+                   'type': action.type,
+                   'channel': action.channel}
+
+    if action.new_network is None:
+        action_info['new_network'] = None
+    else:
+        action_info['new_network'] = action.new_network.label
+    return action_info
+
+
+def _wait_for_networking_actions(status_ids, timeout):
+    """Block until none of the given actions is pending.
+
+    Gives up after ``timeout`` seconds. Rather than polling, this re-checks
+    the actions only when the networking daemon reports that it has finished
+    one of them.
+    """
+    def _done():
+        pending = model.NetworkingAction.query.filter(
+            model.NetworkingAction.uuid.in_(status_ids),
+            model.NetworkingAction.status == 'PENDING',
+        ).count()
+        # End the transaction, so that we don't hold on to a database
+        # connection while we wait, and so the next check sees the daemon's
+        # changes.
+        db.session.commit()
+        return pending == 0
+    notifications.wait_until(_done,
+                             model.NetworkingAction.notification_channel,
+                             payloads=status_ids,
+                             timeout=timeout)
+
+
 def check_pending_action(nic):
     """Raises an error if the nic has a pending action
-    Otherwise deletes the completed action"""
+    Otherwise removes the completed action from the journal"""
     if nic.current_action:
         if nic.current_action.status == 'PENDING':
             raise errors.BlockedError(
                 "A networking operation is already active on the nic.")
         else:
-            db.session.delete(nic.current_action)
+            deferred.remove_action(nic.current_action)
     return
@@ -4,6 +4,7 @@ from hil.errors import AuthorizationError
 from hil import model
 from abc import ABCMeta, abstractmethod
 
+import flask
 import sys
 
 _auth_backend = None
@@ -17,9 +18,14 @@ class AuthBackend(object):
     of the subclass
 
     Subclasses of AuthBackend must override `authenticate`, `_have_admin`,
-    and `_have_project_access`, and nothing else. Users of the AuthBackend must
-    not invoke `_have_admin` and `_have_project_access`, preferring
-    `have_admin` and `have_project_access`.
+    and `_have_project_access`, and may override `_accessible_project_ids`.
+    Users of the AuthBackend must not invoke these, preferring `have_admin`
+    and `have_project_access`.
+
+    The answers to `have_admin` and `have_project_access` are memoized for
+    the rest of the request, for as long as ``hil.rest.local.auth`` refers
+    to the same object; backends which change the authorization state in
+    place must call `forget_decisions`.
     """
 
     __metaclass__ = ABCMeta
@@ -64,13 +70,66 @@ class AuthBackend(object):
         the `have_*` and `require_*` wrappers handle this.
         """
 
+    def _accessible_project_ids(self):
+        """Return the ids of the projects the request may act as.
+
+        Backends which can cheaply compute the full set of projects the
+        request has access to (not counting admin access) should override
+        this to return it as a frozenset; `have_project_access` will then
+        consult it instead of calling `_have_project_access` for each
+        project. The default returns None, meaning this is not supported.
+        This will be called at most once per request.
+        """
+        return None
+
+    def access_depends_on(self):
+        """Return the model classes authorization decisions depend on.
+
+        Conditional GETs (see `hil.rest.rest_call`) mix the versions of these
+        classes' tables into their ETags, so that a caller who has lost access
+        to a cached response can't keep revalidating it. The default is an
+        empty list, for backends whose decisions depend only on the request's
+        credentials, which are mixed in already.
+        """
+        return []
+
+    def _decisions(self):
+        """Return the memoized authorization decisions for this request.
+
+        This is a dict, with the keys:
+
+        * 'admin': the result of `_have_admin`, if it has been computed.
+        * 'project_ids': the result of `_accessible_project_ids`, if it has
+          been computed.
+        * 'projects': a dict mapping project ids to the results of
+          `_have_project_access`.
+
+        Outside of an app context, nothing is memoized.
+        """
+        if not flask.has_app_context():
+            return {'projects': {}}
+        owner = getattr(flask.g, 'auth', None)
+        memo = getattr(flask.g, 'hil_auth_decisions', None)
+        if memo is None or memo[0] is not owner:
+            memo = (owner, {'projects': {}})
+            flask.g.hil_auth_decisions = memo
+        return memo[1]
+
+    def forget_decisions(self):
+        """Discard the authorization decisions memoized for this request."""
+        if flask.has_app_context():
+            flask.g.pop('hil_auth_decisions', None)
+
     def have_admin(self):
         """Check if the request is authorized to act as an administrator.
 
         Return True if so, False if not. This will be caled sometime after
         ``authenticate()``.
         """
-        return self._have_admin()
+        decisions = self._decisions()
+        if 'admin' not in decisions:
+            decisions['admin'] = bool(self._have_admin())
+        return decisions['admin']
 
     def have_project_access(self, project):
         """Check if the request is authorized to act as the given project.
@@ -86,10 +145,24 @@ class AuthBackend(object):
         """
 
         if project is None:
-            return self._have_admin()
+            return self.have_admin()
 
         assert isinstance(project, model.Project)
-        return self._have_admin() or self._have_project_access(project)
+        if self.have_admin():
+            return True
+        if project.id is None:
+            # Not yet flushed, so we can't memoize by id:
+            return self._have_project_access(project)
+
+        decisions = self._decisions()
+        if 'project_ids' not in decisions:
+            decisions['project_ids'] = self._accessible_project_ids()
+        if decisions['project_ids'] is not None:
+            return project.id in decisions['project_ids']
+        projects = decisions['projects']
+        if project.id not in projects:
+            projects[project.id] = bool(self._have_project_access(project))
+        return projects[project.id]
 
     def require_admin(self):
         """Ensure the request is authorized to act as an administrator.
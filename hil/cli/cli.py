@@ -21,7 +21,8 @@ def cli():
 
 
 commands = [node.node, project.project, network.network, switch.switch,
-            port.port, user.user, misc.networking_action, headnode.headnode]
+            port.port, user.user, misc.networking_action, misc.obm_action,
+            headnode.headnode]
 
 for command in commands:
     cli.add_command(command)
@@ -15,10 +15,12 @@ def setup_http_client():
     Sets http_client to an object which makes HTTP requests with
     authentication. It chooses an authentication backend as follows:
 
-    1. If the environment variables HIL_USERNAME and HIL_PASSWORD
+    1. If the environment variable HIL_TOKEN is defined, it will send
+       it as an api token (see `hil.ext.auth.database`).
+    2. If the environment variables HIL_USERNAME and HIL_PASSWORD
        are defined, it will use HTTP basic auth, with the corresponding
        user name and password.
-    2. If the `python-keystoneclient` library is installed, and the
+    3. If the `python-keystoneclient` library is installed, and the
        environment variables:
 
            * OS_AUTH_URL
@@ -27,7 +29,7 @@ def setup_http_client():
            * OS_PROJECT_NAME
 
        are defined, Keystone is used.
-    3. Otherwise, do not supply authentication information.
+    4. Otherwise, do not supply authentication information.
 
     This may be extended with other backends in the future.
 
@@ -35,12 +37,18 @@ def setup_http_client():
     Until all calls are moved to client library, this will support
     both ways of intereacting with HIL.
     """
-    # First try basic auth:
     ep = os.environ.get('HIL_ENDPOINT')
 
     if ep is None:
         sys.exit("Error: HIL_ENDPOINT not set \n")
 
+    # First try an api token:
+    token = os.getenv('HIL_TOKEN')
+    if token is not None:
+        http_client = RequestsHTTPClient()
+        http_client.headers['Authorization'] = 'Bearer ' + token
+        return Client(ep, http_client), http_client
+    # Next try basic auth:
     basic_username = os.getenv('HIL_USERNAME')
     basic_password = os.getenv('HIL_PASSWORD')
     if basic_username is not None and basic_password is not None:
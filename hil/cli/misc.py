@@ -10,6 +10,22 @@ def networking_action():
 
 @networking_action.command('show')
 @click.argument('status_id')
-def show_networking_action(status_id):
+@click.option('--wait', type=float,
+              help='Seconds to wait for the action to finish')
+def show_networking_action(status_id, wait):
     """Displays the status of the networking action"""
-    print client.node.show_networking_action(status_id)
+    print client.node.show_networking_action(status_id, wait)
+
+
+@click.group(name='obm-action')
+def obm_action():
+    """Commands related to obm-actions"""
+
+
+@obm_action.command('show')
+@click.argument('status_id')
+@click.option('--wait', type=float,
+              help='Seconds to wait for the action to finish')
+def show_obm_action(status_id, wait):
+    """Displays the status of the OBM action, e.g. a power cycle"""
+    print client.node.show_obm_action(status_id, wait)
@@ -16,13 +16,14 @@ def network():
               'Defaults to the owner of the network')
 @click.option('--net-id',
               help='Network ID for network. Only admins can specify this.')
-def network_create(network, owner, access, net_id):
+@click.option('--pool', help='Pool to allocate the network ID from.')
+def network_create(network, owner, access, net_id, pool):
     """Create a link-layer <network>.  See docs/networks.md for details"""
     if net_id is None:
         net_id = ''
     if access is None:
         access = owner
-    client.network.create(network, owner, access, net_id)
+    client.network.create(network, owner, access, net_id, pool=pool)
 
 
 @network.command(name='delete')
@@ -49,6 +50,15 @@ def network_list():
         sys.stdout.write('%s \t : %s\n' % (item[0], item[1]))
 
 
+@network.command(name='usage')
+def network_allocator_usage():
+    """Show how many network IDs are free and in use, by pool"""
+    q = client.network.allocator_usage()
+    for pool, counts in sorted(q.items()):
+        sys.stdout.write('%s \t : free %d, used %d\n' %
+                         (pool, counts['free'], counts['used']))
+
+
 @network.command('list-attachments')
 @click.argument('network')
 @click.option('--project', help='Name of project.')
@@ -39,7 +39,7 @@ def node_bootdev(node, bootdev):
     eg; hil node_set_bootdev dell-23 pxe
     for IPMI, dev can be set to disk, pxe, or none
     """
-    client.node.set_bootdev(node, bootdev)
+    print client.node.set_bootdev(node, bootdev)
 
 
 @node.command(name='register', short_help='Register a new node')
@@ -135,14 +135,30 @@ def node_power():
 @click.argument('node')
 def node_power_off(node):
     """Power off <node>"""
-    client.node.power_off(node)
+    print client.node.power_off(node)
 
 
 @node_power.command(name='cycle')
 @click.argument('node')
 def node_power_cycle(node):
     """Power cycle <node>"""
-    client.node.power_cycle(node)
+    print client.node.power_cycle(node)
+
+
+@node_power.command(name='many')
+@click.argument('operation', type=click.Choice(['cycle', 'off']))
+@click.argument('nodes', nargs=-1, required=True)
+@click.option('--force', is_flag=True, help='Force nodes off when cycling')
+def node_power_many(operation, nodes, force):
+    """Power cycle or power off many <nodes> at once"""
+    print client.node.power_many(list(nodes), 'power_' + operation, force)
+
+
+@node_power.command(name='job')
+@click.argument('job_id')
+def node_power_job(job_id):
+    """Show the progress of a 'node power many' job"""
+    print client.node.show_power_job(job_id)
 
 
 @node.group(name='metadata')
@@ -174,9 +190,21 @@ def node_console():
 
 @node_console.command(name='show', short_help='Show console')
 @click.argument('node')
-def node_show_console(node):
+@click.option('--tail', type=int,
+              help='Only show this many bytes from the end of the log')
+def node_show_console(node, tail):
     """Display console log for <node>"""
-    print(client.node.show_console(node))
+    print(client.node.show_console(node, tail=tail))
+
+
+@node_console.command(name='list', short_help='List logged consoles')
+def node_list_consoles():
+    """List the nodes whose consoles are being logged"""
+    q = client.node.list_consoles()
+    for node, status in sorted(q.items()):
+        state = 'running' if status['running'] else 'restarting'
+        sys.stdout.write('%s\t  :  %s (%d restarts)\n' %
+                         (node, state, status['restarts']))
 
 
 @node_console.command(name='start', short_help='Start console')
@@ -1,5 +1,6 @@
 """ This module implements the HIL client library. """
 
+from collections import OrderedDict
 from urlparse import urljoin
 import json
 import re
@@ -22,6 +23,51 @@ class FailedAPICallException(Exception):
         self.error_type = error_type
 
 
+class ResponseCache(object):
+    """Wraps an `HTTPClient`, caching GET responses which carry an ETag.
+
+    When a cached URL is requested again, the request is made conditional
+    on the ETag (with ``If-None-Match``); if the server replies 304 Not
+    Modified, the cached response is returned in place of the 304, so the
+    server need not regenerate or resend the body.
+
+    Instances have the same ``request`` method as `HTTPClient`, so they can
+    be used in place of one.
+    """
+
+    # The maximum number of responses to keep. When full, the least
+    # recently stored response is evicted.
+    max_entries = 256
+
+    def __init__(self, httpClient):
+        self.httpClient = httpClient
+        self.responses = OrderedDict()
+
+    def request(self, method, url, data=None, params=None, headers=None):
+        """Make a request, as with `HTTPClient.request`."""
+        if method != 'GET':
+            return self.httpClient.request(method, url, data=data,
+                                           params=params, headers=headers)
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = self.responses.get(key)
+        if cached is None:
+            response = self.httpClient.request(method, url, data=data,
+                                               params=params, headers=headers)
+        else:
+            response = self.httpClient.request(
+                method, url, data=data, params=params,
+                headers=dict(headers or {},
+                             **{'If-None-Match': cached.headers['ETag']}))
+            if response.status_code == 304:
+                return cached
+            del self.responses[key]
+        if response.status_code == 200 and 'ETag' in response.headers:
+            self.responses[key] = response
+            if len(self.responses) > self.max_entries:
+                self.responses.popitem(last=False)
+        return response
+
+
 class ClientBase(object):
     """Main class which contains all the methods to
 
@@ -42,7 +88,7 @@ class ClientBase(object):
        Currently all this information is fetched from the user's environment.
         """
         self.endpoint = endpoint
-        self.httpClient = httpClient
+        self.httpClient = ResponseCache(httpClient)
 
     def object_url(self, *args):
         """Generate URL from combining endpoint and args as relative URL"""
@@ -58,6 +104,10 @@ class ClientBase(object):
 
         Returns the body of the response as (parsed) JSON, or None if there
         was no body. Raises a FailedAPICallException on any non 2xx status.
+
+        GET responses are cached and revalidated with the server by
+        `ResponseCache` (which wraps ``self.httpClient``), so the response
+        may be a cached copy that the server has confirmed is current.
         """
         if 200 <= response.status_code < 300:
             try:
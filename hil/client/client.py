@@ -26,12 +26,13 @@ class HTTPClient(object):
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def request(self, method, url, data=None, params=None):
+    def request(self, method, url, data=None, params=None, headers=None):
         """Make an HTTP request
 
         Makes an HTTP request on URL `url` with method `method`, request body
-        `data`(if supplied) and query parameter `params`(if supplied). May add
-        authentication or other backend-specific information to the request.
+        `data`(if supplied), query parameter `params`(if supplied) and extra
+        headers `headers` (if supplied). May add authentication or other
+        backend-specific information to the request.
 
         Parameters
         ----------
@@ -45,6 +46,8 @@ class HTTPClient(object):
         params : dictionary, optional
             The query parameter, e.g. {'key1': 'val1', 'key2': 'val2'},
             dictionary key can't be `None`
+        headers : dictionary, optional
+            Additional request headers, e.g. {'If-None-Match': '"abc"'}
 
         Returns
         -------
@@ -113,7 +116,7 @@ class KeystoneHTTPClient(HTTPClient):
         """
         self.session = session
 
-    def request(self, method, url, data=None, params=None):
+    def request(self, method, url, data=None, params=None, headers=None):
         """Make an HTTP request using keystone for authentication.
 
         Smooths over the differences between python-keystoneclient's
@@ -129,7 +132,8 @@ class KeystoneHTTPClient(HTTPClient):
             resp = self.session.request(method=method,
                                         url=url,
                                         data=data,
-                                        params=params)
+                                        params=params,
+                                        headers=headers)
 
         except HttpError as e:
             resp = e.response
@@ -15,6 +15,11 @@ class Network(ClientBase):
             url = self.object_url('networks')
             return self.check_response(self.httpClient.request("GET", url))
 
+        def allocator_usage(self):
+            """Shows how many network ids are free and in use, by pool."""
+            url = self.object_url('network_allocator', 'usage')
+            return self.check_response(self.httpClient.request("GET", url))
+
         @check_reserved_chars()
         def list_network_attachments(self, network, project):
             """Lists nodes connected to a network"""
@@ -32,17 +37,21 @@ class Network(ClientBase):
             url = self.object_url('network', network)
             return self.check_response(self.httpClient.request("GET", url))
 
-        @check_reserved_chars(slashes_ok=['net_id'])
-        def create(self, network, owner, access, net_id):
+        @check_reserved_chars(slashes_ok=['net_id'], dont_check=['pool'])
+        def create(self, network, owner, access, net_id, pool=None):
             """Create a link-layer <network>.
 
+            If <pool> is given, the network id is allocated from that pool.
             See docs/networks.md for details.
             """
             url = self.object_url('network', network)
-            payload = json.dumps({
+            payload = {
                 'owner': owner, 'access': access,
                 'net_id': net_id
-                })
+                }
+            if pool is not None:
+                payload['pool'] = pool
+            payload = json.dumps(payload)
             return self.check_response(
                     self.httpClient.request("PUT", url, data=payload)
                     )
@@ -78,6 +78,27 @@ class Node(ClientBase):
         url = self.object_url('node', node_name, 'power_off')
         return self.check_response(self.httpClient.request('POST', url))
 
+    def power_many(self, nodes, operation, force=False):
+        """Power cycle or power off all of <nodes> in parallel.
+
+        <operation> is 'power_cycle' or 'power_off'. Returns information
+        about the job, including its id, which can be passed to
+        `show_power_job`.
+        """
+        url = self.object_url('nodes', 'power')
+        payload = json.dumps({'nodes': nodes,
+                              'operation': operation,
+                              'force': force})
+        return self.check_response(
+                self.httpClient.request('POST', url, data=payload)
+                )
+
+    @check_reserved_chars()
+    def show_power_job(self, job_id):
+        """Shows the progress of a job started by `power_many`."""
+        url = self.object_url('nodes', 'power', job_id)
+        return self.check_response(self.httpClient.request('GET', url))
+
     @check_reserved_chars()
     def set_bootdev(self, node, dev):
         """Set <node> to boot from <dev> persistently"""
@@ -141,15 +162,35 @@ class Node(ClientBase):
         url = self.object_url('node', node, 'metadata', label)
         return self.check_response(self.httpClient.request('DELETE', url))
 
-    @check_reserved_chars()
-    def show_console(self, node):
-        """Display console log for <node> """
+    @check_reserved_chars(dont_check=['offset', 'tail'])
+    def show_console(self, node, offset=None, tail=None):
+        """Display console log for <node>
+
+        If `offset` is given, only the log after that byte offset is
+        returned; if `tail` is given, at most that many bytes from the end
+        of the log are returned.
+        """
+        return self.read_console(node, offset, tail)[0]
+
+    @check_reserved_chars(dont_check=['offset', 'tail'])
+    def read_console(self, node, offset=None, tail=None):
+        """Read console log for <node>, for following it as it grows
+
+        Returns a pair of the log (as for `show_console`) and the offset to
+        pass as `offset` next time to read only what was logged since.
+        """
         url = self.object_url('node', node, 'console')
-        response = self.httpClient.request('GET', url)
+        params = {}
+        if offset is not None:
+            params['offset'] = offset
+        if tail is not None:
+            params['tail'] = tail
+        response = self.httpClient.request('GET', url, params=params)
         # we don't call check_response here because we want to return the
         # raw byte stream, rather than converting it to json.
         if 200 <= response.status_code < 300:
-            return response.content
+            return (response.content,
+                    int(response.headers['X-Console-Offset']))
         raise FailedAPICallException(error_type=response.status_code,
                                      message=response.content)
 
@@ -165,7 +206,46 @@ class Node(ClientBase):
         url = self.object_url('node', node, 'console')
         return self.check_response(self.httpClient.request('DELETE', url))
 
-    def show_networking_action(self, status_id):
-        """Returns the status of the networking action"""
-        url = self.object_url('networking_action', status_id)
+    def list_consoles(self):
+        """List the nodes whose consoles are being logged"""
+        url = self.object_url('consoles')
         return self.check_response(self.httpClient.request('GET', url))
+
+    def show_networking_action(self, status_id, wait=None):
+        """Returns the status of the networking action
+
+        If `wait` is given, block for up to that many seconds for the
+        action to finish.
+        """
+        url = self.object_url('networking_action', status_id)
+        params = None
+        if wait is not None:
+            params = {'wait': wait}
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def show_networking_actions(self, status_ids, wait=None):
+        """Returns the status of several networking actions.
+
+        If `wait` is given, block for up to that many seconds for all of the
+        actions to finish.
+        """
+        url = self.object_url('networking_actions')
+        params = {'status_ids': ','.join(status_ids)}
+        if wait is not None:
+            params['wait'] = wait
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def show_obm_action(self, status_id, wait=None):
+        """Returns the status of an OBM action, e.g. a power cycle
+
+        If `wait` is given, block for up to that many seconds for the
+        action to finish.
+        """
+        url = self.object_url('obm_action', status_id)
+        params = None
+        if wait is not None:
+            params = {'wait': wait}
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
@@ -75,3 +75,31 @@ class User(ClientBase):
         return self.check_response(
                 self.httpClient.request("PATCH", url, data=payload)
                 )
+
+    def create_token(self, ttl=None, project=None, admin=None):
+        """Issue an api token for the authenticated user.
+
+        <ttl> is the token's lifetime in seconds; if <project> is given,
+        the token only grants access to that project, and if <admin> is
+        True, it grants admin access. Returns a dictionary with the
+        token's 'id', the 'token' itself and its 'expires' time.
+        """
+        url = self.object_url('auth/token')
+        payload = {}
+        if ttl is not None:
+            payload['ttl'] = ttl
+        if project is not None:
+            payload['project'] = project
+        if admin is not None:
+            payload['admin'] = admin
+        return self.check_response(
+                self.httpClient.request("POST", url,
+                                        data=json.dumps(payload))
+                )
+
+    def revoke_token(self, token_id):
+        """Revoke the api token with id <token_id>."""
+        url = self.object_url('auth/token', str(token_id))
+        return self.check_response(
+                self.httpClient.request("DELETE", url)
+                )
@@ -1,7 +1,9 @@
 """Implement the hil-admin command."""
-from hil import config, model, deferred, server, migrations, rest
+from hil import config, model, deferred, events, server, migrations, \
+    rest, prefork, obm_jobs, console_supervisor
 from hil.commands import db
 from hil.commands.migrate_ipmi_info import MigrateIpmiInfo
+from hil.commands.inventory import ImportInventory
 from hil.commands.util import ensure_not_root
 from hil.flaskapp import app
 from time import sleep
@@ -9,6 +11,7 @@ from flask_script import Manager, Command, Option
 
 import sys
 import logging
+from multiprocessing import cpu_count
 from click import IntRange
 manager = Manager(app)
 
@@ -45,9 +48,60 @@ class ServeNetworks(Command):
             # loop.
             while deferred.apply_networking():
                 pass
+            events.prune()
+            model.db.session.commit()
+            # Remove old actions a batch at a time, so as not to hold up
+            # new ones:
+            deferred.compact_journal(max_batches=1)
             sleep(sleep_time)
 
 
+class ServeObm(Command):
+    """Start the HIL OBM server.
+
+    This carries out the out of band management operations (power cycling
+    nodes etc.) queued by the api server. Only one should be run at a time.
+    """
+
+    # pylint: disable=arguments-differ
+    def run(self):
+        server.init()
+        server.register_drivers()
+        migrations.check_db_schema()
+        if obm_jobs.workers() == 0:
+            sys.exit("Error: workers is 0 in the [obm] section of hil.cfg, "
+                     "so the api server carries out OBM operations itself.")
+        obm_jobs.Server().serve()
+
+
+class ServeConsoles(Command):
+    """Start the HIL console supervisor.
+
+    This runs the processes which log node consoles, as the api server
+    asks it to. Only one should be run at a time, on the same host as the
+    api server.
+    """
+
+    # pylint: disable=arguments-differ
+    def run(self):
+        console_supervisor.Supervisor().serve()
+
+
+class CompactNetworkingActions(Command):
+    """Remove old finished actions from the networking journal.
+
+    serve-networks does this gradually as it runs; this removes every action
+    older than the action_retention set in the [network-daemon] section of
+    hil.cfg at once, e.g. to catch up after an upgrade.
+    """
+
+    # pylint: disable=arguments-differ
+    def run(self):
+        server.init()
+        migrations.check_db_schema()
+        print('Removed %d networking actions.' % deferred.compact_journal())
+
+
 class RunDevelopmentServer(Command):
     """Run a development api server. Don't use this in production.
     Specify the port with -p or --port otherwise defaults to 5000"""
@@ -69,10 +123,61 @@ class RunDevelopmentServer(Command):
         from hil import api
         server.init()
         migrations.check_db_schema()
-        server.stop_orphan_consoles()
         rest.serve(port, debug=debug)
 
 
+class ServeApi(Command):
+    """Run the api server, for production use.
+
+    This runs a pre-forking server: the api server is initialized once, and
+    then forked into --workers processes, each of which handles requests
+    with --threads threads. Unless pool_size is set in the [database]
+    section of hil.cfg, each worker's database connection pool is sized to
+    its number of threads. The server shuts down gracefully on SIGTERM or
+    SIGINT, giving requests in progress --graceful-timeout seconds to finish.
+
+    Note that each open event stream (see the stream_events api call)
+    occupies a thread for as long as it is open, as does each client
+    following a console (see follow_console). Unless max_followers is set
+    in the [console] section of hil.cfg, each worker lets at most --threads
+    minus one clients follow consoles at once, leaving a thread for other
+    requests.
+    """
+
+    option_list = (
+        Option('--host', dest='host', default='127.0.0.1'),
+        Option('--port', '-p', dest='port',
+               type=IntRange(0, 2**16-1), default=5000),
+        Option('--workers', '-w', dest='workers',
+               type=IntRange(1), default=cpu_count()),
+        Option('--threads', '-t', dest='threads',
+               type=IntRange(1), default=4),
+        Option('--graceful-timeout', dest='graceful_timeout',
+               type=IntRange(0), default=30),
+    )
+
+    # pylint: disable=arguments-differ
+    def run(self, host, port, workers, threads, graceful_timeout):
+        # pylint: disable=too-many-arguments
+        if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') \
+                and not config.cfg.has_option('database', 'pool_size'):
+            app.config.update(SQLALCHEMY_POOL_SIZE=threads)
+        app.config.update(HIL_API_THREADS=threads)
+        # As with run-dev-server, importing api registers the api calls:
+        # pylint: disable=unused-variable
+        from hil import api
+        server.init()
+        migrations.check_db_schema()
+        # Don't share the connections we've made with the workers:
+        model.db.engine.dispose()
+        prefork.PreforkServer(app,
+                              host=host,
+                              port=port,
+                              workers=workers,
+                              threads=threads,
+                              graceful_timeout=graceful_timeout).run()
+
+
 class CreateAdminUser(Command):
     """Create an admin user. Only valid for the database auth backend.
 
@@ -103,8 +208,13 @@ class CreateAdminUser(Command):
 manager.add_command('db', db.command)
 manager.add_command('migrate-ipmi-info', MigrateIpmiInfo())
 manager.add_command('serve-networks', ServeNetworks())
+manager.add_command('serve-obm', ServeObm())
+manager.add_command('serve-consoles', ServeConsoles())
+manager.add_command('compact-networking-actions', CompactNetworkingActions())
 manager.add_command('run-dev-server', RunDevelopmentServer())
+manager.add_command('serve-api', ServeApi())
 manager.add_command('create-admin-user', CreateAdminUser())
+manager.add_command('import-inventory', ImportInventory())
 
 
 def main():
@@ -0,0 +1,28 @@
+"""Implement the ``hil-admin import-inventory`` subcommand."""
+
+import json
+
+from flask_script import Command, Option
+
+from hil import server, inventory
+from hil.flaskapp import app
+from hil import model
+
+
+class ImportInventory(Command):
+    """Load an inventory snapshot into the database.
+
+    The snapshot should be a file of newline-delimited JSON, as returned by
+    the ``export_inventory`` API call.
+    """
+
+    option_list = (Option('filename'),)
+
+    # pylint: disable=arguments-differ
+    def run(self, filename):
+        server.init()
+        with app.app_context():
+            with open(filename) as f:
+                inventory.import_records(json.loads(line)
+                                         for line in f if line.strip())
+            model.db.session.commit()
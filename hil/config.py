@@ -36,6 +36,11 @@ def string_is_db_uri(option):
                Or('postgresql', 'sqlite')).validate(option)
 
 
+def string_is_nonnegative_int(option):
+    """Check if a string is a valid non-negative integer"""
+    return option.isdigit()
+
+
 def string_is_dir(option):
     """Check if a string is a valid directory path"""
     return Use(os.path.isabs).validate(option)
@@ -75,9 +80,17 @@ core_schema = {
     },
     'database': {
         'uri': string_is_db_uri,
+        Optional('replica_uri'): string_is_db_uri,
+        Optional('pool_size'): string_is_nonnegative_int,
+        Optional('max_overflow'): string_is_nonnegative_int,
+        Optional('pool_timeout'): string_is_nonnegative_int,
+        Optional('pool_recycle'): string_is_nonnegative_int,
+        Optional('pool_pre_ping'): string_is_bool,
+        Optional('statement_timeout'): string_is_nonnegative_int,
     },
     Optional('devel'): {
         Optional('dry_run'): string_is_bool,
+        Optional('request_stats'): string_is_bool,
     },
     Optional('maintenance'): {
         Optional('maintenance_project'): str,
@@ -86,6 +99,27 @@ core_schema = {
     },
     Optional('network-daemon'): {
         Optional('sleep_time'): int,
+        Optional('action_retention'): string_is_nonnegative_int,
+        Optional('archive_actions'): string_is_bool,
+        Optional('compaction_batch_size'): string_is_nonnegative_int,
+    },
+    Optional('obm'): {
+        Optional('workers'): string_is_nonnegative_int,
+        Optional('per_host_limit'): string_is_nonnegative_int,
+        Optional('timeout'): string_is_nonnegative_int,
+        Optional('action_retention'): string_is_nonnegative_int,
+    },
+    Optional('console'): {
+        Optional('log_dir'): string_is_dir,
+        Optional('segment_size'): And(string_is_nonnegative_int,
+                                      lambda s: int(s) > 0),
+        Optional('max_node_size'): string_is_nonnegative_int,
+        Optional('disk_budget'): string_is_nonnegative_int,
+        Optional('supervisor_socket'): string_is_dir,
+        Optional('max_followers'): string_is_nonnegative_int,
+    },
+    Optional('events'): {
+        Optional('retention'): string_is_nonnegative_int,
     },
     'extensions': {
         Optional(str): '',
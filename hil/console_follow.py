@@ -0,0 +1,326 @@
+"""Follow console logs as they grow.
+
+`follow` streams a console log (see `hil.console_logs`), and then the
+output added to it, as it is added. However many clients are following a
+log, each api server process reads the new output only once: a single
+`_Follower` thread per log reads it, and hands it to each of the log's
+`_Viewer`s.
+
+The follower waits for the log to change with inotify, where that is
+available (i.e. on Linux), and otherwise checks for new output every
+`POLL_INTERVAL` seconds.
+
+While a log is quiet, a `KEEPALIVE` byte is sent to its viewers every
+`KEEPALIVE_INTERVAL` seconds, so that clients which have gone away are
+noticed (writing to them fails) and their viewers closed. Each viewer
+occupies one of the api server's threads, so each process allows at most
+`max_followers` viewers at once.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import threading
+from Queue import Queue, Empty, Full
+
+from werkzeug.wsgi import ClosingIterator
+
+from hil import console_logs
+from hil.config import cfg
+from hil.errors import BlockedError
+from hil.flaskapp import app
+
+logger = logging.getLogger(__name__)
+
+# How often to check for new output when inotify is unavailable:
+POLL_INTERVAL = 1
+
+# How often a follower checks the log (and whether it still has viewers)
+# even if it hears of no changes:
+IDLE_TIMEOUT = 5
+
+# How many chunks of output may be waiting for a viewer; viewers which fall
+# further behind than this are disconnected:
+MAX_BACKLOG = 256
+
+# How long a viewer may go without output before it is sent a KEEPALIVE
+# byte, which clients should ignore:
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE = '\0'
+
+# The default for max_followers outside of ``hil-admin serve-api``:
+DEFAULT_MAX_FOLLOWERS = 64
+
+# inotify flags; see inotify(7):
+_IN_MODIFY = 0x2
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+except (OSError, AttributeError):
+    _libc = None
+
+
+def max_followers():
+    """Return how many clients may follow logs at once, per process.
+
+    This is the ``max_followers`` option in the ``[console]`` section of
+    ``hil.cfg``, where 0 means there is no limit, and None is returned.
+    If it is unset under ``hil-admin serve-api``, it is one less than the
+    number of threads each worker has, so that one is always left for
+    other requests.
+    """
+    if cfg.has_option('console', 'max_followers'):
+        return cfg.getint('console', 'max_followers') or None
+    threads = app.config.get('HIL_API_THREADS')
+    if threads is not None:
+        return threads - 1
+    return DEFAULT_MAX_FOLLOWERS
+
+
+class _Watcher(object):
+    """Waits for changes to the directory `path`."""
+
+    def __init__(self, path):
+        self.fd = None
+        if _libc is None:
+            return
+        fd = _inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return
+        mask = _IN_MODIFY | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | \
+            _IN_DELETE_SELF | _IN_MOVE_SELF
+        if _inotify_add_watch(fd, path, mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout):
+        """Wait for up to `timeout` seconds for a change.
+
+        This may return early without a change, e.g. if inotify is
+        unavailable.
+        """
+        if self.fd is None:
+            select.select([], [], [], min(timeout, POLL_INTERVAL))
+            return
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except OSError:
+                # No more events to read.
+                pass
+
+    def close(self):
+        """Stop watching the directory."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _Viewer(object):
+    """A client following a log.
+
+    Output is handed to the viewer by the log's `_Follower` as ``(start,
+    data)`` pairs, where `data` is the raw output starting at offset
+    `start`. None is handed over when the log ends.
+
+    Raises a `BlockedError` if ``max_followers`` viewers already exist.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = Queue(MAX_BACKLOG)
+        with _lock:
+            limit = max_followers()
+            viewers = sum(len(follower.viewers)
+                          for follower in _followers.values())
+            if limit is not None and viewers >= limit:
+                raise BlockedError('Too many clients are following consoles;'
+                                   ' try again later.')
+            self.follower = _followers.get(name)
+            if self.follower is None:
+                self.follower = _Follower(name)
+                _followers[name] = self.follower
+                self.follower.viewers.add(self)
+                self.follower.start()
+            else:
+                self.follower.viewers.add(self)
+
+    def put(self, item):
+        """Hand `item` to the viewer.
+
+        Returns False, having handed the viewer None instead, if the viewer
+        has fallen too far behind.
+        """
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            # Make room for the end of the log:
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+    def get(self, timeout=None):
+        """Return the next item handed to the viewer.
+
+        Raises `Queue.Empty` if there is none within `timeout` seconds.
+        """
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        """Stop following the log.
+
+        If this was the follower's last viewer, it is unregistered straight
+        away; its thread exits when it next wakes up.
+        """
+        with _lock:
+            self.follower.viewers.discard(self)
+            if not self.follower.viewers and \
+                    _followers.get(self.name) is self.follower:
+                del _followers[self.name]
+
+
+class _Follower(object):
+    """Reads the new output of the log `name`, and hands it to `viewers`.
+
+    The follower exits once the log ends (i.e. it is deleted, or started
+    again), or it finds it has no viewers left.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.viewers = set()
+        # The offset of the end of the output read so far; set straight
+        # away, so that viewers can count on getting all the output added
+        # after they were created:
+        log = console_logs.read(name)
+        self.offset = 0 if log is None else log[0]
+        self.thread = threading.Thread(target=self._run,
+                                       name='hil-console-follower')
+        self.thread.daemon = True
+
+    def start(self):
+        """Start following the log."""
+        self.thread.start()
+
+    def _viewers(self, ended):
+        """Return the current viewers.
+
+        If the log has `ended`, or there are no viewers left, the follower
+        is unregistered, so that any new viewers start a new one.
+        """
+        with _lock:
+            viewers = list(self.viewers)
+            if (ended or not viewers) and \
+                    _followers.get(self.name) is self:
+                del _followers[self.name]
+            return viewers
+
+    def _read(self):
+        """Read the output added since the last call.
+
+        Returns the output, or None if the log has ended.
+        """
+        log = console_logs.read(self.name, self.offset, raw=True)
+        if log is None or log[0] < self.offset:
+            return None
+        end, chunks = log
+        data = ''.join(chunks)
+        self.offset = end
+        return data
+
+    def _run(self):
+        """Hand new output to the viewers, until the follower exits."""
+        watcher = _Watcher(self.name)
+        try:
+            while True:
+                start = self.offset
+                data = self._read()
+                viewers = self._viewers(ended=data is None)
+                for viewer in viewers:
+                    if data is None:
+                        viewer.put(None)
+                    elif data and not viewer.put((start, data)):
+                        viewer.close()
+                if data is None or not viewers:
+                    return
+                watcher.wait(IDLE_TIMEOUT)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Error following console log %s', self.name)
+            for viewer in self._viewers(ended=True):
+                viewer.put(None)
+        finally:
+            watcher.close()
+
+
+# Map from log names to their `_Follower`s, and a lock protecting it, and
+# their viewers:
+_followers = {}
+_lock = threading.Lock()
+
+
+def follow(name, offset=None, tail=None):
+    """Follow the console log `name`.
+
+    `offset` and `tail` select where to start, as for
+    `console_logs.read`. Returns None if the log doesn't exist. Otherwise,
+    returns an iterator over the (filtered) contents of the log, which
+    carries on with the output added to the log as it is added. It ends
+    when the log is deleted or started again, or if the caller falls too
+    far behind. Raises a `BlockedError` if too many clients are following
+    logs already; see `max_followers`.
+    """
+    # The viewer is created first, so that no output is missed between
+    # reading what's already there and following what is added:
+    viewer = _Viewer(name)
+    log = console_logs.read(name, offset, tail)
+    if log is None:
+        viewer.close()
+        return None
+    end, chunks = log
+    # Closing a generator which was never started doesn't run its finally
+    # clause, so the viewer is closed explicitly too (closing it twice is
+    # harmless):
+    return ClosingIterator(_stream(viewer, end, chunks), viewer.close)
+
+
+def _stream(viewer, position, chunks):
+    """Yield `chunks`, and then the output handed to `viewer`.
+
+    `position` is the offset of the end of `chunks`; output the viewer is
+    handed from before it is skipped. A `KEEPALIVE` is yielded whenever
+    the viewer is handed nothing for `KEEPALIVE_INTERVAL` seconds.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+        while True:
+            try:
+                item = viewer.get(timeout=KEEPALIVE_INTERVAL)
+            except Empty:
+                yield KEEPALIVE
+                continue
+            if item is None:
+                return
+            start, data = item
+            end = start + len(data)
+            if end <= position:
+                continue
+            yield console_logs.filter_ascii(data[max(position - start, 0):])
+            position = end
+    finally:
+        viewer.close()
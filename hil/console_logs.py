@@ -0,0 +1,367 @@
+"""Writing and reading node console logs.
+
+OBM drivers which log a node's console (e.g. `hil.ext.obm.ipmi`) have the
+console supervisor (`hil.console_supervisor`) write the console output with
+a `Writer`, and use `read` to implement `model.Obm.get_console` (and
+`hil.console_follow` to implement `model.Obm.follow_console`).
+
+A log is kept in a directory of its own, as a series of *segments*. Output
+is appended to the newest segment until it reaches ``segment_size``
+bytes, at which point a new segment is started and the old one compressed.
+The oldest segments are removed when a log's segments take up more than
+``max_node_size`` bytes on disk, or when the logs of all nodes together
+take up more than ``disk_budget``. The settings are in the ``[console]``
+section of ``hil.cfg``.
+
+Positions in a log are byte offsets into the output as written, counted
+from the start of logging; each segment is named after the offset of its
+first byte. Offsets don't change when segments are compressed or removed,
+so `read` can read across segments, and a client following a log can
+carry on from where it left off. Non-ASCII bytes are left out of what is
+returned (they are usually line noise from the serial console), but still
+count towards offsets.
+"""
+
+import errno
+import gzip
+import os
+import re
+import shutil
+
+from hil.config import cfg
+
+DEFAULT_LOG_DIR = '/var/run/hil_console_logs'
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+DEFAULT_MAX_NODE_SIZE = 16 * 1024 * 1024
+DEFAULT_DISK_BUDGET = 0
+
+# How many bytes of the log to read at a time:
+CHUNK_SIZE = 64 * 1024
+
+# The bytes removed from console output:
+_NON_ASCII = bytes(bytearray(range(128, 256)))
+
+# The names of segment files; the number is the segment's starting offset:
+_SEGMENT_NAME = re.compile(r'^(\d+)(\.gz)?$')
+
+
+def log_dir():
+    """Return the directory in which console logs are kept."""
+    if cfg.has_option('console', 'log_dir'):
+        return cfg.get('console', 'log_dir')
+    return DEFAULT_LOG_DIR
+
+
+def segment_size():
+    """Return the size (in bytes) at which a new segment is started."""
+    if cfg.has_option('console', 'segment_size'):
+        return cfg.getint('console', 'segment_size')
+    return DEFAULT_SEGMENT_SIZE
+
+
+def max_node_size():
+    """Return how many bytes of disk a single node's log may use.
+
+    0 means there is no limit.
+    """
+    if cfg.has_option('console', 'max_node_size'):
+        return cfg.getint('console', 'max_node_size')
+    return DEFAULT_MAX_NODE_SIZE
+
+
+def disk_budget():
+    """Return how many bytes of disk the logs of all nodes may use.
+
+    0 means there is no limit.
+    """
+    if cfg.has_option('console', 'disk_budget'):
+        return cfg.getint('console', 'disk_budget')
+    return DEFAULT_DISK_BUDGET
+
+
+def filter_ascii(data):
+    """Return `data` (a byte string) with any non-ASCII bytes removed."""
+    return data.translate(None, _NON_ASCII)
+
+
+def start_offset(end, offset=None, tail=None, first=0):
+    """Return where to start reading a log whose output ends at `end`.
+
+    `first` is the offset of the oldest output still kept. Reading starts
+    at `offset` (or at `first`, if `offset` is None or was removed), or
+    `tail` bytes before the end of the log, whichever is later. If `offset`
+    is beyond the end of the log, the log must have been deleted and
+    started again since the caller last read it, so reading starts from
+    the beginning.
+    """
+    if offset is None or offset > end:
+        offset = first
+    offset = max(offset, first)
+    if tail is not None:
+        offset = max(offset, end - tail)
+    return offset
+
+
+def _segments(name):
+    """Return the segments of the log `name`, oldest first.
+
+    Returns a list of ``(start, path)`` pairs. A segment which is being
+    compressed has both a compressed and an uncompressed file; the latter
+    is returned. A log from before logs were split into segments is a
+    plain file, which is treated as a single segment.
+    """
+    if os.path.isfile(name):
+        return [(0, name)]
+    try:
+        entries = os.listdir(name)
+    except OSError:
+        return []
+    found = {}
+    for entry in entries:
+        match = _SEGMENT_NAME.match(entry)
+        if match is None:
+            continue
+        start = int(match.group(1))
+        if start not in found or not match.group(2):
+            found[start] = os.path.join(name, entry)
+    return sorted(found.items())
+
+
+def _open(path):
+    """Open the segment file `path` for reading."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read(name, offset=None, tail=None, raw=False):
+    """Read the console log `name`.
+
+    `offset` and `tail` select the part of the log to read, as described
+    in `start_offset`. Returns None if the log doesn't exist. Otherwise,
+    returns a pair ``(end, chunks)``, where `chunks` is an iterator over
+    the (filtered, unless `raw` is True) contents of the log from the
+    starting offset up to `end`. `end` is the offset of the end of the log
+    when it was opened; anything written after that is left for the next
+    read, which should pass `end` as its `offset`.
+    """
+    while True:
+        segments = _segments(name)
+        if not segments:
+            return None
+        files = []
+        try:
+            # The newest segment is opened first, so that it is certain to
+            # be the one that the end of the log is in:
+            last_start, path = segments[-1]
+            files.append(_open(path))
+            end = last_start + os.fstat(files[0].fileno()).st_size
+            start = start_offset(end, offset, tail, segments[0][0])
+            pieces = [(files[0], max(start, last_start), end, last_start)]
+            for (seg_start, path), (seg_end, _) in reversed(
+                    zip(segments, segments[1:])):
+                if seg_end <= start:
+                    break
+                files.append(_open(path))
+                pieces.insert(0, (files[-1], max(start, seg_start),
+                                  seg_end, seg_start))
+        except IOError as e:
+            for f in files:
+                f.close()
+            if e.errno != errno.ENOENT:
+                raise
+            # A segment was compressed or removed after we listed them:
+            continue
+        return end, _chunks(pieces, files, raw)
+
+
+def _chunks(pieces, files, raw):
+    """Yield the contents of `pieces`, a chunk at a time.
+
+    Each piece is a tuple ``(file, start, end, file_start)``, giving the
+    offsets to read between and the offset of the start of the file. The
+    chunks are filtered unless `raw` is True. `files` are closed once the
+    chunks are exhausted, or the iterator is closed.
+    """
+    try:
+        for f, start, end, file_start in pieces:
+            f.seek(start - file_start)
+            length = end - start
+            while length > 0:
+                data = f.read(min(length, CHUNK_SIZE))
+                if not data:
+                    break
+                length -= len(data)
+                yield data if raw else filter_ascii(data)
+    finally:
+        for f in files:
+            f.close()
+
+
+def create(name):
+    """Create the console log `name`, empty, unless it already exists.
+
+    A log from before logs were split into segments is turned into a log
+    with one segment.
+    """
+    if os.path.isfile(name):
+        _migrate(name)
+    try:
+        os.makedirs(name)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if not _segments(name):
+        open(os.path.join(name, '0'), 'ab').close()
+
+
+def delete(name):
+    """Delete the console log `name`."""
+    if os.path.isfile(name):
+        # A log from before logs were split into segments:
+        os.remove(name)
+    shutil.rmtree(name, ignore_errors=True)
+
+
+def _migrate(name):
+    """Turn the plain file log `name` into a log with one segment.
+
+    Logs written before logs were split into segments are plain files;
+    the file becomes the log's first segment.
+    """
+    tmp = name + '.migrating'
+    os.rename(name, tmp)
+    os.makedirs(name)
+    os.rename(tmp, os.path.join(name, '0'))
+
+
+def _remove_segment(name, start):
+    """Remove the segment of log `name` starting at `start`."""
+    for path in ('%d' % start, '%d.gz' % start):
+        try:
+            os.remove(os.path.join(name, path))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def _compress(path):
+    """Compress the segment file `path`, replacing it with a ``.gz`` file."""
+    tmp = path + '.gz.tmp'
+    with open(path, 'rb') as src:
+        dest = gzip.open(tmp, 'wb')
+        try:
+            shutil.copyfileobj(src, dest, CHUNK_SIZE)
+        finally:
+            dest.close()
+    os.rename(tmp, path + '.gz')
+    os.remove(path)
+
+
+def _disk_usage(segments):
+    """Return a list of ``(start, size)`` for `segments`, as on disk."""
+    result = []
+    for start, path in segments:
+        try:
+            result.append((start, os.path.getsize(path)))
+        except OSError:
+            pass
+    return result
+
+
+def enforce_limits(name):
+    """Remove old segments, to keep logs within their limits.
+
+    The oldest segments of the log `name` are removed while it takes up
+    more than ``max_node_size`` bytes, and then the oldest segments of all
+    logs are removed while they take up more than ``disk_budget``. The
+    newest segment of a log is never removed, as it is being written to.
+    """
+    limit = max_node_size()
+    if limit:
+        usage = _disk_usage(_segments(name))
+        total = sum(size for _, size in usage)
+        for start, size in usage[:-1]:
+            if total <= limit:
+                break
+            _remove_segment(name, start)
+            total -= size
+    budget = disk_budget()
+    if budget:
+        _enforce_budget(os.path.dirname(name), budget)
+
+
+def _enforce_budget(directory, budget):
+    """Remove the oldest segments in `directory` to fit within `budget`."""
+    total = 0
+    candidates = []
+    for entry in os.listdir(directory):
+        log = os.path.join(directory, entry)
+        segments = _segments(log)
+        for i, (start, path) in enumerate(segments):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if i < len(segments) - 1:
+                candidates.append((stat.st_mtime, log, start, stat.st_size))
+    candidates.sort()
+    for _, log, start, size in candidates:
+        if total <= budget:
+            break
+        _remove_segment(log, start)
+        total -= size
+
+
+class Writer(object):
+    """Writes output to the console log `name`, starting new segments as
+    the log grows.
+
+    If the log already exists, output is added to the end of it. Only one
+    writer should write to a log at a time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        create(name)
+        start, path = _segments(name)[-1]
+        if path.endswith('.gz'):
+            # The last segment is normally left uncompressed; if it wasn't,
+            # carry on in a new one after it:
+            with _open(path) as f:
+                while True:
+                    data = f.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    start += len(data)
+        self._start_segment(start)
+
+    def _start_segment(self, start):
+        """Start writing to the segment beginning at offset `start`."""
+        self.start = start
+        self.file = open(os.path.join(self.name, '%d' % start), 'ab')
+        self.size = os.fstat(self.file.fileno()).st_size
+
+    def write(self, data):
+        """Add `data` to the end of the log.
+
+        The data is flushed to disk straight away, so that readers see it.
+        """
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        if self.size >= segment_size():
+            self.rotate()
+
+    def rotate(self):
+        """Start a new segment, compressing the current one."""
+        old = self.file.name
+        self.file.close()
+        self._start_segment(self.start + self.size)
+        _compress(old)
+        enforce_limits(self.name)
+
+    def close(self):
+        """Stop writing the log."""
+        self.file.close()
@@ -0,0 +1,353 @@
+"""Supervise the processes which log node consoles.
+
+Logging a node's console takes a long-running process per node (e.g.
+``ipmitool sol activate``). Rather than the api server starting these and
+leaving them to their own devices, they are all run by the console
+supervisor (``hil-admin serve-consoles``; see `Supervisor`). It writes
+their output to the nodes' console logs (see `hil.console_logs`), and
+starts them again when they die.
+
+OBM drivers ask the supervisor to start and stop logging with `start` and
+`stop`, and `status` reports on the consoles being logged. These talk to
+the supervisor over a unix socket, whose path is the ``supervisor_socket``
+option in the ``[console]`` section of ``hil.cfg``. Each request and
+response is a JSON object on a line of its own.
+
+The supervisor only keeps track of consoles while it is running; when it
+is stopped, so is console logging, and the consoles must be started again
+with the api.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from subprocess import Popen, PIPE
+
+from hil import console_logs
+from hil.config import cfg
+from hil.errors import OBMError
+
+logger = logging.getLogger(__name__)
+
+# How long to wait before starting a process which died, the first time it
+# dies. The delay doubles each time it dies again soon after being started,
+# up to MAX_RESTART_DELAY:
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+# How long to wait for the supervisor to answer a request:
+REQUEST_TIMEOUT = 30
+
+# How long a console's stop command may run before it is killed:
+STOP_COMMAND_TIMEOUT = 30
+
+
+class _Unreachable(OBMError):
+    """The supervisor isn't running (or its socket is missing)."""
+
+
+def socket_path():
+    """Return the path of the supervisor's socket."""
+    if cfg.has_option('console', 'supervisor_socket'):
+        return cfg.get('console', 'supervisor_socket')
+    return os.path.join(console_logs.log_dir(), 'supervisor.sock')
+
+
+def _call(request):
+    """Send `request` to the supervisor, and return its response.
+
+    Raises an `OBMError` if the supervisor can't be reached, or reports an
+    error.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(REQUEST_TIMEOUT)
+        try:
+            sock.connect(socket_path())
+        except socket.error as e:
+            raise _Unreachable('Could not reach the console supervisor: %s'
+                               % e)
+        sock.sendall(json.dumps(request) + '\n')
+        response = sock.makefile().readline()
+    except socket.error as e:
+        logger.error('Error talking to the console supervisor: %s', e)
+        raise OBMError('Could not reach the console supervisor')
+    finally:
+        sock.close()
+    if not response:
+        raise OBMError('The console supervisor did not respond')
+    response = json.loads(response)
+    if 'error' in response:
+        raise OBMError(response['error'])
+    return response
+
+
+def start(log_name, command, stop_command=None):
+    """Start logging the output of `command` to the console log `log_name`.
+
+    `command` is run (as a list of arguments, like `subprocess.Popen`
+    takes) until `stop` is called, and started again whenever it exits. If
+    `stop_command` is given, it is run before each time `command` is
+    started, and after it is stopped; it should clean up anything a
+    previous run may have left behind (e.g. a SOL session still active on
+    the BMC).
+
+    If the console is already being logged with the same commands, this
+    does nothing.
+    """
+    _call({'op': 'start',
+           'log_name': log_name,
+           'command': command,
+           'stop_command': stop_command})
+
+
+def stop(log_name):
+    """Stop logging to the console log `log_name`.
+
+    The log itself is left alone. If the supervisor isn't running, no
+    consoles are being logged, so a warning is logged and nothing else is
+    done.
+    """
+    try:
+        _call({'op': 'stop', 'log_name': log_name})
+    except _Unreachable as e:
+        logger.warning('%s; assuming %s is not being logged',
+                       e.description, log_name)
+
+
+def status():
+    """Report on the consoles being logged.
+
+    Returns a dictionary mapping the names of the logs to dictionaries
+    with the keys:
+
+    * ``running``: whether the console's process is running, rather than
+      waiting to be started again.
+    * ``restarts``: how many times the process has been started again.
+    """
+    return _call({'op': 'status'})['sessions']
+
+
+class _Session(object):
+    """A console being logged by the supervisor."""
+
+    def __init__(self, log_name, command, stop_command, previous=None):
+        self.log_name = log_name
+        self.command = command
+        self.stop_command = stop_command
+        # A session logging the same console, which is being stopped; this
+        # one waits for it before writing to the log:
+        self.previous = previous
+        self.restarts = 0
+        self.proc = None
+        # Whether `proc` is running (and hasn't been waited for):
+        self.running = False
+        self.stopping = threading.Event()
+        # Held while starting, stopping or waiting for `proc`:
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run,
+                                       name='hil-console')
+        self.thread.daemon = True
+
+    def _clean_up(self):
+        """Run the stop command, if any.
+
+        It is killed if it takes longer than STOP_COMMAND_TIMEOUT.
+        """
+        if not self.stop_command:
+            return
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                proc = Popen(self.stop_command, stdin=devnull,
+                             stdout=devnull, stderr=devnull)
+        except OSError as e:
+            logger.error('Could not run %s: %s', self.stop_command[0], e)
+            return
+        deadline = time.time() + STOP_COMMAND_TIMEOUT
+        while proc.poll() is None:
+            if time.time() > deadline:
+                logger.warning('Stop command for %s timed out; killing it',
+                               self.log_name)
+                proc.kill()
+                proc.wait()
+                return
+            time.sleep(0.1)
+
+    def _spawn(self):
+        """Start the console's process, returning None if that fails."""
+        try:
+            # stdin is a pipe which is never written, as ipmitool garbles
+            # its output when stdin is a terminal.
+            with open(os.devnull, 'w') as devnull:
+                return Popen(self.command, stdin=PIPE, stdout=PIPE,
+                             stderr=devnull)
+        except OSError as e:
+            logger.error('Could not run %s: %s', self.command[0], e)
+            return None
+
+    def _run(self):
+        """Run the console's process, until the session is stopped."""
+        if self.previous is not None:
+            self.previous.thread.join()
+            self.previous = None
+        writer = console_logs.Writer(self.log_name)
+        delay = RESTART_DELAY
+        try:
+            while True:
+                self._clean_up()
+                with self.lock:
+                    if self.stopping.is_set():
+                        return
+                    self.proc = self._spawn()
+                    self.running = self.proc is not None
+                started = time.time()
+                if self.proc is None:
+                    outcome = 'could not be started'
+                else:
+                    while True:
+                        data = os.read(self.proc.stdout.fileno(),
+                                       console_logs.CHUNK_SIZE)
+                        if not data:
+                            break
+                        writer.write(data)
+                    with self.lock:
+                        returncode = self.proc.wait()
+                        self.running = False
+                    outcome = 'exited with status %d' % returncode
+                    self.proc.stdin.close()
+                    self.proc.stdout.close()
+                if self.stopping.is_set():
+                    return
+                if time.time() - started > MAX_RESTART_DELAY:
+                    delay = RESTART_DELAY
+                logger.warning('Console process for %s %s; restarting it in '
+                               '%g seconds', self.log_name, outcome, delay)
+                self.restarts += 1
+                if self.stopping.wait(delay):
+                    return
+                delay = min(delay * 2, MAX_RESTART_DELAY)
+        finally:
+            writer.close()
+            self._clean_up()
+
+    def start(self):
+        """Start logging."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop logging, and wait for the process to exit."""
+        with self.lock:
+            self.stopping.set()
+            if self.running:
+                self.proc.terminate()
+        self.thread.join()
+
+    def status(self):
+        """Return the status of the session, as reported by `status`."""
+        return {'running': self.running, 'restarts': self.restarts}
+
+
+class Supervisor(object):
+    """The console supervisor, which runs console logging processes.
+
+    There should only be one of these running at once.
+    """
+
+    def __init__(self):
+        self.path = socket_path()
+        # Map from log names to `_Session`s:
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def handle(self, request):
+        """Carry out `request`, and return the response.
+
+        See `start`, `stop` and `status` for the requests.
+        """
+        op = request.get('op')
+        if op == 'status':
+            with self.lock:
+                return {'sessions': dict(
+                    (name, session.status())
+                    for name, session in self.sessions.items())}
+        if op not in ('start', 'stop'):
+            return {'error': 'Unknown request: %r' % op}
+        log_name = request['log_name']
+        with self.lock:
+            old = self.sessions.pop(log_name, None)
+            if op == 'start' and old is not None \
+                    and old.command == request['command'] \
+                    and old.stop_command == request['stop_command']:
+                self.sessions[log_name] = old
+                return {}
+            if op == 'start':
+                # Create the log before answering, so that it can be read
+                # as soon as the caller hears it has been started:
+                console_logs.create(log_name)
+                session = _Session(log_name,
+                                   request['command'],
+                                   request['stop_command'],
+                                   previous=old)
+                self.sessions[log_name] = session
+                session.start()
+        # Stopping a session can take a while (its stop command talks to
+        # the BMC), so it is done without holding up other requests:
+        if old is not None:
+            old.stop()
+        return {}
+
+    def _serve_connection(self, conn):
+        """Answer the requests sent over the connection `conn`."""
+        try:
+            for line in conn.makefile():
+                try:
+                    response = self.handle(json.loads(line))
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Error handling console request')
+                    response = {'error': 'Internal error'}
+                conn.sendall(json.dumps(response) + '\n')
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def stop_all(self):
+        """Stop logging all consoles."""
+        with self.lock:
+            sessions = self.sessions.values()
+            self.sessions = {}
+        for session in sessions:
+            session.stop()
+
+    def serve(self):
+        """Answer requests, forever."""
+        # The socket is set up under a temporary name, and then moved into
+        # place (replacing any left by a previous supervisor), so that it
+        # only appears once it is ready for connections:
+        tmp = self.path + '.tmp'
+        try:
+            os.remove(tmp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(tmp)
+        # Only HIL itself may start consoles:
+        os.chmod(tmp, 0o600)
+        listener.listen(16)
+        os.rename(tmp, self.path)
+        try:
+            while True:
+                conn, _ = listener.accept()
+                thread = threading.Thread(target=self._serve_connection,
+                                          args=(conn,),
+                                          name='hil-console-request')
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+            self.stop_all()
@@ -1,12 +1,49 @@
-"""Performs deferred networking actions."""
+"""Performs deferred networking actions.
 
-from hil import model
+Finished actions stay in the journal for `action_retention` seconds, so
+that their status can be queried, and are then archived or deleted by
+`compact_journal`.
+"""
+
+from datetime import datetime, timedelta
+
+from hil import model, notifications
+from hil.config import cfg
 from hil.model import db
 from hil.errors import SwitchError
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Default number of seconds for which finished actions are kept in the
+# journal (one week).
+DEFAULT_ACTION_RETENTION = 7 * 24 * 60 * 60
+
+# Default maximum number of actions `compact_journal` removes per
+# transaction.
+DEFAULT_COMPACTION_BATCH_SIZE = 1000
+
+
+def action_retention():
+    """Return the number of seconds finished actions stay in the journal."""
+    if cfg.has_option('network-daemon', 'action_retention'):
+        return cfg.getint('network-daemon', 'action_retention')
+    return DEFAULT_ACTION_RETENTION
+
+
+def archive_actions():
+    """Return whether actions removed from the journal are archived."""
+    if cfg.has_option('network-daemon', 'archive_actions'):
+        return cfg.getboolean('network-daemon', 'archive_actions')
+    return True
+
+
+def compaction_batch_size():
+    """Return the number of actions `compact_journal` removes at a time."""
+    if cfg.has_option('network-daemon', 'compaction_batch_size'):
+        return cfg.getint('network-daemon', 'compaction_batch_size')
+    return DEFAULT_COMPACTION_BATCH_SIZE
+
 
 class DaemonSession(object):
     """A daemon session tracks switch sessions during a call to
@@ -45,17 +82,17 @@ class DaemonSession(object):
                                 action.channel,
                                 network_id)
             if action.new_network is None:
-                model.NetworkAttachment.query \
-                    .filter_by(nic=action.nic, channel=action.channel)\
-                    .delete()
+                for attachment in model.NetworkAttachment.query \
+                        .filter_by(nic=action.nic, channel=action.channel):
+                    db.session.delete(attachment)
             else:
                 db.session.add(model.NetworkAttachment(
                     nic=action.nic,
                     network=action.new_network,
                     channel=action.channel))
-            action.status = 'DONE'
+            _finish(action, 'DONE')
         except SwitchError:
-            action.status = 'ERROR'
+            _finish(action, 'ERROR')
             logger.error('Modify port failed on port %s of switch %s',
                          action.nic.port.label, action.nic.port.owner.label)
 
@@ -64,10 +101,12 @@ class DaemonSession(object):
         session = self.get_session(action.nic.port.owner)
         try:
             session.revert_port(action.nic.port.label)
-            model.NetworkAttachment.query.filter_by(nic=action.nic).delete()
-            action.status = 'DONE'
+            for attachment in model.NetworkAttachment.query \
+                    .filter_by(nic=action.nic):
+                db.session.delete(attachment)
+            _finish(action, 'DONE')
         except SwitchError:
-            action.status = 'ERROR'
+            _finish(action, 'ERROR')
             logger.error('Revert port failed on port %s of switch %s',
                          action.nic.port.label, action.nic.port.owner.label)
 
@@ -88,6 +127,50 @@ class DaemonSession(object):
         self.switch_sessions = {}
 
 
+def _finish(action, status):
+    """Mark `action` as finished, with `status` ('DONE' or 'ERROR')."""
+    action.status = status
+    action.finished = datetime.utcnow()
+
+
+def remove_action(action):
+    """Remove the finished `action` from the journal.
+
+    It is moved to the archive (`model.ArchivedNetworkingAction`), unless
+    archiving is disabled, in which case it is deleted. The caller must
+    commit.
+    """
+    if archive_actions():
+        db.session.add(model.ArchivedNetworkingAction(action))
+    db.session.delete(action)
+
+
+def compact_journal(max_batches=None):
+    """Remove actions which finished more than `action_retention` ago.
+
+    Actions are removed (see `remove_action`) in batches of
+    `compaction_batch_size`, each in its own transaction, so that the
+    journal isn't locked for long. If `max_batches` is not None, at most
+    that many batches are removed. Returns the number of actions removed.
+    """
+    batch_size = compaction_batch_size()
+    cutoff = datetime.utcnow() - timedelta(seconds=action_retention())
+    removed = batches = 0
+    while batch_size > 0 and (max_batches is None or batches < max_batches):
+        actions = model.NetworkingAction.query \
+            .filter(model.NetworkingAction.finished < cutoff) \
+            .order_by(model.NetworkingAction.id) \
+            .limit(batch_size).all()
+        for action in actions:
+            remove_action(action)
+        db.session.commit()
+        removed += len(actions)
+        batches += 1
+        if len(actions) < batch_size:
+            break
+    return removed
+
+
 def apply_networking():
     """Do each networking action in the journal, then cross them off.
 
@@ -117,6 +200,8 @@ def apply_networking():
     session = DaemonSession()
     while action is not None:
         session.handle_action(action)
+        notifications.publish(model.NetworkingAction.notification_channel,
+                              action.uuid)
         db.session.commit()
         # Get the next action
         action = model.NetworkingAction.query \
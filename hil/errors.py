@@ -91,6 +91,13 @@ class BlockedError(APIError):
     status_code = 409  # Conflict
 
 
+class QuotaExceededError(APIError):
+    """An exception indicating that a project would exceed its quota of some
+    resource.
+    """
+    status_code = 409  # Conflict
+
+
 class IllegalStateError(APIError):
     """The request is invalid due to the state of the system.
 
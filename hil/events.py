@@ -0,0 +1,285 @@
+"""Record changes to HIL's state, and stream them to clients.
+
+Whenever a transaction creates or deletes a project, node, nic, network or
+network attachment, connects a node to or detaches it from a project, or
+queues or finishes a networking action, an `model.Event` row describing the
+change is written in the same transaction. Events are numbered from a
+sequence when they are written, so a client which remembers the id of the
+last event it saw can pick up where it left off. Concurrent transactions may
+commit their events out of order, so `stream` holds back the events after a
+gap in the ids until the missing ones commit (or are given up on, as their
+transaction must have rolled back). `stream` generates the events in
+the ``text/event-stream`` (server-sent events) format, blocking (via
+`hil.notifications`) while there are none.
+
+Each event is visible to administrators and to a single project (or to
+administrators only). For networks this is the network's owner; for
+everything to do with a node, it is the project the node belongs to.
+
+Events are deleted after `retention` seconds; see `prune`.
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func, inspect
+
+from hil import model, notifications
+from hil.auth import get_auth_backend
+from hil.config import cfg
+from hil.model import db
+
+# The `hil.notifications` channel on which new events are announced.
+CHANNEL = 'events'
+
+# Default number of seconds for which events are kept.
+DEFAULT_RETENTION = 24 * 60 * 60
+
+# Maximum number of events fetched from the database at a time.
+BATCH_SIZE = 100
+
+# Default number of seconds after which `stream` sends a comment, if there
+# are no new events, to keep the connection from timing out.
+KEEPALIVE_INTERVAL = 15
+
+# Default number of seconds for which `stream` holds back the events after a
+# gap in the ids, waiting for the missing events to commit; see `stream`.
+GAP_TIMEOUT = 5
+
+
+def retention():
+    """Return the number of seconds for which events are kept."""
+    if cfg.has_option('events', 'retention'):
+        return cfg.getint('events', 'retention')
+    return DEFAULT_RETENTION
+
+
+def _node_project(node):
+    """Return the label of ``node``'s project, or None if it is free."""
+    if node.project is None:
+        return None
+    return node.project.label
+
+
+def _project_events(project, change):
+    """Describe the creation or deletion of a project."""
+    if change == 'update':
+        return []
+    return [('project_' + change, project, {'project': project.label})]
+
+
+def _node_events(node, change):
+    """Describe a change to a node."""
+    if change != 'update':
+        return [('node_' + change, node.project,
+                 {'node': node.label, 'project': _node_project(node)})]
+    events = []
+    history = inspect(node).attrs.project.history
+    for project in history.deleted or ():
+        if project is not None:
+            events.append(('node_detach_project', project,
+                           {'node': node.label, 'project': project.label}))
+    for project in history.added or ():
+        if project is not None:
+            events.append(('node_connect_project', project,
+                           {'node': node.label, 'project': project.label}))
+    return events
+
+
+def _nic_events(nic, change):
+    """Describe the creation or deletion of a nic."""
+    if change == 'update':
+        return []
+    return [('nic_' + change, nic.owner.project,
+             {'node': nic.owner.label, 'nic': nic.label})]
+
+
+def _network_events(network, change):
+    """Describe the creation or deletion of a network."""
+    if change == 'update':
+        return []
+    owner = network.owner
+    return [('network_' + change, owner,
+             {'network': network.label,
+              'owner': None if owner is None else owner.label})]
+
+
+def _attachment_events(attachment, change):
+    """Describe the creation or deletion of a network attachment."""
+    if change == 'update':
+        return []
+    node = attachment.nic.owner
+    return [({'create': 'network_attach', 'delete': 'network_detach'}[change],
+             node.project,
+             {'node': node.label,
+              'nic': attachment.nic.label,
+              'network': attachment.network.label,
+              'channel': attachment.channel})]
+
+
+def _networking_action_events(action, change):
+    """Describe the queueing or completion of a networking action."""
+    if change == 'delete' or \
+            (change == 'update' and
+             not inspect(action).attrs.status.history.has_changes()):
+        return []
+    node = action.nic.owner
+    return [('networking_action', node.project,
+             {'status_id': action.uuid,
+              'status': action.status,
+              'node': node.label,
+              'nic': action.nic.label,
+              'action_type': action.type,
+              'channel': action.channel,
+              'new_network': getattr(action.new_network, 'label', None)})]
+
+
+# Map from model classes to functions describing changes to their instances.
+# Each function takes an object and one of 'create', 'update' or 'delete',
+# and returns a list of (type, project, payload) tuples, one per event.
+_describers = {
+    model.Project: _project_events,
+    model.Node: _node_events,
+    model.Nic: _nic_events,
+    model.Network: _network_events,
+    model.NetworkAttachment: _attachment_events,
+    model.NetworkingAction: _networking_action_events,
+}
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _collect(session, flush_context, instances):
+    """Work out which events the pending flush will cause.
+
+    The events are stashed in the session, and written by `_record` once the
+    flush has assigned ids to any new projects.
+    """
+    # pylint: disable=unused-argument
+    pending = session.info.setdefault('hil_events', [])
+    for change, objects in (('create', session.new),
+                            ('update', session.dirty),
+                            ('delete', session.deleted)):
+        for obj in objects:
+            describe = _describers.get(type(obj))
+            if describe is not None:
+                pending.extend(describe(obj, change))
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _record(session, flush_context):
+    """Write the events collected by `_collect` to the database."""
+    # pylint: disable=unused-argument
+    pending = session.info.pop('hil_events', None)
+    if not pending:
+        return
+    now = datetime.utcnow()
+    session.execute(model.Event.__table__.insert(), [
+        {'time': now,
+         'type': type_,
+         'project_id': None if project is None else project.id,
+         'payload': json.dumps(payload, sort_keys=True)}
+        for type_, project, payload in pending
+    ])
+    notifications.publish(CHANNEL)
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _discard(session, previous_transaction):
+    """Forget any events collected for a flush that failed."""
+    # pylint: disable=unused-argument
+    session.info.pop('hil_events', None)
+
+
+def prune():
+    """Delete events older than `retention` seconds.
+
+    The network daemon calls this periodically. The caller must commit.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=retention())
+    model.Event.query.filter(model.Event.time < cutoff) \
+        .delete(synchronize_session=False)
+
+
+def _format(evt):
+    """Format ``evt`` as a server-sent event."""
+    data = json.loads(evt.payload)
+    data['type'] = evt.type
+    data['time'] = evt.time.isoformat()
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+        evt.id, evt.type, json.dumps(data, sort_keys=True))
+
+
+def stream(last_event_id=None, keepalive=KEEPALIVE_INTERVAL,
+           gap_timeout=GAP_TIMEOUT):
+    """Generate the events visible to the current request, forever.
+
+    Events are generated as strings in ``text/event-stream`` format. If
+    ``last_event_id`` is None, only events recorded after the call are
+    generated; otherwise, those with greater ids are, starting with any that
+    have already been recorded. If there are no events for ``keepalive``
+    seconds, a comment line is generated instead.
+
+    Events are generated in id order. If an id is missing, its transaction
+    may not have committed yet, so the events after it are held back until
+    it does, for up to ``gap_timeout`` seconds (or until the event after the
+    gap is that old); after that, the missing event is assumed never to have
+    been committed.
+
+    This must be run inside of a request context. The database session is
+    committed each time the generator waits, so that it does not hold a
+    connection open while idle.
+    """
+    auth_backend = get_auth_backend()
+    is_admin = auth_backend.have_admin()
+    # Memoized project access checks, by project id:
+    access = {None: is_admin}
+
+    def _visible(project_id):
+        if is_admin:
+            return True
+        if project_id not in access:
+            project = model.Project.query.get(project_id)
+            access[project_id] = project is not None and \
+                auth_backend.have_project_access(project)
+        return access[project_id]
+
+    # When we found the gap in the ids which we are waiting on, if any:
+    gap_since = None
+
+    with notifications.subscribe(CHANNEL) as subscription:
+        if last_event_id is None:
+            last_event_id = db.session.query(func.max(model.Event.id)) \
+                .scalar() or 0
+        while True:
+            events = model.Event.query \
+                .filter(model.Event.id > last_event_id) \
+                .order_by(model.Event.id) \
+                .limit(BATCH_SIZE).all()
+            waiting = False
+            for evt in events:
+                if evt.id != last_event_id + 1:
+                    if gap_since is None:
+                        gap_since = time.time()
+                    if time.time() - gap_since < gap_timeout and \
+                            datetime.utcnow() - evt.time < \
+                            timedelta(seconds=gap_timeout):
+                        waiting = True
+                        break
+                gap_since = None
+                last_event_id = evt.id
+                if _visible(evt.project_id):
+                    yield _format(evt)
+            db.session.commit()
+            if waiting:
+                # The missing events announce themselves when they commit:
+                remaining = max(gap_since + gap_timeout - time.time(), 0)
+                if not subscription.wait(min(remaining, keepalive)) and \
+                        remaining > keepalive:
+                    yield ': keepalive\n\n'
+                continue
+            if len(events) == BATCH_SIZE:
+                continue
+            if not subscription.wait(keepalive):
+                yield ': keepalive\n\n'
@@ -3,13 +3,22 @@
 Includes API calls for managing users.
 """
 from hil import api, model, auth, errors
+from hil.config import cfg, core_schema
 from hil.model import db
 from hil.auth import get_auth_backend
 from hil.rest import rest_call, local, ContextLogger
 from passlib.hash import sha512_crypt
-from schema import Schema, Optional
+from schema import Schema, Optional, And, Use
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import binascii
 import flask
+import hashlib
+import hmac
 import logging
+import os
+import threading
+import time
 from os.path import join, dirname
 from hil.migrations import paths
 from hil.model import BigIntegerType
@@ -19,6 +28,18 @@ logger = ContextLogger(logging.getLogger(__name__), {})
 
 paths[__name__] = join(dirname(__file__), 'migrations', 'database')
 
+core_schema[Optional(__name__)] = {
+    Optional('cache_ttl'): And(str, str.isdigit),
+    Optional('cache_size'): And(str, str.isdigit),
+    Optional('max_token_ttl'): And(str, str.isdigit),
+}
+
+# The default lifetime of an api token, in seconds:
+DEFAULT_TOKEN_TTL = 3600
+
+# The default for the max_token_ttl option:
+DEFAULT_MAX_TOKEN_TTL = 86400
+
 
 class User(db.Model):
     """A user of the HIL.
@@ -52,6 +73,89 @@ class User(db.Model):
     def set_password(self, password):
         """Set the user's password to `password` (which must be plaintext)."""
         self.hashed_password = sha512_crypt.encrypt(password)
+        credential_cache.invalidate(self.label)
+
+
+class CredentialCache(object):
+    """A cache of recently verified passwords.
+
+    Verifying a password with `User.verify_password` is deliberately slow,
+    so `DatabaseAuthBackend` remembers, for up to `ttl` seconds, which
+    (username, password) pairs it has recently verified. At most `size`
+    entries are kept, evicting the least recently used first.
+
+    Neither usernames nor passwords are stored; entries are keyed by an HMAC
+    of the pair, under a secret key generated at startup, and record the
+    user's password hash at the time of verification. An entry is only
+    honored if that still matches the user's current hash, so a password
+    change anywhere (even in another process) invalidates it. Entries are
+    also removed eagerly when a user is deleted, changes password or has
+    their admin status changed, via `invalidate`.
+
+    The `hits` and `misses` attributes count lookups.
+    """
+
+    def __init__(self, ttl=60, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)
+        # Maps keys to (username, hashed_password, expiry time):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, username, password):
+        """Return the cache key for the given credentials."""
+        message = '%s\0%s' % (username.encode('utf-8'),
+                              password.encode('utf-8'))
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def check(self, user, password):
+        """Return whether `password` is cached as verified for `user`."""
+        key = self._key(user.label, password)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                _, hashed_password, expires = entry
+                if hashed_password == user.hashed_password and \
+                        expires > time.time():
+                    # Re-insert, to mark it as most recently used:
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def add(self, user, password):
+        """Record that `password` has been verified for `user`."""
+        if self.ttl == 0 or self.size == 0:
+            return
+        key = self._key(user.label, password)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (user.label,
+                                  user.hashed_password,
+                                  time.time() + self.ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """Forget all cached credentials for the user `username`."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry[0] == username:
+                    del self._entries[key]
+
+    def clear(self):
+        """Forget all cached credentials, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+credential_cache = CredentialCache()
 
 
 # A joining table for users and projects, which have a many to many
@@ -61,7 +165,48 @@ user_projects = db.Table('user_projects',
                          db.Column('project_id', db.ForeignKey('project.id')))
 
 
-@rest_call('GET', '/auth/basic/users', schema=Schema({}))
+class ApiToken(db.Model):
+    """An api token, which a user may present in place of their password.
+
+    Tokens are sent as ``Authorization: Bearer <token>``. Only a hash of the
+    token is stored; since tokens are long and random, a fast hash suffices,
+    and verifying a token is a single indexed lookup.
+
+    A token grants at most the access of its user, further restricted by
+    its scope: if `admin` is False, the token does not grant admin access,
+    and if `project` is set, it only grants access to that project.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+    token_hash = db.Column(db.String, nullable=False, unique=True)
+    user_id = db.Column(BigIntegerType, db.ForeignKey('user.id'),
+                        nullable=False)
+    user = db.relationship('User',
+                           backref=db.backref('api_tokens',
+                                              cascade='all, delete-orphan'))
+    project_id = db.Column(BigIntegerType, db.ForeignKey('project.id'))
+    project = db.relationship('Project',
+                              backref=db.backref('api_tokens',
+                                                 cascade='all, '
+                                                         'delete-orphan'))
+    admin = db.Column(db.Boolean, nullable=False, default=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+    @staticmethod
+    def hash(token):
+        """Return the value stored in `token_hash` for `token`."""
+        return hashlib.sha256(token).hexdigest()
+
+    @staticmethod
+    def lookup(token):
+        """Return the unexpired `ApiToken` for `token`, or None."""
+        return ApiToken.query.filter(
+            ApiToken.token_hash == ApiToken.hash(token.encode('utf-8')),
+            ApiToken.expires > datetime.utcnow(),
+        ).first()
+
+
+@rest_call('GET', '/auth/basic/users', schema=Schema({}),
+           depends_on=[User, model.Project])
 def list_users():
     """List all users with database authentication"""
     get_auth_backend().require_admin()
@@ -109,6 +254,7 @@ def user_delete(user):
 
     db.session.delete(user)
     db.session.commit()
+    credential_cache.invalidate(user.label)
 
 
 @rest_call('POST', '/auth/basic/user/<user>/add_project', Schema({
@@ -161,6 +307,94 @@ def user_set_admin(user, is_admin):
         raise errors.IllegalStateError("Cannot set own admin status")
     user.is_admin = is_admin
     db.session.commit()
+    credential_cache.invalidate(user.label)
+
+
+def _max_token_ttl():
+    """Return the maximum lifetime of an api token, in seconds."""
+    if cfg.has_option(__name__, 'max_token_ttl'):
+        return cfg.getint(__name__, 'max_token_ttl')
+    return DEFAULT_MAX_TOKEN_TTL
+
+
+@rest_call('POST', '/auth/token', Schema({
+    Optional('ttl'): And(int, lambda n: n > 0),
+    Optional('project'): basestring,
+    Optional('admin'): bool,
+}))
+def token_create(ttl=DEFAULT_TOKEN_TTL, project=None, admin=False):
+    """Issue an api token for the authenticated user.
+
+    The token expires after `ttl` seconds, which may not exceed the
+    ``max_token_ttl`` option. If `admin` is True, the token grants admin
+    access (which the caller must have); otherwise, if `project` is given,
+    it only grants access to that project, and if not, to the user's
+    projects.
+
+    A token may be used to create further tokens, but these may not
+    outlive it or grant more access than it does.
+    """
+    auth_backend = get_auth_backend()
+    parent = getattr(local, 'auth_token', None)
+    if local.auth is None:
+        raise errors.AuthorizationError(
+            "Api tokens can only be issued to authenticated users.")
+    if ttl > _max_token_ttl():
+        raise errors.BadArgumentError(
+            "Token lifetime may not exceed %d seconds." % _max_token_ttl())
+    if admin and project is not None:
+        raise errors.BadArgumentError(
+            "Admin tokens cannot be scoped to a project.")
+
+    if admin:
+        auth_backend.require_admin()
+    elif project is not None:
+        project = api.get_or_404(model.Project, project)
+        auth_backend.require_project_access(project)
+        if project not in local.auth.projects:
+            raise errors.BadArgumentError(
+                "Tokens can only be scoped to projects the user is in.")
+    elif parent is not None:
+        project = parent.project
+
+    expires = datetime.utcnow() + timedelta(seconds=ttl)
+    if parent is not None:
+        expires = min(expires, parent.expires)
+
+    # Take the opportunity to clean up:
+    ApiToken.query.filter(ApiToken.expires <= datetime.utcnow()) \
+        .delete(synchronize_session=False)
+
+    token = binascii.hexlify(os.urandom(32))
+    api_token = ApiToken(token_hash=ApiToken.hash(token),
+                         user=local.auth,
+                         project=project,
+                         admin=admin,
+                         expires=expires)
+    db.session.add(api_token)
+    db.session.commit()
+    return json.dumps({
+        'id': api_token.id,
+        'token': token,
+        'expires': api_token.expires.isoformat(),
+    })
+
+
+@rest_call('DELETE', '/auth/token/<token_id>', Schema({
+    'token_id': And(Use(int), lambda n: n > 0),
+}))
+def token_revoke(token_id):
+    """Revoke an api token.
+
+    Users may revoke their own tokens; admins may revoke anyone's.
+    """
+    token = ApiToken.query.get(token_id)
+    if token is None:
+        raise errors.NotFoundError("No such token: %d" % token_id)
+    if local.auth is None or token.user_id != local.auth.id:
+        get_auth_backend().require_admin()
+    db.session.delete(token)
+    db.session.commit()
 
 
 class DatabaseAuthBackend(auth.AuthBackend):
@@ -171,14 +405,21 @@ class DatabaseAuthBackend(auth.AuthBackend):
     def authenticate(self):
         # pylint: disable=missing-docstring
         local.auth = None
+        local.auth_token = None
+        self.forget_decisions()
         if flask.request.authorization is None:
+            header = flask.request.headers.get('Authorization', '')
+            if header.startswith('Bearer '):
+                return self._authenticate_token(header[len('Bearer '):])
             return False
         authorization = flask.request.authorization
         if authorization.password is None:
             return False
 
         user = api.get_or_404(User, authorization.username)
-        if user.verify_password(authorization.password):
+        if credential_cache.check(user, authorization.password) or \
+                user.verify_password(authorization.password):
+            credential_cache.add(user, authorization.password)
             local.auth = user
             logger.info("Successful authentication for user %r", user.label)
             return True
@@ -186,15 +427,56 @@ class DatabaseAuthBackend(auth.AuthBackend):
             logger.info("Failed authentication for user %r", user.label)
             return False
 
+    def _authenticate_token(self, token):
+        """Authenticate with the api token `token`."""
+        api_token = ApiToken.lookup(token)
+        if api_token is None:
+            logger.info("Failed authentication with an api token")
+            return False
+        local.auth = api_token.user
+        local.auth_token = api_token
+        logger.info("Successful authentication for user %r with api token "
+                    "%d", api_token.user.label, api_token.id)
+        return True
+
+    def access_depends_on(self):
+        # pylint: disable=missing-docstring
+        # Both admin status and project membership are kept on users:
+        return [User]
+
     def _have_admin(self):
         user = local.auth
-        return user is not None and user.is_admin
+        token = getattr(local, 'auth_token', None)
+        return user is not None and user.is_admin and \
+            (token is None or token.admin)
 
     def _have_project_access(self, project):
         user = local.auth
+        token = getattr(local, 'auth_token', None)
+        if token is not None and token.project_id is not None and \
+                token.project_id != project.id:
+            return False
         return user is not None and project in user.projects
 
+    def _accessible_project_ids(self):
+        user = local.auth
+        if user is None:
+            return frozenset()
+        ids = frozenset(
+            project_id for (project_id,) in
+            db.session.query(user_projects.c.project_id)
+            .filter(user_projects.c.user_id == user.id))
+        token = getattr(local, 'auth_token', None)
+        if token is not None and token.project_id is not None:
+            ids &= frozenset([token.project_id])
+        return ids
+
 
 def setup(*args, **kwargs):
     """Set a DatabaseAuthBackend as the auth backend."""
+    if cfg.has_option(__name__, 'cache_ttl'):
+        credential_cache.ttl = cfg.getint(__name__, 'cache_ttl')
+    if cfg.has_option(__name__, 'cache_size'):
+        credential_cache.size = cfg.getint(__name__, 'cache_size')
+    credential_cache.clear()
     auth.set_auth_backend(DatabaseAuthBackend())
@@ -6,8 +6,9 @@ from keystonemiddleware.auth_token import filter_factory
 from flask import request
 from hil.flaskapp import app
 from hil.config import cfg, core_schema, string_is_web_url
-from hil.model import Project
+from hil.ext.auth.keystone_cache import TokenCache, project_cache
 from hil import auth, rest
+from schema import Optional, And
 import logging
 import sys
 
@@ -21,8 +22,14 @@ core_schema[__name__] = {
     'project_name': str,
     'admin_user': str,
     'admin_password': str,
+    Optional('token_cache_ttl'): And(str, str.isdigit),
+    Optional('token_cache_size'): And(str, str.isdigit),
+    Optional('project_cache_ttl'): And(str, str.isdigit),
 }
 
+# Options which configure HIL's own caches, rather than keystonemiddleware:
+_CACHE_OPTIONS = ('token_cache_ttl', 'token_cache_size', 'project_cache_ttl')
+
 
 class KeystoneAuthBackend(auth.AuthBackend):
     """Authenticate with keystone."""
@@ -48,7 +55,7 @@ class KeystoneAuthBackend(auth.AuthBackend):
             return True
 
         project_id = request.environ['HTTP_X_PROJECT_ID']
-        if Project.query.filter_by(label=project_id).first() is None:
+        if project_cache.get_id(project_id) is None:
             logger.info("Successful authentication by Openstack project %r, "
                         "but this project is not registered with HIL",
                         project_id)
@@ -59,10 +66,23 @@ class KeystoneAuthBackend(auth.AuthBackend):
     def _have_project_access(self, project):
         return project.label == request.environ['HTTP_X_PROJECT_ID']
 
+    def _accessible_project_ids(self):
+        project_id = project_cache.get_id(request.environ['HTTP_X_PROJECT_ID'])
+        if project_id is None:
+            return frozenset()
+        return frozenset([project_id])
+
     def _have_admin(self):
         return 'admin' in request.environ['HTTP_X_ROLES'].split(',')
 
 
+def _getint(option, default):
+    """Return the integer value of `option`, or `default` if unset."""
+    if cfg.has_option(__name__, option):
+        return cfg.getint(__name__, option)
+    return default
+
+
 def setup(*args, **kwargs):
     """Set a KeystoneAuthBackend as the auth backend.
 
@@ -75,10 +95,15 @@ def setup(*args, **kwargs):
         sys.exit(1)
     keystone_cfg = {}
     for key in cfg.options(__name__):
-        keystone_cfg[key] = cfg.get(__name__, key)
+        if key not in _CACHE_OPTIONS:
+            keystone_cfg[key] = cfg.get(__name__, key)
+
+    project_cache.ttl = _getint('project_cache_ttl', 60)
 
     # Great job with the API design Openstack! </sarcasm>
     factory = filter_factory(keystone_cfg)
-    app.wsgi_app = factory(app.wsgi_app)
+    app.wsgi_app = TokenCache(app.wsgi_app, factory,
+                              ttl=_getint('token_cache_ttl', 60),
+                              size=_getint('token_cache_size', 1024))
 
     auth.set_auth_backend(KeystoneAuthBackend())
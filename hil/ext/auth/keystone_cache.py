@@ -0,0 +1,210 @@
+"""Caches used by the keystone auth backend (`hil.ext.auth.keystone`).
+
+`TokenCache` is WSGI middleware which sits in front of `keystonemiddleware`,
+and remembers the identity keystone reported for each token, so that
+repeated requests with the same token are not validated against keystone
+again. `ProjectCache` remembers which openstack projects are registered in
+HIL, so that authenticating doesn't need a database query either.
+
+These are kept separate from `hil.ext.auth.keystone` so that they don't
+depend on `keystonemiddleware`; any WSGI middleware which sets the same
+environment variables can stand in for it, e.g. in the tests.
+"""
+
+import hashlib
+import threading
+import time
+from calendar import timegm
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event
+
+from hil import model
+
+# The wsgi environment variables which keystonemiddleware sets to describe
+# the identity of the request. It strips any of these sent by the client, so
+# we must too when answering from the cache:
+IDENTITY_KEYS = tuple('HTTP_X_' + name for name in [
+    'IDENTITY_STATUS',
+    'DOMAIN_ID', 'DOMAIN_NAME',
+    'PROJECT_ID', 'PROJECT_NAME',
+    'PROJECT_DOMAIN_ID', 'PROJECT_DOMAIN_NAME',
+    'USER_ID', 'USER_NAME',
+    'USER_DOMAIN_ID', 'USER_DOMAIN_NAME',
+    'ROLES', 'SERVICE_CATALOG', 'IS_ADMIN_PROJECT',
+    'TENANT_ID', 'TENANT_NAME', 'TENANT', 'USER', 'ROLE',
+])
+
+# Prefix of the variables describing the identity of a service token:
+SERVICE_IDENTITY_PREFIX = 'HTTP_X_SERVICE_'
+
+
+class _BoundedCache(object):
+    """A thread-safe mapping with a size limit and expiring entries.
+
+    At most `size` entries are kept, evicting the least recently used first.
+    The `hits` and `misses` attributes count lookups.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # Maps keys to (value, expiry time):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for `key`, or None if absent or expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > time.time():
+                # Re-insert, to mark it as most recently used:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, expires):
+        """Store `value` for `key` until the (unix) time `expires`."""
+        if self.size == 0 or expires <= time.time():
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Remove the entry for `key`, if any."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _token_expiry(environ):
+    """Return the (unix) time at which the request's token expires.
+
+    This is read from the token data keystonemiddleware stores in the
+    environment. Returns None if it isn't available.
+    """
+    info = environ.get('keystone.token_info')
+    if not isinstance(info, dict):
+        return None
+    if 'token' in info:
+        expires = info['token'].get('expires_at')  # v3
+    else:
+        expires = info.get('access', {}).get('token', {}).get('expires')  # v2
+    if not expires:
+        return None
+    # e.g. 2017-06-01T12:00:00.000000Z; we ignore the fractional part:
+    expires = expires.split('.')[0].rstrip('Z')
+    try:
+        when = datetime.strptime(expires, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    return timegm(when.timetuple())
+
+
+class TokenCache(object):
+    """WSGI middleware caching the results of keystone token validation.
+
+    `app` is the wsgi application to protect, and `auth_filter` is a
+    function which wraps a wsgi application in keystone's authentication
+    middleware (as returned by `keystonemiddleware.auth_token.filter_factory`).
+
+    Requests with a token which keystone has confirmed within the last `ttl`
+    seconds (and which has not expired since) bypass `auth_filter`, and are
+    given the identity keystone reported last time. At most `size` tokens are
+    cached. Requests with a service token, and tokens keystone did not
+    confirm, are never cached.
+
+    Note that this means a revoked token may continue to work for up to
+    `ttl` seconds.
+    """
+
+    def __init__(self, app, auth_filter, ttl=60, size=1024):
+        self.app = app
+        self.ttl = ttl
+        self.cache = _BoundedCache(size)
+        self._authenticated_app = auth_filter(self._remember)
+
+    @staticmethod
+    def _key(token):
+        """Return the cache key for `token`."""
+        return hashlib.sha256(token).digest()
+
+    def __call__(self, environ, start_response):
+        token = environ.get('HTTP_X_AUTH_TOKEN')
+        if not token or self.ttl == 0 or \
+                'HTTP_X_SERVICE_TOKEN' in environ:
+            return self._authenticated_app(environ, start_response)
+
+        identity = self.cache.get(self._key(token))
+        if identity is None:
+            environ['hil.token_cache.key'] = self._key(token)
+            return self._authenticated_app(environ, start_response)
+
+        for key in list(environ.keys()):
+            if key in IDENTITY_KEYS or \
+                    key.startswith(SERVICE_IDENTITY_PREFIX):
+                del environ[key]
+        environ.update(identity)
+        return self.app(environ, start_response)
+
+    def _remember(self, environ, start_response):
+        """Cache the identity keystone established, then call `app`.
+
+        This is the application wrapped by `auth_filter`.
+        """
+        key = environ.pop('hil.token_cache.key', None)
+        if key is not None and \
+                environ.get('HTTP_X_IDENTITY_STATUS') == 'Confirmed':
+            expires = time.time() + self.ttl
+            token_expires = _token_expiry(environ)
+            if token_expires is not None:
+                expires = min(expires, token_expires)
+            identity = dict((k, environ[k])
+                            for k in IDENTITY_KEYS if k in environ)
+            self.cache.put(key, identity, expires)
+        return self.app(environ, start_response)
+
+
+class ProjectCache(object):
+    """A cache of the ids of the projects registered in HIL, by label.
+
+    Only projects which exist are cached, for up to `ttl` seconds; projects
+    deleted by this process are forgotten immediately.
+    """
+
+    def __init__(self, ttl=60, size=1024):
+        self.ttl = ttl
+        self.cache = _BoundedCache(size)
+
+    def get_id(self, label):
+        """Return the id of the project named `label`, or None if absent."""
+        project_id = self.cache.get(label)
+        if project_id is None:
+            project_id = model.db.session.query(model.Project.id) \
+                .filter_by(label=label).scalar()
+            if project_id is not None and self.ttl > 0:
+                self.cache.put(label, project_id, time.time() + self.ttl)
+        return project_id
+
+
+project_cache = ProjectCache()
+
+
+@event.listens_for(model.Project, 'after_delete')
+def _forget_project(mapper, connection, target):
+    """Remove deleted projects from `project_cache`."""
+    # pylint: disable=unused-argument
+    project_cache.cache.discard(target.label)
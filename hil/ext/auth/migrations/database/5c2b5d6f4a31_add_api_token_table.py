@@ -0,0 +1,48 @@
+"""add api_token table
+
+Revision ID: 5c2b5d6f4a31
+Revises: 96f1e8f87f85
+Create Date: 2026-10-19 14:02:31.552712
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2b5d6f4a31'
+down_revision = '96f1e8f87f85'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'api_token',
+        sa.Column('id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.Column('token_hash', sa.String(), nullable=False),
+        sa.Column('user_id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.Column('project_id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=True),
+        sa.Column('admin', sa.Boolean(), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token_hash'),
+    )
+    op.create_index(op.f('ix_api_token_expires'), 'api_token', ['expires'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_api_token_expires'), table_name='api_token')
+    op.drop_table('api_token')
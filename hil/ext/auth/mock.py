@@ -51,6 +51,7 @@ class MockAuthBackend(auth.AuthBackend):
     def set_project(self, project):
         """Change the project that the request is acting on behalf of."""
         rest.local.auth['project'] = project
+        self.forget_decisions()
 
     def set_admin(self, admin):
         """Change whether the request has admin access.
@@ -59,6 +60,7 @@ class MockAuthBackend(auth.AuthBackend):
         access.
         """
         rest.local.auth['admin'] = admin
+        self.forget_decisions()
 
     def set_user(self, user):
         """Set the user the request is running as."""
@@ -0,0 +1,93 @@
+"""Export api request statistics to Prometheus.
+
+This extension aggregates the per-request statistics collected by
+`hil.request_stats` into Prometheus histograms, labelled by api call, and
+serves them at ``/metrics`` (outside of the versioned api, and without
+authentication, as Prometheus expects). It also reports the state of the
+database connection pool.
+
+It requires the ``prometheus_client`` library. If the api server runs in
+several processes, set the ``prometheus_multiproc_dir`` environment variable
+to an empty directory writable by all of them, as described in the
+``prometheus_client`` documentation, so that the metrics are combined.
+"""
+
+import os
+
+from flask import Response
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, \
+    CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+
+from hil import model, request_stats
+from hil.flaskapp import app
+
+_requests = Counter(
+    'hil_api_requests_total',
+    'Number of api calls handled, by api call and status code.',
+    ['endpoint', 'status'])
+
+_duration = Histogram(
+    'hil_api_request_seconds',
+    'Time taken to handle api calls.',
+    ['endpoint'])
+
+_phase_duration = Histogram(
+    'hil_api_request_phase_seconds',
+    'Time spent in each phase of handling api calls.',
+    ['endpoint', 'phase'])
+
+_sql_duration = Histogram(
+    'hil_api_request_sql_seconds',
+    'Time spent executing SQL statements per api call.',
+    ['endpoint'])
+
+_sql_count = Histogram(
+    'hil_api_request_sql_statements',
+    'Number of SQL statements executed per api call.',
+    ['endpoint'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')))
+
+# In multiprocess mode, this is summed over the live processes:
+_pool_connections = Gauge(
+    'hil_db_pool_connections',
+    'Database connections in the pool, by state: "size" is the number the '
+    'pool keeps open, "checked_out" the number in use, and "overflow" the '
+    'number in use beyond "size".',
+    ['state'],
+    multiprocess_mode='livesum')
+
+
+def _update_pool_status():
+    """Update `_pool_connections` from the current pool status."""
+    status = model.pool_status()
+    if status is not None:
+        for state, count in status.items():
+            _pool_connections.labels(state).set(count)
+
+
+def _observe(endpoint, status, stats):
+    """Record the statistics for a request; see `request_stats.observers`."""
+    _requests.labels(endpoint, str(status)).inc()
+    _duration.labels(endpoint).observe(stats.total())
+    for phase, seconds in stats.phases.items():
+        _phase_duration.labels(endpoint, phase).observe(seconds)
+    _sql_duration.labels(endpoint).observe(stats.sql_time)
+    _sql_count.labels(endpoint).observe(stats.sql_count)
+    _update_pool_status()
+
+
+def _metrics():
+    """Serve the metrics in the Prometheus text format."""
+    _update_pool_status()
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def setup(*args, **kwargs):
+    """Start aggregating request statistics, and serve ``/metrics``."""
+    request_stats.observers.append(_observe)
+    app.add_url_rule('/metrics', 'prometheus_metrics', _metrics)
@@ -0,0 +1,47 @@
+"""add vlan pools and projects
+
+Revision ID: 8ca66ab92e06
+Revises: e06576b2ea9e
+Create Date: 2026-10-19 16:12:40.183522
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = '8ca66ab92e06'
+down_revision = 'e06576b2ea9e'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    # Existing vlans all belong to the default pool:
+    op.add_column('vlan', sa.Column('pool', sa.String(), nullable=False,
+                                    server_default='default'))
+    op.alter_column('vlan', 'pool', server_default=None)
+    op.add_column('vlan', sa.Column(
+        'project_id',
+        sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+        nullable=True))
+    op.create_foreign_key('vlan_project_id_fkey', 'vlan', 'project',
+                          ['project_id'], ['id'])
+    op.create_index(op.f('ix_vlan_project_id'), 'vlan', ['project_id'],
+                    unique=False)
+    # Charge the vlans of existing project-owned networks to their projects:
+    op.execute("UPDATE vlan SET project_id = ("
+               "    SELECT network.owner_id FROM network"
+               "    WHERE network.allocated"
+               "    AND network.network_id = CAST(vlan.vlan_no AS VARCHAR))"
+               " WHERE NOT vlan.available")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_vlan_project_id'), table_name='vlan')
+    op.drop_constraint('vlan_project_id_fkey', 'vlan', type_='foreignkey')
+    op.drop_column('vlan', 'project_id')
+    op.drop_column('vlan', 'pool')
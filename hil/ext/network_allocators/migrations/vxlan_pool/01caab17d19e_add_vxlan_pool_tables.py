@@ -0,0 +1,44 @@
+"""add vxlan pool tables
+
+Revision ID: 01caab17d19e
+Revises:
+Create Date: 2026-10-19 17:05:12.640193
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = '01caab17d19e'
+down_revision = None
+branch_labels = ('hil.ext.network_allocators.vxlan_pool',)
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    for table in 'vni_range', 'vni_pool_range':
+        op.create_table(
+            table,
+            sa.Column('id',
+                      sa.BigInteger().with_variant(sqlite.INTEGER(),
+                                                   'sqlite'),
+                      nullable=False),
+            sa.Column('first_vni', sa.Integer(), nullable=False),
+            sa.Column('last_vni', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    op.create_index(op.f('ix_vni_range_first_vni'), 'vni_range',
+                    ['first_vni'], unique=False)
+    op.create_index(op.f('ix_vni_range_last_vni'), 'vni_range',
+                    ['last_vni'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_vni_range_last_vni'), table_name='vni_range')
+    op.drop_index(op.f('ix_vni_range_first_vni'), table_name='vni_range')
+    op.drop_table('vni_pool_range')
+    op.drop_table('vni_range')
@@ -12,7 +12,7 @@ class NullNetworkAllocator(NetworkAllocator):
 
     Conforms to the interface specified for its superclass, NetworkAllocator.
     """
-    def get_new_network_id(self):
+    def get_new_network_id(self, pool=None, project=None):
         return str(uuid.uuid1())
 
     def free_network_id(self, net_id):
@@ -1,11 +1,32 @@
-"""VLAN based ``network_allocator`` implementation."""
+"""VLAN based ``network_allocator`` implementation.
+
+The vlans are divided into named pools, each configured by its own option in
+the extension's config section: ``vlans`` holds the vlans of the pool named
+``default``, and ``pool.<name>`` those of the pool ``<name>``. Networks are
+allocated from the default pool unless another is asked for.
+
+The option ``project_quota``, if given, limits how many vlans each project
+may have allocated from each pool at once; ``project_quota.<name>`` overrides
+it for the pool ``<name>``.
+"""
 
 import logging
+import os
+import re
+import sys
+import threading
+
+from flask_sqlalchemy import SignallingSession
+from schema import And, Optional
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects import postgresql
 
+from hil import notifications
 from hil.network_allocator import NetworkAllocator, set_network_allocator
-from hil.model import db
-from hil.config import cfg, core_schema, string_has_vlans
-from hil.errors import BlockedError
+from hil.model import db, Project
+from hil.config import cfg, core_schema, string_has_vlans, \
+    string_is_nonnegative_int
+from hil.errors import BadArgumentError, BlockedError, QuotaExceededError
 
 from os.path import join, dirname
 from hil.migrations import paths
@@ -13,17 +34,25 @@ from hil.model import BigIntegerType
 
 paths[__name__] = join(dirname(__file__), 'migrations', 'vlan_pool')
 
+DEFAULT_POOL = 'default'
+
+
+def _named_option(prefix):
+    """Return a schema matching options named ``<prefix>.<pool name>``."""
+    pattern = re.compile(re.escape(prefix) + r'\.[\w-]+$')
+    return And(str, lambda option: pattern.match(option) is not None)
+
+
 core_schema[__name__] = {
-    'vlans': string_has_vlans
+    'vlans': string_has_vlans,
+    Optional(_named_option('pool')): string_has_vlans,
+    Optional('project_quota'): string_is_nonnegative_int,
+    Optional(_named_option('project_quota')): string_is_nonnegative_int,
 }
 
 
-def get_vlan_list():
-    """Return a list of vlans in the module's config section.
-
-    This is for use by the ``create_bridges`` script.
-    """
-    vlan_str = cfg.get(__name__, 'vlans')
+def _parse_vlans(vlan_str):
+    """Return the list of vlans in `vlan_str`; see `string_has_vlans`."""
     returnee = []
     for r in vlan_str.split(","):
         r = r.strip().split("-")
@@ -34,35 +63,152 @@ def get_vlan_list():
     return returnee
 
 
+# The last config section parsed by `get_pools`, and the result:
+_parsed_pools = {}
+
+
+def get_pools():
+    """Return a dict mapping the names of the configured pools to their vlans.
+
+    The vlans of each pool are a sorted list. The config is only parsed
+    again if it has changed since the last call.
+    """
+    options = tuple(sorted(cfg.items(__name__)))
+    if options not in _parsed_pools:
+        pools = {}
+        for option, value in options:
+            if option == 'vlans':
+                pools[DEFAULT_POOL] = value
+            elif option.startswith('pool.'):
+                pools[option[len('pool.'):]] = value
+        pools = dict((name, sorted(set(_parse_vlans(value))))
+                     for name, value in pools.items())
+        _parsed_pools.clear()
+        _parsed_pools[options] = pools
+    return _parsed_pools[options]
+
+
+def get_vlan_list():
+    """Return a list of the vlans in all of the configured pools.
+
+    This is for use by the ``create_bridges`` script.
+    """
+    return sorted(vlan for vlans in get_pools().values() for vlan in vlans)
+
+
+def project_quota(pool):
+    """Return the limit on vlans each project may have from `pool`.
+
+    Returns None if there is no limit.
+    """
+    for option in 'project_quota.' + pool, 'project_quota':
+        if cfg.has_option(__name__, option):
+            return int(cfg.get(__name__, option))
+    return None
+
+
 class VlanAllocator(NetworkAllocator):
     """A allocator of VLANs. The interface is as specified in
     ``NetworkAllocator``.
+
+    Which vlans are in which pool, and which of those are available, is
+    cached in memory (see `_VlanBitmap`), so that checking whether a vlan
+    is in a pool costs no queries, and finding a free vlan costs none
+    beyond the one which claims it. The database remains authoritative:
+    allocation and freeing update the vlan table directly, rather than
+    through the ORM, so that each is a single atomic statement which only
+    succeeds if the vlan is in the expected state.
     """
 
-    def get_new_network_id(self):
-        vlan = Vlan.query.filter_by(available=True).first()
-        if not vlan:
-            return None
-        vlan.available = False
-        returnee = str(vlan.vlan_no)
-        return returnee
+    def get_new_network_id(self, pool=None, project=None):
+        """Allocate the lowest-numbered available vlan in `pool`.
+
+        If `pool` is None, the default pool is used. If `project` is not
+        None, the vlan is allocated to that project, and counts against its
+        quota for the pool.
+
+        Candidates are taken from the in-memory bitmap, lowest first, and
+        each is claimed only if it is still available in the database;
+        vlans which turn out to have been taken by another process are
+        skipped. If the bitmap runs out of candidates, it is reloaded once,
+        in case vlans have been freed since it was loaded.
+
+        Concurrent transactions never get the same vlan. On postgres, the
+        claim skips vlans locked by (i.e. being allocated by) other
+        transactions, rather than waiting for them.
+        """
+        if pool is None:
+            pool = DEFAULT_POOL
+        if pool not in get_pools():
+            raise BadArgumentError("No such vlan pool: %r" % pool)
+        project_id = None
+        if project is not None:
+            project_id = project.id
+            _check_quota(pool, project_id)
+        skip_locked = db.session.get_bind().dialect.name == 'postgresql'
+        reloaded = False
+        while True:
+            vlan_no = _bitmap.take(pool)
+            if vlan_no is None:
+                if reloaded:
+                    return None
+                _bitmap.invalidate()
+                reloaded = True
+                continue
+            _bitmap.changed_in(db.session)
+            if _set_available(vlan_no, False, only_if=True,
+                              skip_locked=skip_locked,
+                              project_id=project_id):
+                return str(vlan_no)
 
     def free_network_id(self, net_id):
-        vlan = Vlan.query.filter_by(vlan_no=net_id).one_or_none()
-        if vlan is None:
+        if not _set_available(int(net_id), True):
             logger = logging.getLogger(__name__)
             logger.error('vlan %s does not exist in database', net_id)
             return
-        vlan.available = True
+        # Every process (including this one) picks the freed vlan up when
+        # the transaction commits:
+        notifications.publish(_CHANNEL, str(net_id))
 
     def populate(self):
-        vlan_list = get_vlan_list()
-        for vlan in vlan_list:
-            if Vlan.query.filter_by(vlan_no=vlan).count() == 1:
-                # Already created by a previous call; leave it alone.
-                continue
-            db.session.add(Vlan(vlan))
+        """Add the configured vlans which aren't in the database yet.
+
+        Vlans which are already there are left alone, except that they are
+        moved to the pool they are now configured in, if that has changed.
+        So this is safe to run on a database in use, including by several
+        processes at once.
+        """
+        table = Vlan.__table__
+        existing = dict(db.session.execute(
+            select([table.c.vlan_no, table.c.pool])).fetchall())
+        changed = False
+        for pool, vlans in sorted(get_pools().items()):
+            missing = [vlan_no for vlan_no in vlans
+                       if vlan_no not in existing]
+            moved = [vlan_no for vlan_no in vlans
+                     if existing.get(vlan_no, pool) != pool]
+            if missing:
+                if db.session.get_bind().dialect.name == 'postgresql':
+                    insert = postgresql.insert(table) \
+                        .on_conflict_do_nothing()
+                else:
+                    insert = table.insert().prefix_with('OR IGNORE')
+                db.session.execute(insert, [{'vlan_no': vlan_no,
+                                             'pool': pool,
+                                             'available': True}
+                                            for vlan_no in missing])
+            if moved:
+                db.session.execute(table.update()
+                                   .where(table.c.vlan_no.in_(moved))
+                                   .values(pool=pool))
+            if missing or moved:
+                changed = True
+        if changed:
+            notifications.publish(_CHANNEL)
         db.session.commit()
+        # The database may have been re-created, which doesn't notify
+        # anyone:
+        _bitmap.invalidate()
 
     def legal_channels_for(self, net_id):
         return ["vlan/native",
@@ -81,18 +227,212 @@ class VlanAllocator(NetworkAllocator):
             return False
 
     def claim_network_id(self, net_id):
-        vlan = Vlan.query.filter_by(vlan_no=net_id).one_or_none()
-        if vlan is None:
+        if not self.is_network_id_in_pool(net_id):
             return
-        elif vlan.available:
-            vlan.available = False
-        else:
+        vlan_no = int(net_id)
+        _bitmap.changed_in(db.session)
+        _bitmap.take_vlan(vlan_no)
+        if not _set_available(vlan_no, False, only_if=True):
             raise BlockedError("Network ID is not available."
                                " Please choose a different ID.")
 
     def is_network_id_in_pool(self, net_id):
-        vlan = Vlan.query.filter_by(vlan_no=net_id).one_or_none()
-        return vlan is not None
+        try:
+            return _bitmap.in_pool(int(net_id))
+        except ValueError:
+            return False
+
+    def usage(self):
+        """Count the free and used vlans in each pool, with one query.
+
+        Pools which are no longer configured, but still have vlans in the
+        database, are included.
+        """
+        table = Vlan.__table__
+        result = dict((pool, {'free': 0, 'used': 0}) for pool in get_pools())
+        for pool, available, count in db.session.execute(
+                select([table.c.pool, table.c.available, func.count()])
+                .group_by(table.c.pool, table.c.available)):
+            counts = result.setdefault(pool, {'free': 0, 'used': 0})
+            counts['free' if available else 'used'] += count
+        return result
+
+
+def _check_quota(pool, project_id):
+    """Raise QuotaExceededError if the project can't have another vlan.
+
+    The project's row is locked for the rest of the transaction, so that
+    concurrent allocations for the same project can't each see room for
+    one more vlan, and together exceed the quota.
+    """
+    quota = project_quota(pool)
+    if quota is None:
+        return
+    projects = Project.__table__
+    db.session.execute(select([projects.c.id])
+                       .where(projects.c.id == project_id)
+                       .with_for_update())
+    table = Vlan.__table__
+    used = db.session.execute(
+        select([func.count()])
+        .where(table.c.pool == pool)
+        .where(table.c.project_id == project_id)).scalar()
+    if used >= quota:
+        raise QuotaExceededError("Project has used its quota of %d vlans "
+                                 "from pool %r." % (quota, pool))
+
+
+def _set_available(vlan_no, available, only_if=None, skip_locked=False,
+                   project_id=None):
+    """Set whether `vlan_no` is available, returning whether it was changed.
+
+    The vlan's project is set to `project_id` at the same time. If `only_if`
+    is not None, the vlan is only changed if its availability is currently
+    `only_if`. If `skip_locked` is true (which is only supported on
+    postgres), the vlan is also left alone if another transaction has it
+    locked. Returns False if the vlan doesn't exist.
+    """
+    table = Vlan.__table__
+    if skip_locked:
+        candidate = select([table.c.id]) \
+            .where(table.c.vlan_no == vlan_no)
+        if only_if is not None:
+            candidate = candidate.where(table.c.available == only_if)
+        stmt = table.update() \
+            .where(table.c.id == candidate.with_for_update(skip_locked=True)
+                   .as_scalar())
+    else:
+        stmt = table.update().where(table.c.vlan_no == vlan_no)
+        if only_if is not None:
+            stmt = stmt.where(table.c.available == only_if)
+    stmt = stmt.values(available=available, project_id=project_id)
+    return db.session.execute(stmt).rowcount == 1
+
+
+# Notification channel on which changes to the vlan table which other
+# processes can't infer are announced:
+_CHANNEL = 'vlan_pool'
+
+
+class _VlanBitmap(object):
+    """A per-process cache of the vlan table.
+
+    The members of each pool and the available vlans are each kept as a
+    bitset (a python integer), with bit ``n`` standing for vlan ``n``. The
+    cache is loaded on first use, with one query, and is only a hint: it
+    may say a vlan is available when another process has since taken it,
+    which the claim itself detects. Changes that the cache can't detect
+    this way, i.e. vlans being freed or added to pools, are announced by
+    notification (see `hil.notifications`). A freed vlan's notification
+    carries its number, which is simply marked available the next time the
+    cache is used; after any other notification, the cache is reloaded. So
+    is a cache whose changes were rolled back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._subscription = None
+        # Map from pool names to their members, or None if the cache needs
+        # (re)loading:
+        self._pools = None
+        # The members of all pools:
+        self._all = 0
+        self._available = 0
+
+    def _refresh(self):
+        """Make sure the cache is loaded and up to date.
+
+        Must be called with `_lock` held.
+        """
+        if self._pid != os.getpid():
+            # Either we've never been used, or we've been forked, in which
+            # case the subscription was the parent's.
+            self._subscription = notifications.subscribe(_CHANNEL,
+                                                         keep_payloads=True)
+            self._subscription.__enter__()
+            self._pid = os.getpid()
+            self._pools = None
+        for payload in self._subscription.received():
+            if self._pools is None:
+                break
+            if payload and payload.isdigit():
+                # A freed vlan:
+                self._available |= 1 << int(payload)
+            else:
+                # Some other change, or notifications may have been lost:
+                self._pools = None
+        if self._pools is not None:
+            return
+        table = Vlan.__table__
+        pools = {}
+        available = 0
+        for vlan_no, pool, is_available in db.session.execute(
+                select([table.c.vlan_no, table.c.pool, table.c.available])):
+            pools[pool] = pools.get(pool, 0) | 1 << vlan_no
+            if is_available:
+                available |= 1 << vlan_no
+        self._pools = pools
+        self._all = reduce(lambda a, b: a | b, pools.values(), 0)
+        self._available = available
+
+    def invalidate(self):
+        """Reload the cache the next time it is used."""
+        with self._lock:
+            self._pools = None
+
+    def in_pool(self, vlan_no):
+        """Return whether `vlan_no` is in any pool."""
+        if vlan_no < 0:
+            return False
+        with self._lock:
+            self._refresh()
+            return bool(self._all >> vlan_no & 1)
+
+    def take_vlan(self, vlan_no):
+        """Mark `vlan_no` unavailable."""
+        with self._lock:
+            self._refresh()
+            self._available &= ~(1 << vlan_no)
+
+    def take(self, pool):
+        """Return the lowest available vlan in `pool`, marking it unavailable.
+
+        Returns None if there are no available vlans. Marking the vlan
+        unavailable keeps other threads from trying to claim it too.
+        """
+        with self._lock:
+            self._refresh()
+            candidates = self._available & self._pools.get(pool, 0)
+            if not candidates:
+                return None
+            lowest = candidates & -candidates
+            self._available ^= lowest
+            return lowest.bit_length() - 1
+
+    def changed_in(self, session):
+        """Note that the cache has been changed in `session`'s transaction.
+
+        If the transaction doesn't commit, the cache is reloaded.
+        """
+        session.info['hil_vlan_bitmap_changed'] = True
+
+
+_bitmap = _VlanBitmap()
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _keep_bitmap(session):
+    """The changes to `_bitmap` in a committed transaction stand."""
+    session.info.pop('hil_vlan_bitmap_changed', None)
+
+
+@event.listens_for(SignallingSession, 'after_transaction_end')
+def _discard_bitmap(session, transaction):
+    """Reload `_bitmap` if a transaction which changed it didn't commit."""
+    if transaction.parent is None and \
+            session.info.pop('hil_vlan_bitmap_changed', False):
+        _bitmap.invalidate()
 
 
 class Vlan(db.Model):
@@ -107,13 +447,25 @@ class Vlan(db.Model):
     """
     id = db.Column(BigIntegerType, primary_key=True)
     vlan_no = db.Column(db.Integer, nullable=False, unique=True)
+    pool = db.Column(db.String, nullable=False)
     available = db.Column(db.Boolean, nullable=False)
+    # The project the vlan was allocated to, if any:
+    project_id = db.Column(BigIntegerType, db.ForeignKey('project.id'),
+                           index=True)
 
-    def __init__(self, vlan_no):
+    def __init__(self, vlan_no, pool=DEFAULT_POOL):
         self.vlan_no = vlan_no
+        self.pool = pool
         self.available = True
 
 
 def setup(*args, **kwargs):
     """Register a VlanAllocator as the network allocator."""
+    pools = {}
+    for pool, vlans in sorted(get_pools().items()):
+        for vlan_no in vlans:
+            if vlan_no in pools:
+                sys.exit("Fatal Error: vlan %d is in both the %r and %r "
+                         "vlan pools." % (vlan_no, pools[vlan_no], pool))
+            pools[vlan_no] = pool
     set_network_allocator(VlanAllocator())
@@ -0,0 +1,326 @@
+"""VXLAN based ``network_allocator`` implementation.
+
+Networks are identified by 24-bit VXLAN network identifiers (VNIs), taken
+from the ranges in the ``vnis`` option of the extension's config section.
+There can be millions of those, so rather than keeping a row per VNI (as
+the vlan_pool allocator does per vlan), the database holds the *free* VNIs
+as a set of disjoint ranges (see `VniRange`). Allocating a VNI shrinks a
+range, and freeing one extends or joins its neighbours.
+
+The channels of a network with VNI ``<vni>`` are ``vxlan/native`` and
+``vxlan/<vni>``.
+"""
+
+import logging
+
+from sqlalchemy import func, select
+
+from hil.network_allocator import NetworkAllocator, set_network_allocator
+from hil.model import db
+from hil.config import cfg, core_schema
+from hil.errors import BadArgumentError, BlockedError
+
+from os.path import join, dirname
+from hil.migrations import paths
+from hil.model import BigIntegerType
+
+paths[__name__] = join(dirname(__file__), 'migrations', 'vxlan_pool')
+
+# VNIs are 24 bits:
+MAX_VNI = 2**24 - 1
+
+# The name under which the VNIs are reported by `VxlanAllocator.usage`; they
+# make up a single pool:
+DEFAULT_POOL = 'default'
+
+
+def string_has_vnis(option):
+    """Check if a string is a valid list of VNIs"""
+    for r in option.split(","):
+        r = r.strip().split("-")
+        if len(r) > 2 or \
+                not all(s.isdigit() and 0 < int(s) <= MAX_VNI for s in r):
+            return False
+    return True
+
+
+core_schema[__name__] = {
+    'vnis': string_has_vnis,
+}
+
+
+def _merge(ranges):
+    """Return the union of `ranges`, as a sorted list of disjoint ranges.
+
+    Ranges are ``(first, last)`` pairs, inclusive at both ends; adjacent
+    ranges are joined.
+    """
+    result = []
+    for first, last in sorted(ranges):
+        if result and first <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(last, result[-1][1]))
+        else:
+            result.append((first, last))
+    return result
+
+
+def _subtract(ranges, other):
+    """Return the VNIs in `ranges` but not in `other`, as merged ranges."""
+    result = []
+    other = _merge(other)
+    for first, last in _merge(ranges):
+        for other_first, other_last in other:
+            if other_last < first or other_first > last:
+                continue
+            if other_first > first:
+                result.append((first, other_first - 1))
+            first = other_last + 1
+            if first > last:
+                break
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+# The last value of the ``vnis`` option parsed by `get_vni_ranges`, and the
+# result:
+_parsed_ranges = {}
+
+
+def get_vni_ranges():
+    """Return the configured VNIs, as a sorted list of disjoint ranges.
+
+    The config is only parsed again if it has changed since the last call.
+    """
+    vni_str = cfg.get(__name__, 'vnis')
+    if vni_str not in _parsed_ranges:
+        ranges = []
+        for r in vni_str.split(","):
+            r = r.strip().split("-")
+            ranges.append((int(r[0]), int(r[-1])))
+        _parsed_ranges.clear()
+        _parsed_ranges[vni_str] = _merge(ranges)
+    return _parsed_ranges[vni_str]
+
+
+class VxlanAllocator(NetworkAllocator):
+    """An allocator of VXLAN VNIs. The interface is as specified in
+    ``NetworkAllocator``.
+
+    The free ranges are only ever changed by statements which check that
+    the range is still as it was when it was read, so concurrent
+    transactions can't both take the same VNI, or leave ranges
+    overlapping; whichever loses the race reads the ranges again and
+    retries.
+    """
+
+    def get_new_network_id(self, pool=None, project=None):
+        """Allocate the lowest-numbered free VNI.
+
+        There is only one pool of VNIs, so `pool` must be None or
+        `DEFAULT_POOL`. There are no quotas, so `project` is ignored.
+        """
+        if pool not in (None, DEFAULT_POOL):
+            raise BadArgumentError("No such VNI pool: %r" % pool)
+        table = VniRange.__table__
+        while True:
+            free = db.session.execute(
+                select([table.c.id, table.c.first_vni, table.c.last_vni])
+                .order_by(table.c.first_vni)
+                .limit(1)).first()
+            if free is None:
+                return None
+            if _take(free, free.first_vni):
+                return str(free.first_vni)
+
+    def free_network_id(self, net_id):
+        vni = int(net_id)
+        table = VniRange.__table__
+        while True:
+            if _find_range(vni) is not None:
+                logger = logging.getLogger(__name__)
+                logger.error('VNI %s is already free', net_id)
+                return
+            below = db.session.execute(
+                select([table.c.id, table.c.first_vni, table.c.last_vni])
+                .where(table.c.last_vni == vni - 1)).first()
+            above = db.session.execute(
+                select([table.c.id, table.c.first_vni, table.c.last_vni])
+                .where(table.c.first_vni == vni + 1)).first()
+            if below is not None and above is not None:
+                # Join the two ranges. `above` is removed first; if `below`
+                # has changed in the meantime, the VNIs which were in
+                # `above` become a range of their own instead.
+                if not _delete(above):
+                    continue
+                if not _update(below, last_vni=above.last_vni):
+                    _insert(vni, above.last_vni)
+                return
+            if below is not None:
+                if _update(below, last_vni=vni):
+                    return
+            elif above is not None:
+                if _update(above, first_vni=vni):
+                    return
+            else:
+                _insert(vni, vni)
+                return
+
+    def populate(self):
+        """Add the configured VNIs which haven't been added yet.
+
+        VNIs which have been added before are left alone, whether they are
+        free or allocated; `VniPoolRange` records which those are.
+        """
+        table = VniPoolRange.__table__
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Keep concurrent calls from adding the same VNIs twice:
+            db.session.execute('LOCK TABLE vni_pool_range '
+                               'IN SHARE ROW EXCLUSIVE MODE')
+        added = [(row.first_vni, row.last_vni) for row in db.session.execute(
+            select([table.c.first_vni, table.c.last_vni]))]
+        missing = _subtract(get_vni_ranges(), added)
+        if missing:
+            rows = [{'first_vni': first, 'last_vni': last}
+                    for first, last in missing]
+            db.session.execute(table.insert(), rows)
+            db.session.execute(VniRange.__table__.insert(), rows)
+        db.session.commit()
+
+    def legal_channels_for(self, net_id):
+        return ["vxlan/native",
+                "vxlan/" + net_id]
+
+    def is_legal_channel_for(self, channel_id, net_id):
+        return channel_id in self.legal_channels_for(net_id)
+
+    def get_default_channel(self):
+        return "vxlan/native"
+
+    def validate_network_id(self, net_id):
+        try:
+            return 1 <= int(net_id) <= MAX_VNI
+        except ValueError:
+            return False
+
+    def claim_network_id(self, net_id):
+        if not self.is_network_id_in_pool(net_id):
+            return
+        vni = int(net_id)
+        while True:
+            free = _find_range(vni)
+            if free is None:
+                raise BlockedError("Network ID is not available."
+                                   " Please choose a different ID.")
+            if _take(free, vni):
+                return
+
+    def is_network_id_in_pool(self, net_id):
+        try:
+            vni = int(net_id)
+        except ValueError:
+            return False
+        return any(first <= vni <= last for first, last in get_vni_ranges())
+
+    def usage(self):
+        """Count the free and used VNIs.
+
+        The counts are computed from the ranges, with one query however many
+        VNIs there are.
+        """
+        total, free = db.session.execute(select([
+            _size(VniPoolRange.__table__),
+            _size(VniRange.__table__),
+        ])).first()
+        return {DEFAULT_POOL: {'free': free, 'used': total - free}}
+
+
+def _size(table):
+    """Return a scalar subquery counting the VNIs in `table`'s ranges."""
+    return select([
+        func.coalesce(func.sum(table.c.last_vni - table.c.first_vni + 1), 0)
+    ]).as_scalar()
+
+
+def _find_range(vni):
+    """Return the free range containing `vni`, or None."""
+    table = VniRange.__table__
+    free = db.session.execute(
+        select([table.c.id, table.c.first_vni, table.c.last_vni])
+        .where(table.c.first_vni <= vni)
+        .order_by(table.c.first_vni.desc())
+        .limit(1)).first()
+    if free is None or free.last_vni < vni:
+        return None
+    return free
+
+
+def _matching(stmt, free):
+    """Restrict `stmt` to the range `free`, if it hasn't changed."""
+    table = VniRange.__table__
+    return stmt.where(table.c.id == free.id) \
+        .where(table.c.first_vni == free.first_vni) \
+        .where(table.c.last_vni == free.last_vni)
+
+
+def _update(free, **values):
+    """Change the range `free`, returning whether it was unchanged."""
+    stmt = _matching(VniRange.__table__.update(), free).values(**values)
+    return db.session.execute(stmt).rowcount == 1
+
+
+def _delete(free):
+    """Delete the range `free`, returning whether it was unchanged."""
+    stmt = _matching(VniRange.__table__.delete(), free)
+    return db.session.execute(stmt).rowcount == 1
+
+
+def _insert(first_vni, last_vni):
+    """Add a new free range."""
+    db.session.execute(VniRange.__table__.insert()
+                       .values(first_vni=first_vni, last_vni=last_vni))
+
+
+def _take(free, vni):
+    """Remove `vni` from the range `free`.
+
+    Returns False, having changed nothing, if the range has changed since
+    it was read.
+    """
+    if free.first_vni == free.last_vni:
+        return _delete(free)
+    if vni == free.first_vni:
+        return _update(free, first_vni=vni + 1)
+    if vni == free.last_vni:
+        return _update(free, last_vni=vni - 1)
+    # Split the range in two:
+    if not _update(free, last_vni=vni - 1):
+        return False
+    _insert(vni + 1, free.last_vni)
+    return True
+
+
+class VniRange(db.Model):
+    """A range of free VNIs, from `first_vni` to `last_vni` inclusive.
+
+    Free ranges never overlap, but adjacent ones are not always joined.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+    first_vni = db.Column(db.Integer, nullable=False, index=True)
+    last_vni = db.Column(db.Integer, nullable=False, index=True)
+
+
+class VniPoolRange(db.Model):
+    """A range of VNIs which has been added to the pool by `populate`.
+
+    This lets `populate` tell VNIs which are allocated (which aren't in any
+    `VniRange`) from those which have never been added.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+    first_vni = db.Column(db.Integer, nullable=False)
+    last_vni = db.Column(db.Integer, nullable=False)
+
+
+def setup(*args, **kwargs):
+    """Register a VxlanAllocator as the network allocator."""
+    set_network_allocator(VxlanAllocator())
@@ -1,12 +1,27 @@
-"""IPMI driver for implementing out of band management. """
+"""IPMI driver for implementing out of band management.
+
+Power and boot device commands are sent over IPMI-over-LAN sessions which
+are kept open between commands (see `hil.ext.obm.ipmi_lan`), falling back to
+ipmitool for BMCs which won't open such a session. Set ``transport`` to
+``ipmitool`` in the ``[hil.ext.obm.ipmi]`` section of hil.cfg to always use
+ipmitool. Consoles always use ipmitool.
+"""
 
 import schema
 import logging
+import threading
+import time
+
+from schema import And, Optional
 
+from hil import console_follow, console_logs, console_supervisor, \
+    obm_jobs
+from hil.config import cfg, core_schema, string_is_nonnegative_int
+from hil.ext.obm import ipmi_lan
 from hil.model import db, Obm
 from hil.errors import OBMError, BadArgumentError
 from hil.dev_support import no_dry_run
-from subprocess import call, Popen, PIPE
+from subprocess import Popen
 import os
 
 from os.path import join, dirname
@@ -19,6 +34,32 @@ paths[__name__] = join(dirname(__file__), 'migrations', 'ipmi')
 BigIntegerType = BigInteger().with_variant(
                 sqlite.INTEGER(), 'sqlite')
 
+core_schema[Optional(__name__)] = {
+    Optional('transport'): And(str, lambda s: s in ('native', 'ipmitool')),
+    Optional('port'): string_is_nonnegative_int,
+    Optional('session_idle_timeout'): string_is_nonnegative_int,
+}
+
+# How long (in seconds) to keep open sessions which aren't being used, unless
+# set in hil.cfg:
+DEFAULT_SESSION_IDLE_TIMEOUT = 30
+
+# How long (in seconds) to use ipmitool for a BMC which wouldn't open a
+# session, before trying again:
+FALLBACK_PERIOD = 600
+
+# Map from BMC hosts which wouldn't open a session to the time until which
+# we use ipmitool for them:
+_fallback_until = {}
+_fallback_lock = threading.Lock()
+
+
+def _option(name, default):
+    """Return option `name` from our section of hil.cfg, or `default`."""
+    if cfg.has_option(__name__, name):
+        return cfg.get(__name__, name)
+    return default
+
 
 class Ipmi(Obm):
     """IPMI obm driver"""
@@ -45,20 +86,76 @@ class Ipmi(Obm):
             'password': basestring,
             }).validate(kwargs)
 
+    def _ipmi(self, args):
+        """Send a command to this node's BMC.
+
+        `args` are the arguments for ipmitool, as for `_ipmitool`, and the
+        return value is likewise 0 on success. If the native transport is
+        enabled and supports the command, it is sent over an existing
+        session, or a new one. Otherwise, or if no session can be
+        established, ipmitool is used.
+        """
+        request = ipmi_lan.command_for(args)
+        if request is None or _option('transport', 'native') != 'native':
+            return self._ipmitool(args)
+        with _fallback_lock:
+            if _fallback_until.get(self.host, 0) > time.time():
+                return self._ipmitool(args)
+        try:
+            status = ipmi_lan.run(
+                self.host,
+                int(_option('port', ipmi_lan.DEFAULT_PORT)),
+                self.user,
+                self.password,
+                request,
+                obm_jobs.timeout(),
+                int(_option('session_idle_timeout',
+                            DEFAULT_SESSION_IDLE_TIMEOUT)))
+        except ipmi_lan.SessionError as e:
+            logger = logging.getLogger(__name__)
+            logger.info('Falling back to ipmitool for %s: %s', self.host, e)
+            with _fallback_lock:
+                _fallback_until[self.host] = time.time() + FALLBACK_PERIOD
+            return self._ipmitool(args)
+        if status is None:
+            # The command timed out:
+            return -1
+        if status != 0:
+            logger = logging.getLogger(__name__)
+            logger.info('Completion code %#x from %s, args = %r',
+                        status, self.host, args)
+        return status
+
     def _ipmitool(self, args):
         """Invoke ipmitool with the right host/pass etc. for this node.
 
         `args`- A list of any additional arguments to pass to ipmitool.
         Returns the exit status of ipmitool.
 
+        If ipmitool takes longer than the ``timeout`` in the ``[obm]``
+        section of hil.cfg (e.g. because the BMC doesn't respond), it is
+        killed, and the exit status is nonzero.
+
         Note: Includes the ``-I lanplus`` flag, available only in IPMI v2+.
         This is needed for machines which do not accept the older version.
         """
-        status = call(['ipmitool',
-                       '-I', 'lanplus',  # see docstring above
-                       '-U', self.user,
-                       '-P', self.password,
-                       '-H', self.host] + args)
+        proc = Popen(['ipmitool',
+                      '-I', 'lanplus',  # see docstring above
+                      '-U', self.user,
+                      '-P', self.password,
+                      '-H', self.host] + args)
+        deadline = time.time() + obm_jobs.timeout()
+        status = proc.poll()
+        while status is None and time.time() < deadline:
+            time.sleep(0.05)
+            status = proc.poll()
+        if status is None:
+            proc.kill()
+            proc.wait()
+            logger = logging.getLogger(__name__)
+            logger.error('ipmitool timed out talking to %s, args = %r',
+                         self.host, args)
+            return -1
 
         if status != 0:
             logger = logging.getLogger(__name__)
@@ -67,26 +164,26 @@ class Ipmi(Obm):
 
     @no_dry_run
     def power_cycle(self, force):
-        self._ipmitool(['chassis', 'bootdev', 'pxe'])
+        self._ipmi(['chassis', 'bootdev', 'pxe'])
         if force:
             op = 'reset'
         else:
             op = 'cycle'
-        if self._ipmitool(['chassis', 'power', op]) == 0:
+        if self._ipmi(['chassis', 'power', op]) == 0:
             return
-        if self._ipmitool(['chassis', 'power', 'on']) == 0:
+        if self._ipmi(['chassis', 'power', 'on']) == 0:
             # power cycle will fail if the machine is not running.
             # To avoid such a situation, just turn it on anyways.
             # Doing this saves power by turning things off without
             # Without breaking the HIL.
             return
         # If it is still does not work, then it is a real error:
-        raise OBMError('Could not power cycle node %s' % self.node.label)
+        raise OBMError('Could not power cycle node with BMC %s' % self.host)
 
     @no_dry_run
     def power_off(self):
-        if self._ipmitool(['chassis', 'power', 'off']) != 0:
-            raise OBMError('Could not power off node %s', self.label)
+        if self._ipmi(['chassis', 'power', 'off']) != 0:
+            raise OBMError('Could not power off node with BMC %s' % self.host)
 
     def require_legal_bootdev(self, dev):
         if dev not in self.valid_bootdevices:
@@ -95,55 +192,44 @@ class Ipmi(Obm):
     @no_dry_run
     def set_bootdev(self, dev):
         self.require_legal_bootdev(dev)
-        if self._ipmitool(['chassis', 'bootdev', dev,
-                          'options=persistent']) != 0:
+        if self._ipmi(['chassis', 'bootdev', dev,
+                      'options=persistent']) != 0:
             raise OBMError('Could not set boot device')
 
+    def _sol_command(self, action):
+        """Return the ipmitool command to `action` (e.g. activate) SOL."""
+        return ['ipmitool',
+                '-H', self.host,
+                '-U', self.user,
+                '-P', self.password,
+                '-I', 'lanplus',
+                'sol', action]
+
     @no_dry_run
     def start_console(self):
-        """Starts logging the IPMI console."""
-
-        # stdin and stderr are redirected to a PIPE that is never read in order
-        # to prevent stdout from becoming garbled.  This happens because
-        # ipmitool sets shell settings to behave like a tty when communicateing
-        # over Serial over Lan
-        Popen(
-            ['ipmitool',
-             '-H', self.host,
-             '-U', self.user,
-             '-P', self.password,
-             '-I', 'lanplus',
-             'sol', 'activate'],
-            stdin=PIPE,
-            stdout=open(self.get_console_log_filename(), 'a'),
-            stderr=PIPE)
-
-    # stdin, stdout, and stderr are redirected to a pipe that is never read
-    # because we are not interested in the ouput of this command.
+        """Starts logging the IPMI console.
+
+        The console supervisor runs ipmitool, deactivating any SOL session
+        left behind by a previous one first.
+        """
+        console_supervisor.start(self.get_console_log_filename(),
+                                 self._sol_command('activate'),
+                                 self._sol_command('deactivate'))
+
     @no_dry_run
     def stop_console(self):
-        call(['pkill', '-f', 'ipmitool -H %s' % self.host])
-        proc = Popen(
-            ['ipmitool',
-             '-H', self.host,
-             '-U', self.user,
-             '-P', self.password,
-             '-I', 'lanplus',
-             'sol', 'deactivate'],
-            stdin=PIPE,
-            stdout=PIPE,
-            stderr=PIPE)
-        proc.wait()
+        console_supervisor.stop(self.get_console_log_filename())
 
     def delete_console(self):
-        if os.path.isfile(self.get_console_log_filename()):
-            os.remove(self.get_console_log_filename())
+        console_logs.delete(self.get_console_log_filename())
+
+    def get_console(self, offset=None, tail=None):
+        return console_logs.read(self.get_console_log_filename(),
+                                 offset, tail)
 
-    def get_console(self):
-        if not os.path.isfile(self.get_console_log_filename()):
-            return None
-        with open(self.get_console_log_filename(), 'r') as log:
-            return "".join(i for i in log.read() if ord(i) < 128)
+    def follow_console(self, offset=None, tail=None):
+        return console_follow.follow(self.get_console_log_filename(),
+                                     offset, tail)
 
     def get_console_log_filename(self):
-        return '/var/run/hil_console_logs/%s.log' % self.host
+        return os.path.join(console_logs.log_dir(), '%s.log' % self.host)
@@ -0,0 +1,440 @@
+"""A minimal IPMI v2.0 (RMCP+) client, which keeps its sessions open.
+
+Establishing an RMCP+ session takes four round trips to the BMC, and
+ipmitool does this afresh for every command. The ipmi OBM driver instead
+sends the commands it can through this module, which keeps one
+authenticated session per BMC, reuses it for consecutive commands, and
+closes it once it has been idle for ``session_idle_timeout`` seconds.
+
+Only what the ipmi driver needs is implemented: sessions use cipher suite 2
+(RAKP-HMAC-SHA1 authentication, HMAC-SHA1-96 integrity, and no
+confidentiality, which needs nothing beyond the standard library), and the
+commands are the chassis power and boot device commands (see
+`command_for`). If a BMC can't be reached or won't open such a session,
+`run` raises `SessionError`, and the driver falls back to ipmitool.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The standard RMCP port:
+DEFAULT_PORT = 623
+
+# How long to wait for each reply before resending a request:
+RETRY_INTERVAL = 1
+
+# The longest to wait for a session to be established, or for a reused
+# session (which the BMC may have dropped) to respond. These are kept short,
+# so that there is time to try again, or fall back to ipmitool:
+QUICK_TIMEOUT = 5
+
+# The RMCP header of IPMI packets: version 6, no sequence number or ack,
+# class IPMI.
+_RMCP_HEADER = '\x06\x00\xff\x07'
+
+# Session header authentication type for RMCP+:
+_AUTH_RMCPP = 0x06
+
+# Payload types, and the flag set on authenticated payloads:
+PAYLOAD_IPMI = 0x00
+PAYLOAD_OPEN_SESSION_REQUEST = 0x10
+PAYLOAD_OPEN_SESSION_RESPONSE = 0x11
+PAYLOAD_RAKP1 = 0x12
+PAYLOAD_RAKP2 = 0x13
+PAYLOAD_RAKP3 = 0x14
+PAYLOAD_RAKP4 = 0x15
+AUTHENTICATED = 0x40
+
+# Slave addresses of the BMC and of remote consoles:
+BMC_ADDRESS = 0x20
+CONSOLE_ADDRESS = 0x81
+
+# Privilege level requested for sessions (administrator), and the same with
+# the "name-only lookup" bit, as sent in RAKP message 1:
+_ADMIN = 0x04
+_ADMIN_NAME_ONLY = 0x14
+
+# Network functions and commands:
+NETFN_CHASSIS = 0x00
+NETFN_APP = 0x06
+CMD_CHASSIS_CONTROL = 0x02
+CMD_SET_BOOT_OPTIONS = 0x08
+CMD_CLOSE_SESSION = 0x3c
+
+# Arguments to the chassis control command, by ipmitool's name for them:
+CHASSIS_CONTROLS = {
+    'off': 0x00,
+    'on': 0x01,
+    'cycle': 0x02,
+    'reset': 0x03,
+}
+
+# Boot device selectors (the second byte of the boot flags boot option), by
+# ipmitool's name for them:
+BOOT_DEVICES = {
+    'none': 0x00,
+    'pxe': 0x04,
+    'disk': 0x08,
+}
+
+
+class SessionError(Exception):
+    """The BMC could not be reached, or would not open a session."""
+
+
+def command_for(args):
+    """Translate ipmitool arguments into an IPMI request.
+
+    `args` is a list of arguments for ipmitool, as passed to
+    `hil.ext.obm.ipmi.Ipmi._ipmitool`. Returns a (netfn, command, data)
+    tuple, where data is a string, or None if the command isn't supported.
+    """
+    if args[:2] == ['chassis', 'power'] and len(args) == 3 and \
+            args[2] in CHASSIS_CONTROLS:
+        return (NETFN_CHASSIS, CMD_CHASSIS_CONTROL,
+                chr(CHASSIS_CONTROLS[args[2]]))
+    if args[:2] == ['chassis', 'bootdev'] and len(args) in (3, 4) and \
+            args[2] in BOOT_DEVICES:
+        # Parameter 5 is the boot flags; the first byte marks them valid,
+        # and for all future boots, rather than just the next one, if asked.
+        flags = 0x80
+        if args[3:] == ['options=persistent']:
+            flags |= 0x40
+        elif args[3:]:
+            return None
+        return (NETFN_CHASSIS, CMD_SET_BOOT_OPTIONS,
+                struct.pack('6B', 5, flags, BOOT_DEVICES[args[2]], 0, 0, 0))
+    return None
+
+
+def checksum(data):
+    """Return the IPMI checksum of the string `data`."""
+    return -sum(bytearray(data)) & 0xff
+
+
+def ipmi_message(address, netfn, lun_and_seq, command, data, source):
+    """Build an IPMI message, from `source` to `address`.
+
+    `netfn` is the network function (which is odd for responses), and
+    `lun_and_seq` the requester's sequence number and LUN, as encoded in the
+    message.
+    """
+    header = struct.pack('BB', address, netfn << 2)
+    body = struct.pack('BBB', source, lun_and_seq, command) + data
+    return header + chr(checksum(header)) + body + chr(checksum(body))
+
+
+def hmac_sha1(key, data):
+    """Return the HMAC-SHA1 of `data` under `key`."""
+    return hmac.new(key, data, hashlib.sha1).digest()
+
+
+def session_packet(payload_type, session_id, seq, payload, k1=None):
+    """Build an RMCP+ packet.
+
+    If `k1` is not None, the packet is authenticated with it, using
+    HMAC-SHA1-96.
+    """
+    if k1 is not None:
+        payload_type |= AUTHENTICATED
+    body = struct.pack('<BBIIH', _AUTH_RMCPP, payload_type, session_id, seq,
+                       len(payload)) + payload
+    if k1 is None:
+        return _RMCP_HEADER + body
+    # Pad so that the integrity data (from the auth type on) is a multiple
+    # of four bytes long; the 2 is for the pad length and next header bytes:
+    pad = -(len(body) + 2) % 4
+    body += '\xff' * pad + struct.pack('BB', pad, 0x07)
+    return _RMCP_HEADER + body + hmac_sha1(k1, body)[:12]
+
+
+def parse_session_packet(packet, k1=None):
+    """Parse an RMCP+ packet built by `session_packet`.
+
+    Returns a (payload type, session id, payload) tuple, with the
+    authenticated flag cleared from the payload type, or None if the packet
+    is malformed, or isn't authenticated with `k1` (when `k1` is given).
+    """
+    if len(packet) < 16 or packet[:4] != _RMCP_HEADER or \
+            ord(packet[4]) != _AUTH_RMCPP:
+        return None
+    payload_type, session_id, _, length = \
+        struct.unpack('<BIIH', packet[5:16])
+    payload = packet[16:16 + length]
+    if len(payload) != length:
+        return None
+    if k1 is not None:
+        if not payload_type & AUTHENTICATED or len(packet) < 16 + length + 14:
+            return None
+        body, auth_code = packet[4:-12], packet[-12:]
+        if not hmac.compare_digest(hmac_sha1(k1, body)[:12], auth_code):
+            return None
+    return payload_type & ~AUTHENTICATED, session_id, payload
+
+
+class Session(object):
+    """An RMCP+ session with a BMC.
+
+    Sessions aren't thread safe; `run` makes sure each is used by one thread
+    at a time.
+    """
+
+    def __init__(self, host, port, user, password):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sock = None
+        # Our session id, and the BMC's:
+        self.console_id = None
+        self.bmc_id = None
+        self.k1 = None
+        # The next session sequence number, and the last requester sequence
+        # number used (which is only 6 bits):
+        self.seq = 1
+        self.rq_seq = 0
+        self.last_used = time.time()
+
+    def open(self, deadline):
+        """Establish the session.
+
+        Raises SessionError if it can't be established by the time
+        `deadline` (a `time.time()` value) is reached.
+        """
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.host, self.port))
+        except socket.error as e:
+            self.close()
+            raise SessionError('Could not contact %s: %s' % (self.host, e))
+        self.console_id = struct.unpack('<I', os.urandom(4))[0] | 1
+        user = self.user.encode('utf-8')
+        kuid = self.password.encode('utf-8').ljust(20, '\0')[:20]
+        role = struct.pack('BB', _ADMIN_NAME_ONLY, len(user)) + user
+
+        # Open session request, asking for cipher suite 2:
+        reply = self._handshake(
+            PAYLOAD_OPEN_SESSION_REQUEST,
+            struct.pack('<BBHI', 0, _ADMIN, 0, self.console_id) +
+            struct.pack('<BHBB3x', 0, 0, 8, 1) +  # RAKP-HMAC-SHA1
+            struct.pack('<BHBB3x', 1, 0, 8, 1) +  # HMAC-SHA1-96
+            struct.pack('<BHBB3x', 2, 0, 8, 0),   # no confidentiality
+            PAYLOAD_OPEN_SESSION_RESPONSE, 12, deadline)
+        self.bmc_id = struct.unpack('<I', reply[8:12])[0]
+
+        # RAKP messages 1 and 2:
+        console_random = os.urandom(16)
+        reply = self._handshake(
+            PAYLOAD_RAKP1,
+            struct.pack('<B3xI', 0, self.bmc_id) + console_random +
+            struct.pack('BxxB', _ADMIN_NAME_ONLY, len(user)) + user,
+            PAYLOAD_RAKP2, 60, deadline)
+        bmc_random, guid, auth_code = reply[8:24], reply[24:40], reply[40:60]
+        expected = hmac_sha1(kuid,
+                             struct.pack('<II', self.console_id, self.bmc_id) +
+                             console_random + bmc_random + guid + role)
+        if not hmac.compare_digest(expected, auth_code):
+            self.close()
+            raise SessionError('%s sent a bad RAKP 2 message' % self.host)
+
+        # RAKP messages 3 and 4:
+        sik = hmac_sha1(kuid, console_random + bmc_random + role)
+        reply = self._handshake(
+            PAYLOAD_RAKP3,
+            struct.pack('<BBxxI', 0, 0, self.bmc_id) +
+            hmac_sha1(kuid, bmc_random +
+                      struct.pack('<I', self.console_id) + role),
+            PAYLOAD_RAKP4, 20, deadline)
+        expected = hmac_sha1(sik, console_random +
+                             struct.pack('<I', self.bmc_id) + guid)[:12]
+        if not hmac.compare_digest(expected, reply[8:20]):
+            self.close()
+            raise SessionError('%s sent a bad RAKP 4 message' % self.host)
+        self.k1 = hmac_sha1(sik, '\x01' * 20)
+        self.last_used = time.time()
+
+    def _handshake(self, payload_type, payload, reply_type, reply_length,
+                   deadline):
+        """Send one of the messages which establish the session.
+
+        Returns the reply, which is of type `reply_type`, and at least
+        `reply_length` bytes long. Raises SessionError if there is no reply,
+        or the BMC reports an error.
+        """
+        packet = session_packet(payload_type, 0, 0, payload)
+
+        def _match(parsed):
+            """Check if `parsed` is the reply."""
+            return parsed[0] == reply_type and len(parsed[2]) >= 8 and \
+                struct.unpack('<I', parsed[2][4:8])[0] == self.console_id
+        parsed = self._exchange(packet, None, _match, deadline)
+        if parsed is None:
+            self.close()
+            raise SessionError('No response from %s' % self.host)
+        reply = parsed[2]
+        status = ord(reply[1])
+        if status != 0 or len(reply) < reply_length:
+            self.close()
+            raise SessionError('%s refused a session (status %d)'
+                               % (self.host, status))
+        return reply
+
+    def _exchange(self, packet, k1, match, deadline):
+        """Send `packet` until a reply for which `match` is true arrives.
+
+        Replies are parsed with `parse_session_packet`. Returns the parsed
+        reply, or None if none arrives by `deadline`.
+        """
+        while time.time() < deadline:
+            try:
+                self.sock.send(packet)
+                resend_at = min(time.time() + RETRY_INTERVAL, deadline)
+                while time.time() < resend_at:
+                    self.sock.settimeout(max(resend_at - time.time(), 0.001))
+                    try:
+                        parsed = parse_session_packet(self.sock.recv(4096),
+                                                      k1)
+                    except socket.timeout:
+                        break
+                    if parsed is not None and match(parsed):
+                        return parsed
+            except socket.error as e:
+                logger.info('Error talking to %s: %s', self.host, e)
+                time.sleep(max(min(RETRY_INTERVAL, deadline - time.time()),
+                               0))
+        return None
+
+    def command(self, netfn, command, data, deadline):
+        """Send an IPMI request, and return its completion code.
+
+        Returns None if there is no response by `deadline`.
+        """
+        self.rq_seq = (self.rq_seq + 1) % 64
+        rq_seq = self.rq_seq
+        message = ipmi_message(BMC_ADDRESS, netfn, rq_seq << 2, command,
+                               data, CONSOLE_ADDRESS)
+
+        def _match(parsed):
+            """Check if `parsed` is the response."""
+            payload_type, session_id, reply = parsed
+            return payload_type == PAYLOAD_IPMI and \
+                session_id == self.console_id and len(reply) >= 8 and \
+                ord(reply[1]) >> 2 == netfn + 1 and \
+                ord(reply[4]) >> 2 == rq_seq and ord(reply[5]) == command
+
+        # Each transmission needs a new sequence number, so packets are built
+        # as they are sent:
+        parsed = None
+        while parsed is None and time.time() < deadline:
+            packet = session_packet(PAYLOAD_IPMI, self.bmc_id, self.seq,
+                                    message, self.k1)
+            self.seq = (self.seq + 1) & 0xffffffff or 1
+            parsed = self._exchange(packet, self.k1, _match,
+                                    min(time.time() + RETRY_INTERVAL,
+                                        deadline))
+        self.last_used = time.time()
+        if parsed is None:
+            return None
+        return ord(parsed[2][6])
+
+    def close(self, notify=True):
+        """Close the session, if it is open, and its socket.
+
+        If `notify` is false, the BMC isn't told; this is for sessions it
+        has stopped responding on.
+        """
+        if self.k1 is not None and notify:
+            self.command(NETFN_APP, CMD_CLOSE_SESSION,
+                         struct.pack('<I', self.bmc_id),
+                         time.time() + RETRY_INTERVAL)
+        self.k1 = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class _SessionCache(object):
+    """The open sessions of a process, by BMC."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # Map from (host, port, user, password) to (lock, session) pairs:
+        self.sessions = {}
+
+    def get(self, key):
+        """Return the lock and session (or None) for `key`."""
+        with self.lock:
+            if self.pid != os.getpid():
+                # We've been forked; the sessions belong to our parent:
+                self.sessions = {}
+                self.pid = os.getpid()
+            return self.sessions.setdefault(key, (threading.Lock(), [None]))
+
+    def expire(self, idle_timeout):
+        """Close the sessions which have been idle for `idle_timeout`."""
+        with self.lock:
+            entries = list(self.sessions.values())
+        for lock, holder in entries:
+            # Sessions in use aren't idle:
+            if not lock.acquire(False):
+                continue
+            try:
+                session = holder[0]
+                if session is not None and \
+                        time.time() - session.last_used > idle_timeout:
+                    session.close()
+                    holder[0] = None
+            finally:
+                lock.release()
+
+
+_cache = _SessionCache()
+
+
+def run(host, port, user, password, request, timeout, idle_timeout):
+    """Send `request`, as returned by `command_for`, to a BMC.
+
+    The session with the BMC is reused if there is one, and otherwise
+    established. Sessions which have been idle for more than
+    `idle_timeout` seconds are closed first. Returns the completion code
+    (0 for success), or None if there is no response within `timeout`
+    seconds. Raises SessionError if no session can be established.
+    """
+    _cache.expire(idle_timeout)
+    deadline = time.time() + timeout
+    netfn, command, data = request
+    lock, holder = _cache.get((host, port, user, password))
+    with lock:
+        if holder[0] is not None:
+            completion_code = holder[0].command(
+                netfn, command, data,
+                min(deadline, time.time() + QUICK_TIMEOUT))
+            if completion_code is not None:
+                return completion_code
+            # The BMC has probably dropped the session (e.g. it timed it out
+            # sooner than we did), so try a new one:
+            logger.info('No response from %s on an existing session', host)
+            holder[0].close(notify=False)
+            holder[0] = None
+        session = Session(host, port, user, password)
+        session.open(min(deadline, time.time() + QUICK_TIMEOUT))
+        completion_code = session.command(netfn, command, data, deadline)
+        if completion_code is None:
+            session.close(notify=False)
+        else:
+            holder[0] = session
+        return completion_code
+
+
+def close_all():
+    """Close all open sessions."""
+    _cache.expire(-1)
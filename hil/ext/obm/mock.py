@@ -3,6 +3,7 @@
 from sqlalchemy import Column, String, ForeignKey
 import schema
 
+from hil import console_logs
 from hil.model import Obm
 
 from os.path import join, dirname
@@ -63,10 +64,18 @@ class MockObm(Obm):
     def delete_console(self):
         return
 
-    def get_console(self):
+    def get_console(self, offset=None, tail=None):
         state = LOCAL_STATE[self.id]
         if state['console']:
-            return "Some console output"
+            output = "Some console output"
+            start = console_logs.start_offset(len(output), offset, tail)
+            return len(output), [output[start:]]
+
+    def follow_console(self, offset=None, tail=None):
+        # The mock console never gets any more output:
+        log = self.get_console(offset, tail)
+        if log is not None:
+            return log[1]
 
     def get_console_log_filename(self):
         return
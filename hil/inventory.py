@@ -0,0 +1,333 @@
+"""Bulk export and import of the HIL inventory.
+
+The inventory is the set of projects, switches, ports, nodes, nics, networks
+and network attachments known to HIL. `export_records` produces it as a
+stream of plain dictionaries, and `import_records` recreates the objects
+from such a stream, so the output of one can be fed to the other.
+
+Each record has a ``type`` key naming the kind of object it describes; the
+remaining keys depend on the type. Records are produced in dependency order
+(e.g. a nic's node and port always come before the nic), which is also the
+order `import_records` expects.
+
+Headnodes and users are not part of the inventory.
+"""
+
+import json
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import with_polymorphic
+
+from hil import model, errors
+from hil.model import db
+from hil.class_resolver import concrete_class_for
+from hil.network_allocator import get_network_allocator
+
+# Number of rows fetched from the database at a time while exporting. On
+# postgres, this is the size of each batch pulled from the server-side
+# cursor.
+BATCH_SIZE = 1000
+
+# The legal values for the ``type`` key of a record, in the order in which
+# `export_records` produces them.
+RECORD_TYPES = ('project', 'switch', 'port', 'node', 'metadata', 'nic',
+                'network', 'network_access', 'attachment')
+
+
+def _driver_params(obj, base):
+    """Return the driver-specific columns of ``obj`` as a dictionary.
+
+    ``base`` is the class at the top of the driver hierarchy (e.g.
+    ``model.Switch``); its columns are skipped, since they are not arguments
+    to the driver's constructor.
+    """
+    base_keys = set(attr.key for attr in inspect(base).column_attrs)
+    return dict((attr.key, getattr(obj, attr.key))
+                for attr in inspect(type(obj)).column_attrs
+                if attr.key not in base_keys)
+
+
+def _stream(query):
+    """Iterate over ``query`` in batches of `BATCH_SIZE` rows."""
+    return query.yield_per(BATCH_SIZE)
+
+
+def export_records():
+    """Generate a record for each object in the inventory.
+
+    This must be run inside of an app context. The objects are fetched
+    in batches, so memory use does not grow with the size of the inventory.
+    """
+    for (label,) in _stream(db.session.query(model.Project.label)
+                            .order_by(model.Project.id)):
+        yield {'type': 'project', 'label': label}
+
+    switches = with_polymorphic(model.Switch, '*')
+    for switch in _stream(db.session.query(switches)
+                          .order_by(switches.id)):
+        yield {'type': 'switch',
+               'label': switch.label,
+               'driver': switch.type,
+               'params': _driver_params(switch, model.Switch)}
+
+    for port, switch in _stream(
+            db.session.query(model.Port.label, model.Switch.label)
+            .join(model.Switch, model.Port.owner_id == model.Switch.id)
+            .order_by(model.Port.id)):
+        yield {'type': 'port', 'switch': switch, 'label': port}
+
+    obms = with_polymorphic(model.Obm, '*')
+    for node, obm, project in _stream(
+            db.session.query(model.Node, obms, model.Project.label)
+            .join(obms, model.Node.obm_id == obms.id)
+            .outerjoin(model.Project,
+                       model.Node.project_id == model.Project.id)
+            .order_by(model.Node.id)):
+        obm_info = _driver_params(obm, model.Obm)
+        obm_info['type'] = obm.type
+        yield {'type': 'node',
+               'label': node.label,
+               'project': project,
+               'obm': obm_info,
+               'obmd': {'uri': node.obmd_uri,
+                        'admin_token': node.obmd_admin_token}}
+
+    for label, value, node in _stream(
+            db.session.query(model.Metadata.label,
+                             model.Metadata.value,
+                             model.Node.label)
+            .join(model.Node, model.Metadata.owner_id == model.Node.id)
+            .order_by(model.Metadata.id)):
+        yield {'type': 'metadata',
+               'node': node,
+               'label': label,
+               'value': json.loads(value)}
+
+    for nic, macaddr, node, port, switch in _stream(
+            db.session.query(model.Nic.label,
+                             model.Nic.mac_addr,
+                             model.Node.label,
+                             model.Port.label,
+                             model.Switch.label)
+            .join(model.Node, model.Nic.owner_id == model.Node.id)
+            .outerjoin(model.Port, model.Nic.port_id == model.Port.id)
+            .outerjoin(model.Switch, model.Port.owner_id == model.Switch.id)
+            .order_by(model.Nic.id)):
+        yield {'type': 'nic',
+               'node': node,
+               'label': nic,
+               'macaddr': macaddr,
+               'switch': switch,
+               'port': port}
+
+    for label, network_id, allocated, owner in _stream(
+            db.session.query(model.Network.label,
+                             model.Network.network_id,
+                             model.Network.allocated,
+                             model.Project.label)
+            .outerjoin(model.Project,
+                       model.Network.owner_id == model.Project.id)
+            .order_by(model.Network.id)):
+        yield {'type': 'network',
+               'label': label,
+               'owner': owner,
+               'network_id': network_id,
+               'allocated': allocated}
+
+    access = model.network_projects
+    for network, project in _stream(
+            db.session.query(model.Network.label, model.Project.label)
+            .select_from(access)
+            .join(model.Network, access.c.network_id == model.Network.id)
+            .join(model.Project, access.c.project_id == model.Project.id)
+            .order_by(model.Network.id, model.Project.id)):
+        yield {'type': 'network_access',
+               'network': network,
+               'project': project}
+
+    for channel, network, nic, node in _stream(
+            db.session.query(model.NetworkAttachment.channel,
+                             model.Network.label,
+                             model.Nic.label,
+                             model.Node.label)
+            .join(model.Network,
+                  model.NetworkAttachment.network_id == model.Network.id)
+            .join(model.Nic, model.NetworkAttachment.nic_id == model.Nic.id)
+            .join(model.Node, model.Nic.owner_id == model.Node.id)
+            .order_by(model.NetworkAttachment.id)):
+        yield {'type': 'attachment',
+               'node': node,
+               'nic': nic,
+               'network': network,
+               'channel': channel}
+
+
+def export_ndjson():
+    """Like `export_records`, but yields newline-delimited JSON."""
+    for record in export_records():
+        yield json.dumps(record, sort_keys=True) + '\n'
+
+
+class _Importer(object):
+    """Recreates inventory objects from records.
+
+    Objects created during the import are remembered by label, so that
+    records referring to them don't need to go back to the database.
+    """
+
+    def __init__(self):
+        self.projects = {}
+        self.switches = {}
+        self.ports = {}
+        self.nodes = {}
+        self.nics = {}
+        self.networks = {}
+
+    def _get(self, cache, cls, label):
+        """Look up the ``cls`` named ``label``, in ``cache`` or the db."""
+        if label not in cache:
+            obj = cls.query.filter_by(label=label).one_or_none()
+            if obj is None:
+                raise errors.NotFoundError("%s %s does not exist." %
+                                           (cls.__name__, label))
+            cache[label] = obj
+        return cache[label]
+
+    def _get_project(self, label):
+        """Return the project named ``label``, or None if label is None."""
+        if label is None:
+            return None
+        return self._get(self.projects, model.Project, label)
+
+    def _absent(self, cls, label):
+        """Raise a DuplicateError if the ``cls`` named ``label`` exists."""
+        if cls.query.filter_by(label=label).first() is not None:
+            raise errors.DuplicateError("%s %s already exists." %
+                                        (cls.__name__, label))
+
+    def project(self, record):
+        """Import a project record."""
+        self._absent(model.Project, record['label'])
+        project = model.Project(record['label'])
+        db.session.add(project)
+        self.projects[project.label] = project
+
+    def switch(self, record):
+        """Import a switch record."""
+        self._absent(model.Switch, record['label'])
+        cls = concrete_class_for(model.Switch, record['driver'])
+        if cls is None:
+            raise errors.BadArgumentError(
+                '%r is not a valid switch type.' % record['driver'])
+        switch = cls(**record['params'])
+        switch.label = record['label']
+        switch.type = record['driver']
+        db.session.add(switch)
+        self.switches[switch.label] = switch
+
+    def port(self, record):
+        """Import a port record."""
+        switch = self._get(self.switches, model.Switch, record['switch'])
+        port = model.Port(record['label'], switch)
+        db.session.add(port)
+        self.ports[(switch.label, port.label)] = port
+
+    def node(self, record):
+        """Import a node record."""
+        self._absent(model.Node, record['label'])
+        obm_type = record['obm']['type']
+        cls = concrete_class_for(model.Obm, obm_type)
+        if cls is None:
+            raise errors.BadArgumentError(
+                '%r is not a valid OBM type.' % obm_type)
+        node = model.Node(label=record['label'],
+                          obmd_uri=record['obmd']['uri'],
+                          obmd_admin_token=record['obmd']['admin_token'],
+                          obm=cls(**record['obm']))
+        node.project = self._get_project(record['project'])
+        db.session.add(node)
+        self.nodes[node.label] = node
+
+    def metadata(self, record):
+        """Import a metadata record."""
+        node = self._get(self.nodes, model.Node, record['node'])
+        db.session.add(model.Metadata(record['label'],
+                                      json.dumps(record['value']),
+                                      node))
+
+    def nic(self, record):
+        """Import a nic record."""
+        node = self._get(self.nodes, model.Node, record['node'])
+        nic = model.Nic(node, record['label'], record['macaddr'])
+        if record['port'] is not None:
+            key = (record['switch'], record['port'])
+            if key not in self.ports:
+                switch = self._get(self.switches, model.Switch,
+                                   record['switch'])
+                port = model.Port.query \
+                    .filter_by(owner=switch, label=record['port']) \
+                    .one_or_none()
+                if port is None:
+                    raise errors.NotFoundError(
+                        "Port %s on switch %s does not exist." %
+                        (record['port'], record['switch']))
+                self.ports[key] = port
+            nic.port = self.ports[key]
+        db.session.add(nic)
+        self.nics[(node.label, nic.label)] = nic
+
+    def network(self, record):
+        """Import a network record."""
+        self._absent(model.Network, record['label'])
+        if record['allocated']:
+            get_network_allocator().claim_network_id(record['network_id'])
+        network = model.Network(owner=self._get_project(record['owner']),
+                                access=[],
+                                allocated=record['allocated'],
+                                network_id=record['network_id'],
+                                label=record['label'])
+        db.session.add(network)
+        self.networks[network.label] = network
+
+    def network_access(self, record):
+        """Import a network_access record."""
+        network = self._get(self.networks, model.Network, record['network'])
+        network.access.append(self._get_project(record['project']))
+
+    def attachment(self, record):
+        """Import an attachment record."""
+        key = (record['node'], record['nic'])
+        if key not in self.nics:
+            node = self._get(self.nodes, model.Node, record['node'])
+            nic = model.Nic.query \
+                .filter_by(owner=node, label=record['nic']).one_or_none()
+            if nic is None:
+                raise errors.NotFoundError(
+                    "Nic %s on node %s does not exist." % key[::-1])
+            self.nics[key] = nic
+        db.session.add(model.NetworkAttachment(
+            nic=self.nics[key],
+            network=self._get(self.networks, model.Network,
+                              record['network']),
+            channel=record['channel']))
+
+
+def import_records(records):
+    """Recreate the objects described by ``records``.
+
+    ``records`` is an iterable of records in the format produced by
+    `export_records`. All of the objects are added to the current database
+    session; it is up to the caller to commit. Raises a DuplicateError if any
+    of the top-level objects (projects, switches, nodes, networks) already
+    exist, and a NotFoundError if a record refers to an object that is
+    neither in the database nor earlier in ``records``.
+
+    This must be run inside of an app context, after the drivers have been
+    registered (see `hil.server.register_drivers`).
+    """
+    importer = _Importer()
+    for record in records:
+        if record.get('type') not in RECORD_TYPES:
+            raise errors.BadArgumentError(
+                'Unknown inventory record type: %r' % record.get('type'))
+        getattr(importer, record['type'])(record)
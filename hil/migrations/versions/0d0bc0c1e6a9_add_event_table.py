@@ -0,0 +1,41 @@
+"""add event table
+
+Revision ID: 0d0bc0c1e6a9
+Revises: d65a9dc873d7
+Create Date: 2026-10-19 10:12:44.180265
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = '0d0bc0c1e6a9'
+down_revision = 'd65a9dc873d7'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'event',
+        sa.Column('id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.Column('time', sa.DateTime(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('project_id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=True),
+        sa.Column('payload', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_event_time'), 'event', ['time'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_event_time'), table_name='event')
+    op.drop_table('event')
@@ -0,0 +1,53 @@
+"""add obm actions
+
+Revision ID: 3f2a1c9b7d40
+Revises: d152981f43f5
+Create Date: 2026-10-19 17:02:11.530417
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a1c9b7d40'
+down_revision = 'd152981f43f5'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'obm_action',
+        sa.Column('id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.Column('uuid', sa.String(), nullable=False),
+        sa.Column('job', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('args', sa.String(), nullable=False),
+        sa.Column('node_id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.ForeignKeyConstraint(['node_id'], ['node.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_obm_action_uuid'), 'obm_action', ['uuid'],
+                    unique=False)
+    op.create_index(op.f('ix_obm_action_job'), 'obm_action', ['job'],
+                    unique=False)
+    op.create_index(op.f('ix_obm_action_node_id'), 'obm_action', ['node_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_obm_action_node_id'), table_name='obm_action')
+    op.drop_index(op.f('ix_obm_action_job'), table_name='obm_action')
+    op.drop_index(op.f('ix_obm_action_uuid'), table_name='obm_action')
+    op.drop_table('obm_action')
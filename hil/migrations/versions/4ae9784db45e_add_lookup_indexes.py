@@ -0,0 +1,45 @@
+"""add lookup indexes
+
+Revision ID: 4ae9784db45e
+Revises: b1f35a1bb9b0
+Create Date: 2026-10-19 14:21:05.418224
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4ae9784db45e'
+down_revision = 'b1f35a1bb9b0'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+# (name, table, columns) of the plain indexes:
+INDEXES = [
+    ('ix_node_project_id', 'node', ['project_id']),
+    ('ix_nic_owner_id_label', 'nic', ['owner_id', 'label']),
+    ('ix_port_owner_id_label', 'port', ['owner_id', 'label']),
+    ('ix_metadata_owner_id_label', 'metadata', ['owner_id', 'label']),
+    ('ix_network_attachment_nic_id_channel', 'network_attachment',
+     ['nic_id', 'channel']),
+    ('ix_network_attachment_nic_id_network_id', 'network_attachment',
+     ['nic_id', 'network_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+    op.create_index('ix_networking_action_status_id', 'networking_action',
+                    ['status', 'id'], unique=False,
+                    postgresql_where=sa.text("status = 'PENDING'"))
+
+
+def downgrade():
+    op.drop_index('ix_networking_action_status_id',
+                  table_name='networking_action')
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
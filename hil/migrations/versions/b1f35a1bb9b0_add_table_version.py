@@ -0,0 +1,34 @@
+"""add table_version
+
+Revision ID: b1f35a1bb9b0
+Revises: 0d0bc0c1e6a9
+Create Date: 2026-10-19 11:02:17.530912
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1f35a1bb9b0'
+down_revision = '0d0bc0c1e6a9'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'table_version',
+        sa.Column('table', sa.String(), nullable=False),
+        sa.Column('version',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('table'),
+    )
+
+
+def downgrade():
+    op.drop_table('table_version')
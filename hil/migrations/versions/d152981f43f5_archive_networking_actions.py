@@ -0,0 +1,61 @@
+"""archive networking actions
+
+Revision ID: d152981f43f5
+Revises: 4ae9784db45e
+Create Date: 2026-10-19 15:03:48.271906
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'd152981f43f5'
+down_revision = '4ae9784db45e'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action',
+                  sa.Column('finished', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_networking_action_finished'),
+                    'networking_action', ['finished'], unique=False)
+    # We don't know when existing actions finished; start their retention
+    # period now:
+    op.execute("UPDATE networking_action "
+               "SET finished = (now() AT TIME ZONE 'utc') "
+               "WHERE status != 'PENDING'")
+
+    op.create_table(
+        'archived_networking_action',
+        sa.Column('id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=False),
+        sa.Column('uuid', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('channel', sa.String(), nullable=False),
+        sa.Column('node', sa.String(), nullable=False),
+        sa.Column('nic', sa.String(), nullable=False),
+        sa.Column('new_network', sa.String(), nullable=True),
+        sa.Column('project_id',
+                  sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite'),
+                  nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_archived_networking_action_uuid'),
+                    'archived_networking_action', ['uuid'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_archived_networking_action_uuid'),
+                  table_name='archived_networking_action')
+    op.drop_table('archived_networking_action')
+    op.drop_index(op.f('ix_networking_action_finished'),
+                  table_name='networking_action')
+    op.drop_column('networking_action', 'finished')
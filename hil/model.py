@@ -11,15 +11,17 @@ Extensions are permitted to create new database objects by subclassing from
 # from sqlalchemy import *
 # from sqlalchemy.ext.declarative import declarative_base, declared_attr
 # from sqlalchemy.orm import relationship, sessionmaker,backref
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from subprocess import call, check_call, Popen, PIPE
 from hil.flaskapp import app
 from hil.config import cfg
 from hil.dev_support import no_dry_run
+import json
 import uuid
 import xml.etree.ElementTree
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, text
 from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import DBAPIError
 
 # without setting this explicitly, we get a warning that this option
 # will default to disabled in future versions (due to incurring a lot
@@ -27,7 +29,46 @@ from sqlalchemy.dialects import sqlite
 # just opt-in to the change now:
 app.config.update(SQLALCHEMY_TRACK_MODIFICATIONS=False)
 
-db = SQLAlchemy(app)
+# Extra keyword arguments for `sqlalchemy.create_engine`; see `init_db`:
+app.config.setdefault('HIL_ENGINE_OPTIONS', {})
+
+# The Flask-SQLAlchemy bind key of the read replica, if one is configured:
+REPLICA = 'replica'
+
+# What `write_position` returns if the position can't be determined:
+UNKNOWN_POSITION = 'unknown'
+
+
+class _RoutingSession(SignallingSession):
+    """A session which can be told to use the read replica; see `use_replica`.
+    """
+
+    def __init__(self, db, **options):
+        # pylint: disable=redefined-outer-name
+        self.db = db
+        super(_RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get(REPLICA):
+            return self.db.get_engine(self.app, bind=REPLICA)
+        return super(_RoutingSession, self).get_bind(mapper, clause)
+
+
+class _SQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, plus the engine options set by `init_db`, and
+    routing to the read replica.
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        # pylint: disable=redefined-outer-name
+        super(_SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        options.update(app.config['HIL_ENGINE_OPTIONS'])
+
+    def create_session(self, options):
+        return _RoutingSession(self, **options)
+
+
+db = _SQLAlchemy(app)
 
 # Sets up variant type so that postgresql can use BIGINT primary keys
 # while sqlite uses Integer primary keys.
@@ -35,15 +76,144 @@ BigIntegerType = BigInteger().with_variant(
         sqlite.INTEGER(), 'sqlite')
 
 
+def _db_option(name):
+    """Return the integer option `name` from [database], or None if unset."""
+    if cfg.has_option('database', name):
+        return cfg.getint('database', name)
+    return None
+
+
 def init_db(uri=None):
     """Start up the DB connection.
 
     `uri` is the uri to use for the database. If it is None, the uri from the
-    config file will be used.
+    config file will be used. The read replica, connection pool and statement
+    timeout options in the ``[database]`` section of the config file are
+    applied either way; this must be called before the database is first used
+    for them to take effect.
     """
     if uri is None:
         uri = cfg.get('database', 'uri')
     app.config.update(SQLALCHEMY_DATABASE_URI=uri)
+    if cfg.has_option('database', 'replica_uri'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA: cfg.get('database', 'replica_uri'),
+        }
+    else:
+        app.config['SQLALCHEMY_BINDS'] = None
+
+    # sqlite doesn't use a connection pool which can be sized:
+    sized_pool = not uri.startswith('sqlite')
+    for key, option in [('SQLALCHEMY_POOL_SIZE', 'pool_size'),
+                        ('SQLALCHEMY_MAX_OVERFLOW', 'max_overflow'),
+                        ('SQLALCHEMY_POOL_TIMEOUT', 'pool_timeout')]:
+        app.config[key] = _db_option(option) if sized_pool else None
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = _db_option('pool_recycle')
+
+    engine_options = {}
+    if cfg.has_option('database', 'pool_pre_ping'):
+        engine_options['pool_pre_ping'] = \
+            cfg.getboolean('database', 'pool_pre_ping')
+    statement_timeout = _db_option('statement_timeout')
+    if statement_timeout and uri.startswith('postgresql'):
+        engine_options['connect_args'] = {
+            'options': '-c statement_timeout=%d' % statement_timeout,
+        }
+    app.config.update(HIL_ENGINE_OPTIONS=engine_options)
+
+
+def replica_configured():
+    """Return whether a read replica is configured."""
+    return REPLICA in (app.config['SQLALCHEMY_BINDS'] or {})
+
+
+def use_replica(enable=True):
+    """Send the current session's queries to the read replica.
+
+    If `enable` is False, send them to the primary database instead (the
+    default). This has no effect if no replica is configured.
+
+    The setting lasts until the session is removed, i.e. the end of the app
+    context. It must not be changed in the middle of a transaction, and
+    nothing may be written while using the replica.
+    """
+    if not replica_configured():
+        return
+    if enable:
+        db.session.info[REPLICA] = True
+    else:
+        db.session.info.pop(REPLICA, None)
+
+
+def _wal_functions(engine):
+    """Return the names of PostgreSQL's write log functions for `engine`.
+
+    The result is a tuple of the functions returning the current write
+    position, the last replayed position, and the difference between two
+    positions. PostgreSQL 10 renamed these from "xlog" to "wal".
+    """
+    version = engine.dialect.server_version_info
+    if version is not None and version < (10,):
+        return ('pg_current_xlog_location',
+                'pg_last_xlog_replay_location',
+                'pg_xlog_location_diff')
+    return 'pg_current_wal_lsn', 'pg_last_wal_replay_lsn', 'pg_wal_lsn_diff'
+
+
+def write_position():
+    """Return the current position in the primary database's write log.
+
+    Once the replica has reached this position (see `replica_caught_up`), it
+    reflects everything committed before this was called. The position is
+    a string; on databases other than PostgreSQL, or if it can't be
+    determined, it is `UNKNOWN_POSITION`.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return UNKNOWN_POSITION
+    current, _, _ = _wal_functions(db.engine)
+    try:
+        return db.engine.scalar(text('SELECT %s()' % current))
+    except DBAPIError:
+        return UNKNOWN_POSITION
+
+
+def replica_caught_up(position):
+    """Return whether the read replica has reached `position`.
+
+    `position` is a value returned by `write_position`. Returns False if
+    it isn't valid, or can't be compared.
+    """
+    engine = db.get_engine(app, bind=REPLICA)
+    if position == UNKNOWN_POSITION or engine.dialect.name != 'postgresql':
+        return False
+    current, replayed, diff = _wal_functions(engine)
+    # If the "replica" is itself a primary, it has nothing to replay:
+    query = text('SELECT %s(COALESCE(%s(), %s()), :position) >= 0'
+                 % (diff, replayed, current))
+    try:
+        return bool(engine.scalar(query, position=position))
+    except DBAPIError:
+        return False
+
+
+def pool_status():
+    """Return statistics about the database connection pool.
+
+    The result is a dict with the keys 'size' (the number of connections
+    the pool keeps open), 'checked_out' (the number in use) and 'overflow'
+    (the number in use beyond 'size'). If the pool doesn't support these
+    statistics (as is the case for sqlite), returns None.
+
+    This must be called within an app context.
+    """
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return None
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+    }
 
 
 # A joining table for project's access to networks, which have a many to many
@@ -60,9 +230,11 @@ class Nic(db.Model):
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
 
-    # The Node to which the nic belongs:
+    # The Node to which the nic belongs. A node's nics are listed in the
+    # order in which they were registered:
     owner_id = db.Column(db.ForeignKey('node.id'), nullable=False)
-    owner = db.relationship("Node", backref=db.backref('nics'))
+    owner = db.relationship("Node",
+                            backref=db.backref('nics', order_by='Nic.id'))
 
     # The mac address of the nic:
     mac_addr = db.Column(db.String)
@@ -72,6 +244,9 @@ class Nic(db.Model):
     port = db.relationship("Port",
                            backref=db.backref('nic', uselist=False))
 
+    # For looking up nics by name; see `api._namespaced_query`:
+    __table_args__ = (db.Index('ix_nic_owner_id_label', owner_id, label),)
+
     def __init__(self, node, label, mac_addr):
         self.owner = node
         self.label = label
@@ -85,7 +260,7 @@ class Node(db.Model):
 
     # The project to which this node is allocated. If the project is null, the
     # node is unallocated:
-    project_id = db.Column(db.ForeignKey('project.id'))
+    project_id = db.Column(db.ForeignKey('project.id'), index=True)
     project = db.relationship("Project", backref=db.backref('nodes'))
 
     # The Obm info is fetched from the obm class and its respective subclass
@@ -130,6 +305,11 @@ class Metadata(db.Model):
     owner_id = db.Column(db.ForeignKey('node.id'), nullable=False)
     owner = db.relationship('Node', backref=db.backref('metadata'))
 
+    # For looking up metadata by name; see `api._namespaced_query`:
+    __table_args__ = (
+        db.Index('ix_metadata_owner_id_label', owner_id, label),
+    )
+
     def __init__(self, label, value, node):
         """Create a key with the given label."""
         self.label = label
@@ -187,8 +367,13 @@ class Port(db.Model):
     """
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
+    # A switch's ports are listed in the order in which they were registered:
     owner_id = db.Column(db.ForeignKey('switch.id'), nullable=False)
-    owner = db.relationship('Switch', backref=db.backref('ports'))
+    owner = db.relationship('Switch',
+                            backref=db.backref('ports', order_by='Port.id'))
+
+    # For looking up ports by name; see `api._namespaced_query`:
+    __table_args__ = (db.Index('ix_port_owner_id_label', owner_id, label),)
 
     def __init__(self, label, switch):
         """Register a port on a switch."""
@@ -397,12 +582,34 @@ class Obm(db.Model):
         """Delete the console log."""
         assert False, "Subclasses MUST override the delete_console method"
 
-    def get_console(self):
-        """Return the contents of the console log."""
+    def get_console(self, offset=None, tail=None):
+        """Return part of the console log.
+
+        Returns None if there is no log. Otherwise returns a pair
+        ``(end, chunks)``, where `chunks` is an iterable of strings making up
+        the log from the position selected by `offset` and `tail` up to the
+        offset `end`; see `hil.console_logs.read`, which drivers can use to
+        implement this.
+        """
         assert False, "Subclasses MUST override the get_console method"
 
+    def follow_console(self, offset=None, tail=None):
+        """Follow the console log as it grows.
+
+        Returns None if there is no log. Otherwise returns an iterable of
+        strings making up the log from the position selected by `offset`
+        and `tail` (as for `get_console`), which carries on with the output
+        added to the log as it is added; see `hil.console_follow.follow`,
+        which drivers can use to implement this.
+        """
+        assert False, "Subclasses MUST override the follow_console method"
+
     def get_console_log_filename(self):
-        """Return the name of the file containing the console log."""
+        """Return the name of the console log.
+
+        For drivers using `hil.console_logs`, this is the directory holding
+        the log's segments.
+        """
         assert False, "Subclasses MUST override the get_console_log_filename" \
             "method"
 
@@ -580,6 +787,10 @@ class NetworkingAction(db.Model):
     # Legal values for `type`
     legal_types = ('modify_port', 'revert_port')
 
+    # The `hil.notifications` channel on which the network daemon announces
+    # that it has finished an action. The payload is the action's uuid.
+    notification_channel = 'networking_action'
+
     id = db.Column(BigIntegerType, primary_key=True)
 
     # UUID of a networking action. Useful for querying the status of a
@@ -589,6 +800,11 @@ class NetworkingAction(db.Model):
     # status of the operation; it can either be 'PENDING', 'DONE' or 'ERROR'
     status = db.Column(db.String, nullable=False)
 
+    # The time (in UTC) at which the action finished, or None if it is
+    # pending. Finished actions are eventually removed from the journal; see
+    # `hil.deferred.compact_journal`.
+    finished = db.Column(db.DateTime, nullable=True, index=True)
+
     # The type of action.
     #
     # * 'modify_port' attaches the (nic, channel) pair to a specified network,
@@ -616,6 +832,100 @@ class NetworkingAction(db.Model):
                                   backref=db.backref('scheduled_nics',
                                                      uselist=True))
 
+    # The network server polls for the oldest pending action. Finished
+    # actions are kept (so their status can be queried), and far outnumber
+    # pending ones, so on postgres only the latter are indexed. (SQLite can't
+    # use partial indexes for queries with bound parameters.)
+    __table_args__ = (
+        db.Index('ix_networking_action_status_id', status, id,
+                 postgresql_where=(status == 'PENDING')),
+    )
+
+
+class ArchivedNetworkingAction(db.Model):
+    """A finished networking action, which has been removed from the journal.
+
+    This keeps what `show_networking_action` reports about the action. The
+    node, nic and network are recorded by name, as they may since have been
+    deleted.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+    uuid = db.Column(db.String, nullable=False, index=True)
+    status = db.Column(db.String, nullable=False)
+    finished = db.Column(db.DateTime, nullable=True)
+    type = db.Column(db.String, nullable=False)
+    channel = db.Column(db.String, nullable=False)
+    node = db.Column(db.String, nullable=False)
+    nic = db.Column(db.String, nullable=False)
+    new_network = db.Column(db.String, nullable=True)
+
+    # The id of the project the node belonged to when the action was
+    # archived, if any. As with `Event`, this is not a foreign key, since the
+    # project may be deleted.
+    project_id = db.Column(BigIntegerType, nullable=True)
+
+    def __init__(self, action):
+        """Create an archive entry for the `NetworkingAction` `action`."""
+        node = action.nic.owner
+        self.uuid = action.uuid
+        self.status = action.status
+        self.finished = action.finished
+        self.type = action.type
+        self.channel = action.channel
+        self.node = node.label
+        self.nic = action.nic.label
+        self.new_network = getattr(action.new_network, 'label', None)
+        self.project_id = node.project_id
+
+
+class ObmAction(db.Model):
+    """A journal entry representing an out of band management operation.
+
+    The api calls which operate on a node's OBM create one of these, and
+    `hil.obm_jobs` carries them out in the background. Bulk power operations
+    (see `hil.api.nodes_power`) create one for each node, all sharing the
+    same `job` id.
+    """
+
+    # Legal values for `type`
+    legal_types = ('power_cycle', 'power_off', 'set_bootdev')
+
+    id = db.Column(BigIntegerType, primary_key=True)
+
+    # UUID of the action, and of the job it is part of:
+    uuid = db.Column(db.String, nullable=False, index=True)
+    job = db.Column(db.String, nullable=True, index=True)
+
+    # status of the operation; one of 'PENDING', 'RUNNING', 'DONE' or
+    # 'ERROR'. If it is 'ERROR', `error` says what went wrong.
+    status = db.Column(db.String, nullable=False)
+    error = db.Column(db.String, nullable=True)
+
+    # The time (in UTC) at which the action finished, or None if it hasn't.
+    finished = db.Column(db.DateTime, nullable=True)
+
+    # The operation to perform; the name of an `Obm` method.
+    type = db.Column(db.String, nullable=False)
+
+    # JSON-encoded keyword arguments for the operation, e.g. ``{"force":
+    # true}`` for 'power_cycle':
+    args = db.Column(db.String, nullable=False)
+
+    node_id = db.Column(db.ForeignKey('node.id'), nullable=False, index=True)
+    node = db.relationship('Node',
+                           backref=db.backref('obm_actions',
+                                              cascade='all, delete-orphan'))
+
+    def __init__(self, node, type, args, job=None):
+        # pylint: disable=redefined-builtin
+        assert type in self.legal_types
+        self.node = node
+        self.type = type
+        self.args = json.dumps(args)
+        self.job = job
+        self.uuid = str(uuid.uuid4())
+        self.status = 'PENDING'
+
 
 class NetworkAttachment(db.Model):
     """An attachment of a network to a particular nic on a channel"""
@@ -630,5 +940,50 @@ class NetworkAttachment(db.Model):
     network_id = db.Column(db.ForeignKey('network.id'), nullable=False)
     channel = db.Column(db.String, nullable=False)
 
+    # For checking what a nic is attached to, when connecting or detaching
+    # networks:
+    __table_args__ = (
+        db.Index('ix_network_attachment_nic_id_channel', nic_id, channel),
+        db.Index('ix_network_attachment_nic_id_network_id',
+                 nic_id, network_id),
+    )
+
     nic = db.relationship('Nic', backref=db.backref('attachments'))
     network = db.relationship('Network', backref=db.backref('attachments'))
+
+
+class Event(db.Model):
+    """A record of a change to HIL's state.
+
+    Events are recorded automatically as objects are created, modified and
+    deleted; see `hil.events` for details. They are kept for a limited time,
+    so that clients can follow changes without polling the api.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+
+    # The time (in UTC) at which the event was recorded.
+    time = db.Column(db.DateTime, nullable=False, index=True)
+
+    # The kind of change, e.g. 'node_create'.
+    type = db.Column(db.String, nullable=False)
+
+    # The id of the project that may see this event, or None if the event is
+    # only visible to administrators. This is deliberately not a foreign key,
+    # since events outlive the objects they describe.
+    project_id = db.Column(BigIntegerType, nullable=True)
+
+    # JSON object describing the change; its contents depend on `type`.
+    payload = db.Column(db.String, nullable=False)
+
+
+class TableVersion(db.Model):
+    """A counter which is incremented whenever a table is modified.
+
+    These are maintained by `hil.table_versions`, and used to generate ETags
+    for api responses.
+    """
+    # The name of the table.
+    table = db.Column(db.String, primary_key=True)
+
+    # The number of transactions which have modified the table.
+    version = db.Column(BigIntegerType, nullable=False)
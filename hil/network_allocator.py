@@ -29,12 +29,19 @@ class NetworkAllocator(object):
     __metaclass__ = ABCMeta
 
     @abstractmethod
-    def get_new_network_id(self):
+    def get_new_network_id(self, pool=None, project=None):
         """Gets a new network ID, valid for this driver.
 
         Returns 'None' if there are no more possible IDs available.  Pass
         in the database connection, to make the allocation part of the current
         transaction.
+
+        If the driver divides its network IDs into named pools, ``pool`` is
+        the name of the one to allocate from; None means the default pool.
+        ``project`` is the `model.Project` the network is being allocated
+        for, or None for administrator-owned networks. Drivers which enforce
+        per-project quotas should raise a `QuotaExceededError` if the
+        project has used up its quota.
         """
 
     @abstractmethod
@@ -89,6 +96,17 @@ class NetworkAllocator(object):
     def is_network_id_in_pool(self, net_id):
         """returns true if net_id is part of the allocation pool"""
 
+    def usage(self):
+        """Report how many network IDs are free and in use.
+
+        Returns a dict mapping the name of each pool to a dict with keys
+        "free" and "used", giving the number of network IDs in that pool
+        which are available for allocation and allocated, respectively.
+        Drivers which don't keep track of their IDs (the default) return an
+        empty dict.
+        """
+        return {}
+
 
 _network_allocator = None
 
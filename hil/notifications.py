@@ -0,0 +1,317 @@
+"""Cross-process change notifications.
+
+This module lets one part of HIL tell another that something in the database
+has changed, so that the latter can block waiting for the change rather than
+polling the database in a loop. For example, the networking daemon publishes
+a notification each time it finishes a networking action, which wakes up API
+requests waiting for that action to complete.
+
+Notifications are transactional: `publish` queues a notification in the
+current database transaction, and it is only delivered if and when that
+transaction commits.
+
+On postgres, notifications are delivered with ``NOTIFY``/``LISTEN``, so they
+reach every HIL process using the database. Each process that waits for
+notifications keeps one extra database connection open, on which a
+background thread listens for them. On other databases (i.e. sqlite, which
+is only suitable for development) notifications are only delivered within
+the process that published them.
+
+A notification consists of a *channel*, which identifies the kind of change,
+and a *payload* string, typically identifying the changed object.
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+# Prefix for the names of postgres notification channels, to avoid stepping on
+# anything else that may be using the same database:
+_PG_CHANNEL_PREFIX = 'hil_'
+
+# Map from channel names to the set of subscriptions for that channel.
+_subscriptions = defaultdict(set)
+_lock = threading.Lock()
+
+_listener = None
+
+
+def _using_postgres():
+    """Return whether the database is postgres."""
+    return db.engine.dialect.name == 'postgresql'
+
+
+def publish(channel, payload=''):
+    """Notify subscribers to ``channel`` when the current transaction commits.
+
+    If the transaction is rolled back, the notification is discarded.
+    """
+    if _using_postgres():
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {'channel': _PG_CHANNEL_PREFIX + channel,
+                            'payload': payload})
+    else:
+        db.session.info.setdefault('hil_notifications', []) \
+            .append((channel, payload))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _deliver_local(session):
+    """Deliver notifications queued by `publish` on non-postgres databases."""
+    for channel, payload in session.info.pop('hil_notifications', []):
+        _dispatch(channel, payload)
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _discard_local(session, previous_transaction):
+    """Discard notifications queued in a rolled-back transaction."""
+    # pylint: disable=unused-argument
+    session.info.pop('hil_notifications', None)
+
+
+def _dispatch(channel, payload):
+    """Wake up the subscriptions interested in a notification."""
+    with _lock:
+        subscriptions = list(_subscriptions[channel])
+    for subscription in subscriptions:
+        if subscription.payloads is None or payload in subscription.payloads:
+            subscription.notify(payload)
+
+
+def _dispatch_all():
+    """Wake up every subscription.
+
+    This is used when notifications may have been lost, so that waiters
+    re-check whatever they are waiting on.
+    """
+    with _lock:
+        subscriptions = [s for subs in _subscriptions.values() for s in subs]
+    for subscription in subscriptions:
+        subscription.notify(None)
+
+
+class Subscription(object):
+    """A subscription to a notification channel.
+
+    Use `subscribe` to create one. Subscriptions are context managers; they
+    start receiving notifications on entry, and stop on exit.
+    """
+
+    # How many payloads a subscription keeping them holds before it gives up
+    # and reports that notifications may have been lost:
+    max_kept = 1000
+
+    def __init__(self, channel, payloads=None, keep_payloads=False):
+        self.channel = channel
+        if payloads is not None:
+            payloads = frozenset(payloads)
+        self.payloads = payloads
+        self.event = threading.Event()
+        # The payloads received since the last call to `received`, if
+        # `keep_payloads` was given; see `received`:
+        self._kept = [] if keep_payloads else None
+        self._kept_lock = threading.Lock()
+
+    def notify(self, payload):
+        """Deliver a notification with ``payload`` to the subscription.
+
+        A ``payload`` of None means notifications may have been lost.
+        """
+        if self._kept is not None:
+            with self._kept_lock:
+                if len(self._kept) >= self.max_kept:
+                    self._kept = [None]
+                elif self._kept[-1:] != [None]:
+                    self._kept.append(payload)
+        self.event.set()
+
+    def received(self):
+        """Return the payloads received since the last call.
+
+        This is only supported by subscriptions created with
+        ``keep_payloads=True``. If notifications may have been lost (e.g.
+        because the connection to the database was lost, or too many
+        payloads were waiting), the list ends with None.
+        """
+        with self._kept_lock:
+            kept, self._kept = self._kept, []
+        return kept
+
+    def __enter__(self):
+        if _using_postgres():
+            _get_listener().listen(self.channel)
+        with _lock:
+            _subscriptions[self.channel].add(self)
+        return self
+
+    def __exit__(self, *args):
+        with _lock:
+            _subscriptions[self.channel].discard(self)
+
+    def wait(self, timeout):
+        """Wait up to ``timeout`` seconds for a notification.
+
+        Returns True if a notification was received, False if we timed out.
+        Notifications received since the last call to ``wait`` (or since
+        the subscription started) count, so none are missed between calls.
+        """
+        received = self.event.wait(timeout)
+        self.event.clear()
+        return received
+
+
+def subscribe(channel, payloads=None, keep_payloads=False):
+    """Return a `Subscription` to ``channel``.
+
+    If ``payloads`` is not None, it should be a collection of payloads; only
+    notifications with one of those payloads will wake the subscriber. If
+    ``keep_payloads`` is true, the subscription keeps the payloads it
+    receives, for `Subscription.received`.
+    """
+    return Subscription(channel, payloads, keep_payloads)
+
+
+def wait_until(ready, channel, payloads=None, timeout=0):
+    """Block until ``ready()`` returns true, or ``timeout`` seconds pass.
+
+    ``ready`` is called once up front, and then again each time a matching
+    notification arrives on ``channel`` (see `subscribe` for the meaning of
+    ``payloads``). It is never called in a loop otherwise. Returns the last
+    value returned by ``ready``.
+    """
+    deadline = time.time() + timeout
+    with subscribe(channel, payloads) as subscription:
+        result = ready()
+        while not result:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not subscription.wait(remaining):
+                break
+            result = ready()
+        return result
+
+
+class _PostgresListener(threading.Thread):
+    """Background thread receiving notifications from postgres.
+
+    The thread owns a dedicated database connection, on which it listens for
+    notifications on each channel that has been subscribed to, and passes
+    them on to `_dispatch`.
+    """
+
+    daemon = True
+
+    # How long to wait before reconnecting after a database error:
+    retry_delay = 5
+
+    # How long `listen` will wait for the thread to start listening:
+    listen_timeout = 10
+
+    def __init__(self, engine):
+        threading.Thread.__init__(self, name='hil-notifications')
+        self.engine = engine
+        self.pid = os.getpid()
+        self.conn = None
+        # Channels we have been asked to listen on, and those on which we
+        # have actually issued LISTEN on the current connection:
+        self.channels = set()
+        self.listening = set()
+        self.cond = threading.Condition()
+        # Pipe used to wake up the thread when there are new channels to
+        # listen on:
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def listen(self, channel):
+        """Make sure we are listening on ``channel``.
+
+        This blocks until the LISTEN has actually been issued, so that
+        notifications published after it returns will not be missed.
+        """
+        with self.cond:
+            if channel in self.listening:
+                return
+            self.channels.add(channel)
+            os.write(self.wakeup_w, 'x')
+            deadline = time.time() + self.listen_timeout
+            while channel not in self.listening:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.error('Timed out waiting to listen on %r',
+                                 channel)
+                    return
+                self.cond.wait(remaining)
+
+    def _connect(self):
+        """(Re)connect to the database."""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        with self.cond:
+            self.listening = set()
+        conn = self.engine.raw_connection()
+        # This connection is ours for good; don't return it to the pool:
+        conn.detach()
+        self.conn = conn.connection
+        self.conn.autocommit = True
+
+    def _listen_new_channels(self):
+        """Issue LISTEN for any channels we aren't listening on yet."""
+        with self.cond:
+            new_channels = self.channels - self.listening
+        if not new_channels:
+            return
+        cursor = self.conn.cursor()
+        for channel in new_channels:
+            cursor.execute('LISTEN "%s"' % (_PG_CHANNEL_PREFIX + channel))
+        cursor.close()
+        with self.cond:
+            self.listening |= new_channels
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                self._connect()
+                while True:
+                    self._listen_new_channels()
+                    readable, _, _ = select.select(
+                        [self.conn, self.wakeup_r], [], [])
+                    if self.wakeup_r in readable:
+                        os.read(self.wakeup_r, 4096)
+                    self.conn.poll()
+                    while self.conn.notifies:
+                        notify = self.conn.notifies.pop(0)
+                        _dispatch(notify.channel[len(_PG_CHANNEL_PREFIX):],
+                                  notify.payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Error listening for notifications; '
+                                 'reconnecting.')
+            # We may have missed notifications while disconnected:
+            _dispatch_all()
+            time.sleep(self.retry_delay)
+
+
+def _get_listener():
+    """Return the postgres listener thread, starting it if need be.
+
+    The thread is started lazily, so that processes which fork after
+    initialization (e.g. a pre-fork server) each get their own.
+    """
+    global _listener
+    with _lock:
+        if _listener is None or not _listener.is_alive() or \
+                _listener.pid != os.getpid():
+            _listener = _PostgresListener(db.engine)
+            _listener.start()
+        return _listener
@@ -0,0 +1,302 @@
+"""Carry out out of band management operations in the background.
+
+Operations such as power cycling a node can take several seconds each, and
+a BMC which doesn't respond can hold them up for much longer, so the api
+calls which perform them (`hil.api.node_power_cycle`, `hil.api.nodes_power`
+etc.) don't wait for them. Instead, they record a `model.ObmAction` in a
+journal, much as networking operations are recorded as
+`model.NetworkingAction`s, and return straight away. The OBM server
+(``hil-admin serve-obm``; see `Server`) carries the actions out with a pool
+of worker threads, so that operations on different nodes proceed in
+parallel.
+
+Many nodes may share one BMC (e.g. the nodes of a blade chassis), and BMCs
+don't cope well with many simultaneous sessions, so at most
+``per_host_limit`` actions are run against the same BMC at once. Actions on
+the same node are always run one at a time, in the order they were queued.
+
+The settings are in the ``[obm]`` section of ``hil.cfg``. If ``workers`` is
+0, there is no OBM server; instead the api calls carry out actions
+themselves, before returning. This is meant for development and testing.
+"""
+
+import json
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from hil import model, notifications
+from hil.config import cfg
+from hil.errors import OBMError
+from hil.flaskapp import app
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 1
+DEFAULT_TIMEOUT = 60
+DEFAULT_ACTION_RETENTION = 7 * 24 * 60 * 60
+
+# Notification channels on which queued actions are announced (with an empty
+# payload), and finished ones (with the action's uuid):
+CHANNEL_QUEUED = 'obm_action_queued'
+CHANNEL_FINISHED = 'obm_action_finished'
+
+
+def workers():
+    """Return the number of worker threads to carry out actions with."""
+    if cfg.has_option('obm', 'workers'):
+        return cfg.getint('obm', 'workers')
+    return DEFAULT_WORKERS
+
+
+def per_host_limit():
+    """Return how many actions may run against one BMC at once.
+
+    0 means there is no limit.
+    """
+    if cfg.has_option('obm', 'per_host_limit'):
+        return cfg.getint('obm', 'per_host_limit')
+    return DEFAULT_PER_HOST_LIMIT
+
+
+def timeout():
+    """Return how long (in seconds) a single command sent to a BMC may take.
+
+    OBM drivers should give up on commands which take longer than this.
+    """
+    if cfg.has_option('obm', 'timeout'):
+        return cfg.getint('obm', 'timeout')
+    return DEFAULT_TIMEOUT
+
+
+def action_retention():
+    """Return how long (in seconds) to keep finished actions."""
+    if cfg.has_option('obm', 'action_retention'):
+        return cfg.getint('obm', 'action_retention')
+    return DEFAULT_ACTION_RETENTION
+
+
+def bmc_host(obm):
+    """Return a string identifying the BMC that `obm` talks to.
+
+    This is the OBM's ``host``, for drivers which have one. Otherwise, each
+    OBM is assumed to have a BMC of its own.
+    """
+    host = getattr(obm, 'host', None)
+    if host is None:
+        return 'obm-%d' % obm.id
+    return host
+
+
+def queue(actions):
+    """Add `actions` (a list of new `model.ObmAction`s) to the journal.
+
+    This commits the current transaction. If ``workers`` is 0, the actions
+    are then carried out before returning.
+    """
+    db.session.add_all(actions)
+    notifications.publish(CHANNEL_QUEUED)
+    db.session.commit()
+    if workers() == 0:
+        for action in actions:
+            run_action(action.id)
+
+
+def cancel_pending(node):
+    """Give up on `node`'s actions which haven't started yet.
+
+    They are marked as failed, and their waiters told so. Actions already
+    claimed by a worker are left alone. Returns the number of actions
+    cancelled.
+    """
+    uuids = [uuid for (uuid,) in
+             db.session.query(model.ObmAction.uuid)
+             .filter_by(node_id=node.id, status='PENDING')]
+    if not uuids:
+        return 0
+    # Only cancel those still pending, in case a worker has just claimed
+    # one; the update is atomic, so it can't be both run and cancelled:
+    count = model.ObmAction.query \
+        .filter(model.ObmAction.uuid.in_(uuids),
+                model.ObmAction.status == 'PENDING') \
+        .update({
+            'status': 'ERROR',
+            'error': 'Cancelled',
+            'finished': datetime.utcnow(),
+        }, synchronize_session=False)
+    for uuid in uuids:
+        notifications.publish(CHANNEL_FINISHED, uuid)
+    return count
+
+
+def run_action(action_id):
+    """Carry out the `model.ObmAction` with id `action_id`.
+
+    The action is only carried out if it is still pending; this makes sure
+    it is never run twice. Its outcome is recorded in the database. This
+    must be called with an application context.
+    """
+    claimed = model.ObmAction.query \
+        .filter_by(id=action_id, status='PENDING') \
+        .update({'status': 'RUNNING'}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return
+    action = model.ObmAction.query.get(action_id)
+    try:
+        getattr(action.node.obm, action.type)(**json.loads(action.args))
+        status, error = 'DONE', None
+    except OBMError as e:
+        status, error = 'ERROR', e.description
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Error performing %s on node %s',
+                         action.type, action.node.label)
+        status, error = 'ERROR', 'Internal error'
+    action.status = status
+    action.error = error
+    action.finished = datetime.utcnow()
+    notifications.publish(CHANNEL_FINISHED, action.uuid)
+    db.session.commit()
+
+
+class _Pool(object):
+    """A pool of threads carrying out actions.
+
+    Actions are started in the order they were submitted, except that
+    those whose BMC is already handling ``host_limit`` actions, or whose
+    node is already handling one, wait their turn, without holding up those
+    behind them.
+    """
+
+    def __init__(self, size, host_limit):
+        self.size = size
+        self.host_limit = host_limit
+        self.cond = threading.Condition()
+        # (action id, bmc host, node id) tuples not yet started:
+        self.queue = []
+        # Map from bmc hosts to the number of actions running against them:
+        self.running = defaultdict(int)
+        # Ids of the nodes with actions running:
+        self.busy_nodes = set()
+        # Ids of the actions submitted, and not yet finished:
+        self.submitted = set()
+        self.threads = []
+
+    def submit(self, tasks):
+        """Queue `tasks`, a list of (action id, bmc host, node id) tuples.
+
+        Tasks which have already been submitted, and have not finished, are
+        ignored.
+        """
+        with self.cond:
+            for task in tasks:
+                if task[0] not in self.submitted:
+                    self.submitted.add(task[0])
+                    self.queue.append(task)
+            while len(self.threads) < self.size:
+                thread = threading.Thread(target=self._work,
+                                          name='hil-obm-worker')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            self.cond.notify_all()
+
+    def _next(self):
+        """Take the first task which may start now off the queue.
+
+        Returns None if there is no such task. Must be called with `cond`
+        held.
+        """
+        for i, (action_id, host, node_id) in enumerate(self.queue):
+            if node_id in self.busy_nodes:
+                continue
+            if not self.host_limit or self.running[host] < self.host_limit:
+                del self.queue[i]
+                self.running[host] += 1
+                self.busy_nodes.add(node_id)
+                return action_id, host, node_id
+        return None
+
+    def _work(self):
+        """Carry out tasks, forever."""
+        while True:
+            with self.cond:
+                task = self._next()
+                while task is None:
+                    self.cond.wait()
+                    task = self._next()
+            action_id, host, node_id = task
+            try:
+                with app.app_context():
+                    run_action(action_id)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Error running obm action %d', action_id)
+            finally:
+                with self.cond:
+                    self.running[host] -= 1
+                    self.busy_nodes.discard(node_id)
+                    self.submitted.discard(action_id)
+                    self.cond.notify_all()
+
+
+class Server(object):
+    """The OBM server, which carries out the actions in the journal.
+
+    There should only be one of these running against a database at once.
+    """
+
+    # How long to wait between checks for new actions. On postgres, the
+    # server is woken as soon as actions are queued, so this only matters
+    # if notifications are lost:
+    poll_interval = 5
+
+    def __init__(self):
+        self.pool = _Pool(workers(), per_host_limit())
+
+    def recover(self):
+        """Give up on actions left running by a previous server.
+
+        Those actions may or may not have been carried out, so they are
+        marked as failed.
+        """
+        count = model.ObmAction.query.filter_by(status='RUNNING').update({
+            'status': 'ERROR',
+            'error': 'Interrupted',
+            'finished': datetime.utcnow(),
+        }, synchronize_session=False)
+        db.session.commit()
+        if count:
+            logger.warning('Marked %d interrupted obm actions as failed',
+                           count)
+
+    def poll(self):
+        """Submit any new pending actions to the pool.
+
+        Also removes finished actions older than ``action_retention``.
+        """
+        pending = db.session.query(model.ObmAction.id,
+                                   model.ObmAction.node_id) \
+            .filter_by(status='PENDING') \
+            .order_by(model.ObmAction.id).all()
+        if pending:
+            node_ids = set(node_id for _, node_id in pending)
+            hosts = dict((node.id, bmc_host(node.obm)) for node in
+                         model.Node.query.filter(model.Node.id.in_(node_ids)))
+            self.pool.submit([(action_id, hosts[node_id], node_id)
+                              for action_id, node_id in pending])
+        cutoff = datetime.utcnow() - timedelta(seconds=action_retention())
+        model.ObmAction.query \
+            .filter(model.ObmAction.finished < cutoff) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+    def serve(self):
+        """Carry out actions as they are queued, forever."""
+        self.recover()
+        with notifications.subscribe(CHANNEL_QUEUED) as subscription:
+            while True:
+                self.poll()
+                subscription.wait(self.poll_interval)
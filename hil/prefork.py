@@ -0,0 +1,193 @@
+"""A pre-forking, multi-threaded WSGI server.
+
+This is what ``hil-admin serve-api`` uses to run the api server in
+production. The parent process binds the listening socket, and then forks a
+fixed number of worker processes, each of which serves requests from the
+shared socket with a fixed number of threads. Anything set up before
+`PreforkServer.run` is called (loaded extensions, the class map, etc.) is
+shared by the workers, so they start quickly.
+
+The parent replaces workers which die. On SIGTERM or SIGINT it asks the
+workers to stop; each finishes the requests it is handling, and any which
+are still running after a timeout are killed.
+"""
+
+import errno
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) worker threads check whether they should stop:
+POLL_INTERVAL = 0.5
+
+
+class _WorkerServer(BaseWSGIServer):
+    """The WSGI server run by each worker.
+
+    The listening socket is non-blocking, so that all of a worker's threads
+    can wait for connections on it, and those which lose the race to accept
+    one just go back to waiting.
+    """
+
+    def get_request(self):
+        sock, addr = BaseWSGIServer.get_request(self)
+        sock.setblocking(1)
+        return sock, addr
+
+
+class PreforkServer(object):
+    """A pre-forking WSGI server for `app`.
+
+    The server binds to `host` and `port` when it is created (if `port` is
+    0, an unused port is chosen; see the `port` attribute). `run` then
+    starts `workers` worker processes, each serving requests with `threads`
+    threads. When asked to stop, workers are given `graceful_timeout`
+    seconds to finish their requests.
+
+    If given, `after_fork` is called with no arguments in each worker
+    process, before it serves any requests.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=5000, workers=2,
+                 threads=4, graceful_timeout=30, after_fork=None):
+        self.server = _WorkerServer(host, port, app)
+        self.server.socket.setblocking(0)
+        self.port = self.server.server_address[1]
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.after_fork = after_fork
+        self._pids = set()
+        self._stopping = False
+
+    def run(self):
+        """Run the server, until it receives SIGTERM or SIGINT."""
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info('Serving on port %d with %d workers of %d threads',
+                    self.port, self.workers, self.threads)
+        try:
+            while not self._stopping:
+                while len(self._pids) < self.workers and not self._stopping:
+                    self._spawn()
+                try:
+                    pid, status = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                self._pids.discard(pid)
+                if not self._stopping:
+                    logger.error('Worker %d died unexpectedly (status %d); '
+                                 'replacing it', pid, status)
+        finally:
+            self._stop_workers()
+            self.server.server_close()
+
+    def _handle_stop(self, signum, frame):
+        """Signal handler which shuts down the server."""
+        # pylint: disable=unused-argument
+        self._stopping = True
+
+    def _spawn(self):
+        """Fork a worker process."""
+        pid = os.fork()
+        if pid != 0:
+            self._pids.add(pid)
+            return
+        status = 1
+        try:
+            self._work()
+            status = 0
+        except BaseException:  # pylint: disable=broad-except
+            logger.exception('Worker %d failed', os.getpid())
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)  # pylint: disable=protected-access
+
+    def _stop_workers(self):
+        """Stop the workers, killing any still busy after the timeout."""
+        for pid in self._pids:
+            _kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self._pids and time.time() < deadline:
+            for pid in list(self._pids):
+                if _reap(pid):
+                    self._pids.discard(pid)
+            time.sleep(0.05)
+        for pid in self._pids:
+            logger.warn('Worker %d did not stop in time; killing it', pid)
+            _kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._pids.clear()
+
+    def _work(self):
+        """Serve requests in a worker process, until told to stop."""
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        # The parent decides what to do about ^C:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.after_fork is not None:
+            self.after_fork()
+        threads = [threading.Thread(target=self._serve, args=(stop,))
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # Wait with a timeout, so that signals are handled promptly:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(POLL_INTERVAL)
+
+    def _serve(self, stop):
+        """Handle connections until `stop` is set."""
+        server = self.server
+        while not stop.is_set():
+            try:
+                ready, _, _ = select.select([server.socket], [], [],
+                                            POLL_INTERVAL)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+            try:
+                request, client_address = server.get_request()
+            except socket.error:
+                # Another thread or worker got there first.
+                continue
+            try:
+                server.process_request(request, client_address)
+            except Exception:  # pylint: disable=broad-except
+                server.handle_error(request, client_address)
+                server.shutdown_request(request)
+
+
+def _kill(pid, signum):
+    """Send `signum` to `pid`, unless it has already exited."""
+    try:
+        os.kill(pid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _reap(pid):
+    """Return whether the child `pid` has exited, reaping it if so."""
+    try:
+        return os.waitpid(pid, os.WNOHANG)[0] == pid
+    except OSError as e:
+        if e.errno == errno.ECHILD:
+            return True
+        raise
@@ -0,0 +1,174 @@
+"""Per-request cost accounting for api calls.
+
+`hil.rest` starts a `RequestStats` for each api call, and times the phases of
+handling it (validating arguments, authenticating, running the handler and
+building the response). While it is active, every SQL statement executed in
+the request's app context is counted and timed as well.
+
+When the request finishes (for streamed responses, once the body has been
+sent), the statistics are logged, and passed to each of
+the callables in `observers`, which is how e.g. `hil.ext.metrics.prometheus`
+aggregates them. If the ``request_stats`` option in the ``[devel]`` section
+of ``hil.cfg`` is true, they are also returned to the client in the
+``Server-Timing`` and ``X-HIL-SQL-Count`` response headers.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from hil.config import cfg
+
+# Callables invoked as ``observer(endpoint, status, stats)`` when each api
+# call finishes, where ``endpoint`` is the name of the api call, ``status``
+# is the HTTP status code and ``stats`` is the `RequestStats`.
+observers = []
+
+
+class RequestStats(object):
+    """Statistics about the handling of a single request.
+
+    Attributes:
+
+        start (float): the time at which the request started
+        phases (OrderedDict): the number of seconds spent in each phase of
+            handling the request, by name, in the order they began
+        sql_count (int): the number of SQL statements executed
+        sql_time (float): the number of seconds spent executing them
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager which times the phase ``name``."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                time.time() - start
+
+    def total(self):
+        """Return the number of seconds since the request started."""
+        return time.time() - self.start
+
+    def add_headers(self, response):
+        """Report the statistics in the headers of ``response``."""
+        timings = ['%s;dur=%.3f' % (name, seconds * 1000)
+                   for name, seconds in self.phases.items()]
+        timings.append('db;dur=%.3f' % (self.sql_time * 1000))
+        response.headers['Server-Timing'] = ', '.join(timings)
+        response.headers['X-HIL-SQL-Count'] = str(self.sql_count)
+
+
+def headers_enabled():
+    """Return whether statistics should be sent in response headers."""
+    return cfg.has_option('devel', 'request_stats') and \
+        cfg.getboolean('devel', 'request_stats')
+
+
+def start():
+    """Start collecting statistics for the current request.
+
+    Returns the new `RequestStats`.
+    """
+    flask.g.hil_request_stats = RequestStats()
+    return flask.g.hil_request_stats
+
+
+def current():
+    """Return the `RequestStats` for the current request, if any."""
+    if not flask.has_app_context():
+        return None
+    return getattr(flask.g, 'hil_request_stats', None)
+
+
+def finish(logger, endpoint, status, response=None):
+    """Stop collecting statistics for the current request, and report them.
+
+    ``logger`` is the logger to report to (typically `hil.rest.logger`).
+
+    If ``response`` is a streamed response, the statistics are reported when
+    it is closed, once the whole body has been sent. The time spent sending
+    it is recorded as the ``stream`` phase, and SQL statements executed while
+    generating it are counted, if the generator runs in the request's app
+    context (see `flask.stream_with_context`).
+    """
+    stats = flask.g.hil_request_stats
+    if response is not None and response.is_streamed:
+        start_time = time.time()
+
+        def _on_close():
+            """Report the statistics, now that the body has been sent."""
+            stats.phases['stream'] = time.time() - start_time
+            _report(logger, endpoint, status, stats)
+        response.call_on_close(_on_close)
+        return
+    del flask.g.hil_request_stats
+    _report(logger, endpoint, status, stats)
+
+
+def _report(logger, endpoint, status, stats):
+    """Log ``stats``, and pass them to the `observers`."""
+    total = stats.total()
+    fields = {
+        'endpoint': endpoint,
+        'status': status,
+        'total_ms': total * 1000,
+        'sql_count': stats.sql_count,
+        'sql_ms': stats.sql_time * 1000,
+    }
+    for name, seconds in stats.phases.items():
+        fields[name + '_ms'] = seconds * 1000
+    logger.info('API call %s finished: status %d in %.1fms; '
+                '%d SQL statements taking %.1fms; phases: %s',
+                endpoint, status, total * 1000,
+                stats.sql_count, stats.sql_time * 1000,
+                ', '.join('%s %.1fms' % (name, seconds * 1000)
+                          for name, seconds in stats.phases.items()),
+                extra={'hil_request_stats': fields})
+    for observer in observers:
+        try:
+            observer(endpoint, status, stats)
+        except Exception:  # pylint: disable=broad-except
+            logging.getLogger(__name__).exception(
+                'Error reporting request statistics')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    """Note when a statement starts, for `_after_execute`."""
+    # pylint: disable=unused-argument,too-many-arguments
+    conn.info.setdefault('hil_statement_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _on_error(context):
+    """Discard the start time of a statement which failed."""
+    if context.connection is not None:
+        starts = context.connection.info.get('hil_statement_start')
+        if starts:
+            starts.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    """Count a statement against the current request."""
+    # pylint: disable=unused-argument,too-many-arguments
+    start_time = conn.info['hil_statement_start'].pop()
+    stats = current()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_time += time.time() - start_time
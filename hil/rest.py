@@ -17,12 +17,18 @@ from hil.errors import APIError, AuthorizationError
 from hil.config import cfg
 
 from schema import SchemaError
+from werkzeug.exceptions import HTTPException
 from uuid import uuid4
 
-from hil import auth
+from hil import auth, model, request_stats, table_versions
 
 local = flask.g
 
+# The cookie and header which carry the primary database's write position
+# after a request which modified it; see `rest_call`:
+WRITE_POSITION_COOKIE = 'hil_write_position'
+WRITE_POSITION_HEADER = 'X-HIL-Write-Position'
+
 
 class _RequestInfo(object):
     """A Flask extension that stores a few per request values.
@@ -89,7 +95,8 @@ class ValidationError(APIError):
     """An exception indicating that the body of the request was invalid."""
 
 
-def rest_call(methods, path, schema, dont_log=()):
+def rest_call(methods, path, schema, dont_log=(), depends_on=(),
+              use_replica=True):
     """A decorator which registers an http mapping to a python api call.
 
     `rest_call` adds an attribute 'api_schema', which is equal to the `schema`
@@ -123,6 +130,25 @@ def rest_call(methods, path, schema, dont_log=()):
             perform type validation and conversion.
     * dont_log (optional): a list of "sensitive" argument names, which should
             not be logged.
+    * depends_on (optional): a list of model classes from whose tables the
+            response to a GET request is derived. If given, responses carry
+            an ETag, which changes whenever one of those tables is modified
+            (see `hil.table_versions`), and requests whose If-None-Match
+            header matches the current ETag get a 304 Not Modified response
+            without the function being called. The function must not depend
+            on anything else that may change, other than the caller's
+            credentials and access rights (which are mixed into the ETag;
+            see `hil.auth.AuthBackend.access_depends_on`).
+    * use_replica (optional): whether GET requests may be served from the
+            read replica, if one is configured (``[database] replica_uri``).
+            Defaults to True; the function must not modify the database if
+            so. Requests with other methods always use the primary.
+
+            After a request which modifies the database, the client is sent
+            the primary's write position, both as a cookie and in the
+            ``X-HIL-Write-Position`` header. GET requests which carry it
+            (in either form) use the primary until the replica has caught up
+            with that position, so clients see their own writes.
 
     For example, given::
 
@@ -180,7 +206,8 @@ def rest_call(methods, path, schema, dont_log=()):
         versioned_path = "/v0" + path
         app.add_url_rule(versioned_path,
                          f.__name__,
-                         _rest_wrapper(f, schema, dont_log),
+                         _rest_wrapper(f, schema, dont_log, depends_on,
+                                       use_replica),
                          methods=meths)
         return f
     return register
@@ -249,7 +276,7 @@ def _do_validation(schema, kwargs):
         raise validation_error
 
 
-def _rest_wrapper(f, schema, dont_log):
+def _rest_wrapper(f, schema, dont_log, depends_on, use_replica):
     """Return a wrapper around `f` that does the following:
 
     * Validate the current request against the schema.
@@ -258,27 +285,129 @@ def _rest_wrapper(f, schema, dont_log):
       `rest_call`.
     * Log arguments, except those in `dont_log`.
     * Convert `None` return values to empty bodies.
+    * Handle conditional GET requests, if `depends_on` is non-empty.
+    * Route GET requests to the read replica, if `use_replica` is True.
+    * Collect statistics about the cost of the request (see
+      `hil.request_stats`).
 
     The result of this is suitable to hand directly to flask.
     """
 
     def wrapper(**kwargs):
         """The wrapper described above."""
-        kwargs = _do_validation(schema, kwargs)
+        stats = request_stats.start()
+        status = 500
+        # The response, once it is certain to be sent:
+        sent = None
+        reading = flask.request.method in ('GET', 'HEAD')
+        try:
+            if reading and use_replica:
+                _route_to_replica()
+            with stats.phase('validate'):
+                kwargs = _do_validation(schema, kwargs)
+
+            censored_kwargs = kwargs.copy()
+            for argname in dont_log:
+                censored_kwargs[argname] = '<<CENSORED>>'
+
+            with stats.phase('auth'):
+                init_auth()
+            logger.info('API call: %s(%s)',
+                        f.__name__, _format_arglist(**censored_kwargs))
+
+            if depends_on and flask.request.method == 'GET':
+                response = _conditional_get(f, kwargs, depends_on, stats)
+            else:
+                response = _call(f, kwargs, stats)
+            status = response.status_code
+            if not reading:
+                _send_write_position(response)
+            if request_stats.headers_enabled():
+                stats.add_headers(response)
+            sent = response
+            return response
+        except HTTPException as e:
+            # APIErrors keep their status in status_code, rather than code:
+            status = getattr(e, 'status_code', e.code)
+            raise
+        finally:
+            model.use_replica(False)
+            request_stats.finish(logger, f.__name__, status, sent)
+    return wrapper
+
+
+def _route_to_replica():
+    """Send the current request's queries to the read replica, if any.
+
+    Requests carrying a write position (see `rest_call`) the replica hasn't
+    reached yet are left on the primary. Once it has, the cookie is dropped.
+    """
+    if not model.replica_configured():
+        return
+    request = flask.request
+    position = request.headers.get(WRITE_POSITION_HEADER)
+    cookie = request.cookies.get(WRITE_POSITION_COOKIE)
+    if position is None:
+        position = cookie
+    if position is not None:
+        if not model.replica_caught_up(position):
+            return
+        if cookie is not None:
+            flask.after_this_request(_forget_write_position)
+    model.use_replica()
+
+
+def _forget_write_position(response):
+    """Delete the write position cookie."""
+    response.delete_cookie(WRITE_POSITION_COOKIE)
+    return response
+
+
+def _send_write_position(response):
+    """Tell the client the primary's write position, after a write.
+
+    Does nothing if no replica is configured, or the request failed.
+    """
+    if not model.replica_configured() or response.status_code >= 400:
+        return
+    position = model.write_position()
+    response.set_cookie(WRITE_POSITION_COOKIE, position, httponly=True)
+    response.headers[WRITE_POSITION_HEADER] = position
 
-        censored_kwargs = kwargs.copy()
-        for argname in dont_log:
-            censored_kwargs[argname] = '<<CENSORED>>'
 
-        init_auth()
-        logger.info('API call: %s(%s)',
-                    f.__name__, _format_arglist(**censored_kwargs))
+def _call(f, kwargs, stats):
+    """Call `f` with `kwargs`, and convert the result to a response.
 
+    `stats` is the `RequestStats` for the request.
+    """
+    with stats.phase('handler'):
         ret = f(**kwargs)
+    with stats.phase('serialize'):
         if ret is None:
             ret = ''
-        return ret
-    return wrapper
+        return flask.make_response(ret)
+
+
+def _conditional_get(f, kwargs, depends_on, stats):
+    """Invoke `f` on behalf of `_rest_wrapper`, handling ETags.
+
+    The ETag is computed *before* calling `f`, so a modification which
+    commits while `f` is running can only make the ETag out of date (causing
+    a needless re-fetch later), never label a stale body as current.
+    """
+    with stats.phase('etag'):
+        etag = table_versions.etag(
+            list(depends_on) + auth.get_auth_backend().access_depends_on(),
+            f.__name__,
+            flask.request.full_path,
+            flask.request.headers.get('Authorization'),
+            flask.request.headers.get('X-Auth-Token'))
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = _call(f, kwargs, stats)
+    response.set_etag(etag)
+    return response
 
 
 def _format_arglist(*args, **kwargs):
@@ -40,18 +40,6 @@ def validate_state():
                  "the auth backend.")
 
 
-def stop_orphan_consoles():
-    """Stop any orphaned console logging processes.
-
-    These may exist if HIL was shut down uncleanly.
-    """
-    # Stop all orphan console logging processes on startup
-    nodes = model.Node.query.all()
-    for node in nodes:
-        node.obm.stop_console()
-        node.obm.delete_console()
-
-
 def init():
     """Set up the api server's internal state.
 
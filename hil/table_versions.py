@@ -0,0 +1,165 @@
+"""Per-table version counters, used to generate ETags.
+
+Each transaction which modifies a table through the ORM increments that
+table's counter in `model.TableVersion`, once per transaction. The counters
+are incremented just before the transaction commits, so that concurrent
+writers to a table only contend for its counter's row lock while
+committing, rather than for the whole of their transactions. An api call
+declares which tables its response is derived from (see the ``depends_on``
+argument to `hil.rest.rest_call`); if none of their versions have changed,
+neither has the response, so a client's cached copy is still good.
+
+Changes made with bulk ``Query.update``/``Query.delete`` bypass the ORM's
+bookkeeping and are *not* counted, so code which changes api-visible state
+must not use them.
+"""
+
+import hashlib
+import random
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from hil import model
+
+
+def _touched_tables(session):
+    """Return the names of the tables the pending flush will modify."""
+    tables = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for table in inspect(obj).mapper.tables:
+            tables.add(table.name)
+    tables.discard(model.TableVersion.__tablename__)
+    return tables
+
+
+def _initial_version():
+    """Return a version for a table which hasn't got one yet.
+
+    This is random, rather than 1, so that clients holding ETags from before
+    the database was recreated don't mistake the new data for the old.
+    """
+    return random.getrandbits(48)
+
+
+def _insert(session, name):
+    """Add a version row for the table ``name``.
+
+    If a concurrent transaction adds it first, increment that instead.
+    """
+    table = model.TableVersion.__table__
+    row = {'table': name, 'version': _initial_version()}
+    if session.get_bind().dialect.name != 'postgresql':
+        # Other databases (i.e. sqlite) serialize writers, so there's no
+        # race to lose:
+        session.execute(table.insert(), row)
+        return
+    conn = session.connection()
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute(table.insert(), row)
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback()
+        conn.execute(table.update()
+                     .where(table.c.table == name)
+                     .values(version=table.c.version + 1))
+
+
+def _bump(session, tables):
+    """Increment the versions of ``tables`` in the current transaction."""
+    table = model.TableVersion.__table__
+    session.execute(table.update()
+                    .where(table.c.table.in_(tables))
+                    .values(version=table.c.version + 1))
+    existing = set(row[0] for row in session.execute(
+        select([table.c.table]).where(table.c.table.in_(tables))))
+    for name in sorted(tables - existing):
+        _insert(session, name)
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _record(session, flush_context, instances):
+    """Note the tables the pending flush will modify.
+
+    Their versions are bumped by `_bump_on_commit`, or straight away if
+    that has already run.
+    """
+    # pylint: disable=unused-argument
+    touched = session.info.setdefault('hil_touched_tables', set())
+    tables = _touched_tables(session) - touched
+    if not tables:
+        return
+    touched |= tables
+    if session.info.get('hil_tables_bumped'):
+        _bump(session, tables)
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def _bump_on_commit(session):
+    """Bump the versions of the tables the transaction has modified.
+
+    Each table is only bumped once per transaction.
+    """
+    if session.transaction.nested:
+        return
+    # Flush now, rather than leaving it to the commit, so that we know every
+    # table that will be modified:
+    session.flush()
+    tables = session.info.get('hil_touched_tables')
+    if tables:
+        _bump(session, tables)
+    session.info['hil_tables_bumped'] = True
+
+
+def _forget(session):
+    """Start counting afresh in the next transaction."""
+    session.info.pop('hil_touched_tables', None)
+    session.info.pop('hil_tables_bumped', None)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _reset_on_commit(session):
+    """Start counting afresh in the next transaction."""
+    _forget(session)
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _reset_on_rollback(session, previous_transaction):
+    """Forget bumps undone by a rollback."""
+    # pylint: disable=unused-argument
+    _forget(session)
+
+
+def versions(tables):
+    """Return a dict mapping each name in ``tables`` to its version.
+
+    Tables which have never been modified have version 0.
+    Versions start at a random value, so only changes in a table's version
+    are meaningful.
+    """
+    result = dict((name, 0) for name in tables)
+    result.update(model.db.session.query(model.TableVersion.table,
+                                         model.TableVersion.version)
+                  .filter(model.TableVersion.table.in_(tables)))
+    return result
+
+
+def etag(classes, *extra):
+    """Return an ETag for a response derived from the models ``classes``.
+
+    The ETag changes whenever any of the classes' tables do; ``extra`` is
+    a sequence of strings which are also mixed in, e.g. to distinguish
+    requests for different resources.
+    """
+    tables = set()
+    for cls in classes:
+        for table in inspect(cls).tables:
+            tables.add(table.name)
+    digest = hashlib.sha1()
+    for name, version in sorted(versions(tables).items()):
+        digest.update('%s=%d\n' % (name, version))
+    for item in extra:
+        digest.update('%r\n' % (item,))
+    return digest.hexdigest()
@@ -18,6 +18,8 @@ import sys
 import os.path
 import logging
 import re
+import threading
+import time
 
 uuid_pattern = re.compile(
             "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
@@ -161,6 +163,25 @@ def with_request_context():
         yield
 
 
+def console_supervisor():
+    """Run a console supervisor in a background thread.
+
+    The supervisor listens on the socket configured in the ``[console]``
+    section; the configuration must be set up first. It is intended to be
+    used via pytests' `yield_fixture`, and yields the `Supervisor`. All
+    console processes are stopped afterwards.
+    """
+    from hil import console_supervisor as supervisor
+    instance = supervisor.Supervisor()
+    thread = threading.Thread(target=instance.serve)
+    thread.daemon = True
+    thread.start()
+    while not os.path.exists(instance.path):
+        time.sleep(0.01)
+    yield instance
+    instance.stop_all()
+
+
 def fail_on_log_warnings():
     """Raise an exception if a message is logged at warning level or higher.
 
@@ -103,8 +103,10 @@ setup(name='hil',
                 'coverage>=4.5.1,<5.0.0',
                 'coveralls>=1.2.0,<2.0.0',
                 'keystonemiddleware>=4.17,!=4.19,<5.0',
+                'prometheus_client==0.3.1',
           ],
           'postgres': ['psycopg2>=2.7,<3.0'],
           'keystone-auth-backend': ['keystonemiddleware>=4.17,!=4.19,<5.0'],
           'keystone-client': ['python-keystoneclient>=3.13,<4.0'],
+          'prometheus': ['prometheus_client==0.3.1'],
       })
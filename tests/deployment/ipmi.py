@@ -5,17 +5,20 @@ somewhat particular to the MOC's development environment. They may be
 difficult to run in other contexts.
 """
 
-from hil.test_common import config_testsuite, fresh_database, \
-    fail_on_log_warnings, with_request_context, site_layout, server_init
+from hil.test_common import config_testsuite, config_merge, \
+    fresh_database, fail_on_log_warnings, with_request_context, site_layout, \
+    server_init
 from hil.model import Node
 from hil import config, api
+import json
 import pytest
 
 
 @pytest.fixture
 def configure():
-    """Configure HIL"""
+    """Configure HIL, carrying out OBM actions synchronously."""
     config_testsuite()
+    config_merge({'obm': {'workers': '0'}})
     config.load_extensions()
 
 
@@ -34,6 +37,18 @@ pytestmark = pytest.mark.usefixtures('configure',
                                      'site_layout')
 
 
+def check_obm_action(response, status):
+    """Check that the OBM action queued by `response` ended with `status`.
+
+    `response` is the return value of an api call which queues an OBM
+    action; with ``workers = 0`` the action has already been carried out.
+    """
+    body, code = response
+    assert code == 202
+    status_id = json.loads(body)['status_id']
+    assert json.loads(api.show_obm_action(status_id))['status'] == status
+
+
 class TestIpmi():
     """ Test IPMI driver calls using functions included in the IPMI driver. """
 
@@ -46,33 +61,34 @@ class TestIpmi():
         """Test power cycling nodes."""
         nodes = self.collect_nodes()
         for node in nodes:
-            api.node_power_cycle(node.label)
+            check_obm_action(api.node_power_cycle(node.label), 'DONE')
 
     def test_node_power_force(self):
         """Test power cycling nodes, with force=True."""
         nodes = self.collect_nodes()
         for node in nodes:
-            api.node_power_cycle(node.label, True)
+            check_obm_action(api.node_power_cycle(node.label, True), 'DONE')
 
     def test_node_power_off(self):
         """Test shutting down nodes properly"""
         nodes = self.collect_nodes()
         for node in nodes:
-            api.node_power_off(node.label)
+            check_obm_action(api.node_power_off(node.label), 'DONE')
 
     def test_node_set_bootdev(self):
         """Test setting the boot device."""
         nodes = self.collect_nodes()
         for node in nodes:
             # change a node's bootdevice to a valid boot device
-            api.node_set_bootdev(node.label, 'pxe')
-            api.node_set_bootdev(node.label, 'disk')
-            api.node_set_bootdev(node.label, 'none')
+            for dev in 'pxe', 'disk', 'none':
+                check_obm_action(api.node_set_bootdev(node.label, dev),
+                                 'DONE')
             # set the bootdevice to something invalid
             with pytest.raises(api.BadArgumentError):
                 api.node_set_bootdev(node.label, 'invalid-device')
 
-        # register a node with erroneous ipmi details to raise OBMError
+        # register a node with erroneous ipmi details, on which the action
+        # fails
         # XXX: In theory, this could actually be a real node; we should take
         # some measure to ensure this never collides with something actually
         # in our test setup.
@@ -80,6 +96,8 @@ class TestIpmi():
                   "type": "http://schema.massopencloud.org/haas/v0/obm/ipmi",
                   "host": "ipmihost",
                   "user": "root",
-                  "password": "tapeworm"})
-        with pytest.raises(api.OBMError):
-            api.node_set_bootdev('node-99-z4qa63', 'none')
+                  "password": "tapeworm"}, obmd={
+                  "uri": "http://obmd.example.com/nodes/node-99-z4qa63",
+                  "admin_token": "secret"})
+        check_obm_action(api.node_set_bootdev('node-99-z4qa63', 'none'),
+                         'ERROR')
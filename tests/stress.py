@@ -5,11 +5,16 @@ after a certain amount of use.
 """
 
 from hil.test_common import config_testsuite, fresh_database, config_merge, \
-    fail_on_log_warnings, server_init
-from hil import api, config, rest
+    fail_on_log_warnings, server_init, newDB
+from hil import api, config, model, prefork, rest, server
 
 import json
+import os
 import pytest
+import requests
+import signal
+import threading
+import time
 
 
 @pytest.fixture
@@ -116,3 +121,201 @@ def test_many_http_queries():
         assert resp.status_code == 200
         for project in json.loads(resp.get_data()):
             _show_nodes('/v0/project/%s/nodes' % project)
+
+
+def test_serve_api_benchmark(tmpdir):
+    """Measure the startup time and throughput of the pre-fork api server.
+
+    This runs the server the way ``hil-admin serve-api`` does, and prints how
+    long it took to start serving, and how many requests per second it
+    handled from several concurrent clients. It only asserts that every
+    request succeeded; run with ``-s`` to see the numbers.
+    """
+    if config.cfg.get('database', 'uri') == 'sqlite:///:memory:':
+        # Workers can't share an in-memory database:
+        config_merge({
+            'database': {'uri': 'sqlite:///%s' % tmpdir.join('hil.db')},
+        })
+        newDB()
+    with rest.app.test_request_context():
+        rest.init_auth()
+        for i in range(10):
+            api.project_create('project-%d' % i)
+
+    workers, threads, clients, requests_per_client = 2, 4, 8, 50
+
+    start = time.time()
+    with rest.app.app_context():
+        server.init()
+        model.db.engine.dispose()
+    srv = prefork.PreforkServer(rest.app, port=0,
+                                workers=workers, threads=threads)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            srv.run()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    srv.server.server_close()
+    url = 'http://127.0.0.1:%d/v0/projects' % srv.port
+
+    try:
+        while True:
+            try:
+                assert requests.get(url).status_code == 200
+                break
+            except requests.ConnectionError:
+                assert time.time() - start < 30, "Server failed to start"
+                time.sleep(0.01)
+        startup = time.time() - start
+
+        statuses = []
+
+        def _client():
+            session = requests.Session()
+            for _i in range(requests_per_client):
+                statuses.append(session.get(url).status_code)
+
+        client_threads = [threading.Thread(target=_client)
+                          for _i in range(clients)]
+        start = time.time()
+        for thread in client_threads:
+            thread.start()
+        for thread in client_threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    assert statuses == [200] * (clients * requests_per_client)
+    print('serve-api (%d workers x %d threads): started in %.2fs; '
+          '%.1f requests/s from %d clients' %
+          (workers, threads, startup, len(statuses) / elapsed, clients))
+
+
+def _populate_for_query_plans(nodes):
+    """Bulk-insert `nodes` nodes, and the objects hung off of them.
+
+    Every node but one in a hundred belongs to a project, and has a nic
+    attached to a switch port and a network, and a metadata entry. Every nic
+    has a networking action; the most recent one in a thousand are pending,
+    and the rest finished.
+    """
+    engine = model.db.engine
+    ids = range(1, nodes + 1)
+
+    def _insert(cls, rows):
+        engine.execute(cls.__table__.insert(), list(rows))
+
+    _insert(model.Project, [{'id': 1, 'label': 'runway'}])
+    _insert(model.Switch, [{'id': 1, 'label': 'sw0', 'type': 'mock'}])
+    _insert(model.Network, [{'id': 1, 'label': 'pxe', 'owner_id': 1,
+                             'allocated': True, 'network_id': '100'}])
+    _insert(model.Obm, ({'id': i, 'type': 'mock'} for i in ids))
+    _insert(model.Node, ({'id': i, 'label': 'node-%d' % i, 'obm_id': i,
+                          'project_id': None if i % 100 == 0 else 1,
+                          'obmd_uri': 'http://obmd/node-%d' % i,
+                          'obmd_admin_token': 'secret'} for i in ids))
+    _insert(model.Port, ({'id': i, 'label': 'gi1/0/%d' % i, 'owner_id': 1}
+                         for i in ids))
+    _insert(model.Nic, ({'id': i, 'label': 'eth0', 'owner_id': i,
+                         'port_id': i, 'mac_addr': None} for i in ids))
+    _insert(model.Metadata, ({'id': i, 'label': 'rack', 'value': '"A1"',
+                              'owner_id': i} for i in ids))
+    _insert(model.NetworkAttachment, ({'id': i, 'nic_id': i, 'network_id': 1,
+                                       'channel': 'vlan/native'}
+                                      for i in ids))
+    _insert(model.NetworkingAction, ({
+        'id': i,
+        'uuid': 'action-%d' % i,
+        'status': 'PENDING' if i > nodes - nodes // 1000 else 'DONE',
+        'type': 'modify_port',
+        'nic_id': i,
+        'new_network_id': 1,
+        'channel': 'vlan/native',
+    } for i in ids))
+
+
+def _query_plan(query):
+    """Return the database's plan for `query`, as a string."""
+    engine = model.db.engine
+    sql = str(query.statement.compile(dialect=engine.dialect,
+                                      compile_kwargs={'literal_binds': True}))
+    if engine.dialect.name == 'sqlite':
+        rows = engine.execute('EXPLAIN QUERY PLAN ' + sql)
+        return '; '.join(row[-1] for row in rows)
+    rows = engine.execute('EXPLAIN ' + sql)
+    return '; '.join(row[0].strip() for row in rows)
+
+
+def _analyze():
+    """Update postgres' statistics, as autovacuum would in production.
+
+    SQLite only keeps statistics if explicitly asked to, which HIL doesn't.
+    """
+    if model.db.engine.dialect.name == 'postgresql':
+        model.db.engine.execute('ANALYZE')
+
+
+def _time_query(query, repeat=20):
+    """Return the mean time (in seconds) taken to run `query`."""
+    start = time.time()
+    for _i in range(repeat):
+        query.all()
+    return (time.time() - start) / repeat
+
+
+def test_lookup_query_plans():
+    """Compare the plans of the hot lookup queries with and without indexes.
+
+    This populates the database with 50,000 nodes, then prints the plan
+    and mean run time of each query before and after creating the indexes
+    it should use, and asserts that they are used. Run with ``-s`` to see
+    the output.
+    """
+    nodes = 50000
+    with rest.app.app_context():
+        _populate_for_query_plans(nodes)
+        session = model.db.session
+        queries = [
+            ('ix_networking_action_status_id', session.query(
+                model.NetworkingAction)
+                .order_by(model.NetworkingAction.id)
+                .filter_by(status='PENDING').limit(1)),
+            ('ix_node_project_id',
+             session.query(model.Node).filter_by(project_id=None)),
+            ('ix_nic_owner_id_label', session.query(model.Nic)
+                .filter_by(owner_id=nodes // 2, label='eth0')),
+            ('ix_port_owner_id_label', session.query(model.Port)
+                .filter_by(owner_id=1, label='gi1/0/%d' % (nodes // 2))),
+            ('ix_metadata_owner_id_label', session.query(model.Metadata)
+                .filter_by(owner_id=nodes // 2, label='rack')),
+            ('ix_network_attachment_nic_id_channel',
+             session.query(model.NetworkAttachment)
+                .filter_by(nic_id=nodes // 2, channel='vlan/native')),
+            ('ix_network_attachment_nic_id_network_id',
+             session.query(model.NetworkAttachment)
+                .filter_by(nic_id=nodes // 2, network_id=1)),
+        ]
+        engine = model.db.engine
+        indexes = dict((index.name, index)
+                       for table in model.db.metadata.sorted_tables
+                       for index in table.indexes)
+        for name, _query in queries:
+            indexes[name].drop(bind=engine)
+        _analyze()
+        before = [(_query_plan(q), _time_query(q)) for _name, q in queries]
+        for name, _query in queries:
+            indexes[name].create(bind=engine)
+        _analyze()
+        after = [(_query_plan(q), _time_query(q)) for _name, q in queries]
+        session.rollback()
+
+    print('Query plans with %d nodes:' % nodes)
+    for (name, _query), (plan0, time0), (plan1, time1) in \
+            zip(queries, before, after):
+        print('%s: %.3fms -> %.3fms\n  before: %s\n  after:  %s' %
+              (name, time0 * 1000, time1 * 1000, plan0, plan1))
+    for (name, _query), (plan, _time) in zip(queries, after):
+        assert name in plan
@@ -633,7 +633,7 @@ admin_calls = [
     # Nodes assigned to a project are tested in project_calls, below.
     (api.node_power_cycle, ['free_node_0'], {}),
     (api.node_power_off, ['free_node_0'], {}),
-    (api.node_set_bootdev, ['free_node_0'], {'bootdev': {'none'}}),
+    (api.node_set_bootdev, ['free_node_0'], {'bootdev': 'none'}),
 
     (api.project_delete, ['empty-project'], {}),
 
@@ -664,7 +664,7 @@ project_calls = [
     # Free nodes are testsed in admin_calls, above.
     (api.node_power_cycle, ['runway_node_0'], {}),
     (api.node_power_off, ['runway_node_0'], {}),
-    (api.node_set_bootdev, ['runway_node_0'], {'bootdev': {'none'}}),
+    (api.node_set_bootdev, ['runway_node_0'], {'bootdev': 'none'}),
 
     (api.project_connect_node, ['runway', 'free_node_0'], {}),
     (api.project_detach_node, ['runway', 'runway_node_0'], {}),
@@ -51,6 +51,7 @@ from hil.auth import get_auth_backend
 import pytest
 import unittest
 import json
+import time
 import uuid
 from schema import SchemaError
 
@@ -2512,6 +2513,27 @@ class TestShowNetworkingAction(unittest.TestCase):
         assert response['channel'] == 'vlan/native'
         assert response['new_network'] is None
 
+    def test_show_networking_action_archived(self):
+        """Actions removed from the journal can still be shown."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+        deferred.apply_networking()
+
+        # This removes the finished action from the journal:
+        api.node_detach_network('node-99', '99-eth0', 'hammernet')
+        assert model.NetworkingAction.query \
+            .filter_by(uuid=status_id).first() is None
+
+        response = json.loads(api.show_networking_action(status_id))
+        assert response == {'status': 'DONE',
+                            'node': 'node-99',
+                            'nic': '99-eth0',
+                            'type': 'modify_port',
+                            'channel': 'vlan/native',
+                            'new_network': 'hammernet'}
+        response = json.loads(api.show_networking_actions(status_id))
+        assert response[status_id]['status'] == 'DONE'
+
     def test_show_networking_action_revert_port(self):
         """Show networking action on a revert port type of operation"""
         response = api.port_revert('sw0', PORTS[2])
@@ -2531,3 +2553,256 @@ class TestShowNetworkingAction(unittest.TestCase):
         status_id = '96c888a9-3257-491b-bca9-06be26b15525'
         with pytest.raises(errors.NotFoundError):
             api.show_networking_action(status_id)
+
+    def test_show_networking_action_wait_done(self):
+        """Waiting on a finished action should return immediately."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+        deferred.apply_networking()
+
+        start = time.time()
+        response = json.loads(api.show_networking_action(status_id, wait=30))
+        assert response['status'] == 'DONE'
+        assert time.time() - start < 5
+
+    def test_show_networking_action_wait_timeout(self):
+        """Waiting on a pending action should give up after the timeout."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+
+        start = time.time()
+        response = json.loads(api.show_networking_action(status_id,
+                                                         wait=0.2))
+        assert response['status'] == 'PENDING'
+        assert time.time() - start >= 0.2
+
+    def test_show_networking_actions(self):
+        """Query several networking actions at once."""
+        api.switch_register_port('sw0', PORTS[3])
+        new_node('node-98')
+        api.node_register_nic('node-98', '98-eth0', 'DE:AD:BE:EF:20:15')
+        api.project_connect_node('anvil-nextgen', 'node-98')
+        api.port_connect_nic('sw0', PORTS[3], 'node-98', '98-eth0')
+
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        first = json.loads(response[0])['status_id']
+        deferred.apply_networking()
+        response = api.node_connect_network('node-98', '98-eth0', 'hammernet')
+        second = json.loads(response[0])['status_id']
+
+        response = json.loads(api.show_networking_actions(
+            first + ',' + second, wait=0.1))
+        assert sorted(response.keys()) == sorted([first, second])
+        assert response[first]['status'] == 'DONE'
+        assert response[second] == {'status': 'PENDING',
+                                    'node': 'node-98',
+                                    'nic': '98-eth0',
+                                    'type': 'modify_port',
+                                    'channel': 'vlan/native',
+                                    'new_network': 'hammernet'}
+
+        deferred.apply_networking()
+        response = json.loads(api.show_networking_actions(second, wait=30))
+        assert response[second]['status'] == 'DONE'
+
+    def test_show_networking_actions_nonexistent(self):
+        """Any unknown status_id should make the whole call fail."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+        with pytest.raises(errors.NotFoundError):
+            api.show_networking_actions(
+                status_id + ',96c888a9-3257-491b-bca9-06be26b15525')
+
+
+class TestNodesPower:
+    """Test the bulk power api calls."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, configure, fresh_database, server_init,
+              with_request_context, set_admin_auth):
+        """Run obm actions synchronously, and create some nodes."""
+        # pylint: disable=redefined-outer-name,unused-argument
+        config_merge({'obm': {'workers': '0'}})
+        for name in 'node-97', 'node-98', 'node-99':
+            new_node(name)
+
+    def test_nodes_power(self):
+        """Power cycling several nodes runs an action on each."""
+        response, status = api.nodes_power(['node-98', 'node-99'],
+                                           'power_cycle', force=True)
+        assert status == 202
+        response = json.loads(response)
+        assert response['operation'] == 'power_cycle'
+        assert sorted(response['nodes']) == ['node-98', 'node-99']
+
+        response = json.loads(api.show_nodes_power(response['job_id']))
+        assert response['nodes'] == {
+            'node-98': {'status': 'DONE', 'error': None},
+            'node-99': {'status': 'DONE', 'error': None},
+        }
+        action = model.ObmAction.query.first()
+        assert json.loads(action.args) == {'force': True}
+        assert action.finished is not None
+
+    def test_nodes_power_error(self, monkeypatch):
+        """A failure on one node doesn't affect the others."""
+        from hil.ext.obm.mock import MockObm
+        failing = api.get_or_404(model.Node, 'node-97').obm_id
+
+        def power_off(obm):
+            """Fail on node-97 only."""
+            if obm.id == failing:
+                raise errors.OBMError('Could not power off node-97')
+        monkeypatch.setattr(MockObm, 'power_off', power_off)
+
+        response, _ = api.nodes_power(['node-97', 'node-98'], 'power_off')
+        job_id = json.loads(response)['job_id']
+        response = json.loads(api.show_nodes_power(job_id))
+        assert response['nodes'] == {
+            'node-97': {'status': 'ERROR',
+                        'error': 'Could not power off node-97'},
+            'node-98': {'status': 'DONE', 'error': None},
+        }
+
+    def test_nodes_power_bad_args(self):
+        """Nothing is done if any node doesn't exist."""
+        with pytest.raises(errors.NotFoundError):
+            api.nodes_power(['node-98', 'node-100'], 'power_off')
+        with pytest.raises(errors.BadArgumentError):
+            api.nodes_power([], 'power_off')
+        with pytest.raises(errors.NotFoundError):
+            api.show_nodes_power('96c888a9-3257-491b-bca9-06be26b15525')
+        assert model.ObmAction.query.count() == 0
+
+    def test_node_delete_running_power(self):
+        """Nodes can't be deleted while power operations are running."""
+        node = api.get_or_404(model.Node, 'node-99')
+        action = model.ObmAction(node, 'power_off', {}, job='a-job')
+        action.status = 'RUNNING'
+        model.db.session.add(action)
+        model.db.session.commit()
+        with pytest.raises(errors.BlockedError):
+            api.node_delete('node-99')
+
+        action.status = 'DONE'
+        model.db.session.commit()
+        api.node_delete('node-99')
+        assert model.ObmAction.query.count() == 0
+
+    def test_node_delete_pending_power(self):
+        """Deleting a node cancels its power operations not yet started."""
+        node = api.get_or_404(model.Node, 'node-99')
+        action = model.ObmAction(node, 'power_off', {}, job='a-job')
+        model.db.session.add(action)
+        model.db.session.commit()
+        action_id, status_id = action.id, action.uuid
+        api.node_delete('node-99')
+        assert model.ObmAction.query.count() == 0
+
+        from hil import obm_jobs
+        obm_jobs.run_action(action_id)
+        with pytest.raises(errors.NotFoundError):
+            api.show_obm_action(status_id, wait=1)
+
+
+class TestShowObmAction:
+    """Test OBM actions on single nodes, and the show_obm_action api call."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, configure, fresh_database, server_init,
+              with_request_context, set_admin_auth):
+        """Create a node."""
+        # pylint: disable=redefined-outer-name,unused-argument
+        new_node('node-99')
+
+    def test_power_cycle_queued(self):
+        """Power cycling a node queues an action, for the OBM server."""
+        response, status = api.node_power_cycle('node-99', force=True)
+        assert status == 202
+        status_id = json.loads(response)['status_id']
+
+        response = json.loads(api.show_obm_action(status_id))
+        assert response == {'status': 'PENDING',
+                            'error': None,
+                            'node': 'node-99',
+                            'type': 'power_cycle'}
+
+        from hil import obm_jobs
+        action = model.ObmAction.query.filter_by(uuid=status_id).one()
+        obm_jobs.run_action(action.id)
+        response = json.loads(api.show_obm_action(status_id, wait=30))
+        assert response['status'] == 'DONE'
+
+        # Actions are only ever run once:
+        obm_jobs.run_action(action.id)
+        assert model.ObmAction.query.count() == 1
+
+    def test_set_bootdev(self):
+        """Setting the boot device queues an action with the device."""
+        api.node_set_bootdev('node-99', 'pxe')
+        action = model.ObmAction.query.one()
+        assert action.type == 'set_bootdev'
+        assert json.loads(action.args) == {'dev': 'pxe'}
+
+    def test_show_obm_action_wait_timeout(self):
+        """Waiting on an unfinished action gives up after the timeout."""
+        response, _ = api.node_power_off('node-99')
+        status_id = json.loads(response)['status_id']
+
+        start = time.time()
+        response = json.loads(api.show_obm_action(status_id, wait=0.2))
+        assert response['status'] == 'PENDING'
+        assert time.time() - start >= 0.2
+
+    def test_show_obm_action_nonexistent(self):
+        """Show obm action on a non existent status_id"""
+        with pytest.raises(errors.NotFoundError):
+            api.show_obm_action('96c888a9-3257-491b-bca9-06be26b15525')
+
+
+class TestShowConsole:
+    """Test reading the console log with show_console."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, configure, fresh_database, server_init,
+              with_request_context, set_admin_auth):
+        """Create a node, and start logging its console."""
+        # pylint: disable=redefined-outer-name,unused-argument
+        new_node('node-99')
+        api.start_console('node-99')
+
+    def test_show_console(self):
+        """The log is streamed, along with the offset of its end."""
+        response = api.show_console('node-99')
+        assert response.get_data() == 'Some console output'
+        assert response.headers['X-Console-Offset'] == '19'
+
+    def test_show_console_offset(self):
+        """Only the log after the offset is shown."""
+        response = api.show_console('node-99', offset=5)
+        assert response.get_data() == 'console output'
+        response = api.show_console('node-99', offset=19)
+        assert response.get_data() == ''
+        assert response.headers['X-Console-Offset'] == '19'
+
+    def test_show_console_tail(self):
+        """Only the end of the log is shown."""
+        response = api.show_console('node-99', tail=6)
+        assert response.get_data() == 'output'
+        assert response.headers['X-Console-Offset'] == '19'
+
+    def test_show_console_stopped(self):
+        """There is no log to show once the console is stopped."""
+        api.stop_console('node-99')
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+
+    def test_follow_console(self):
+        """The log can be followed, from an offset or its tail."""
+        response = api.follow_console('node-99')
+        assert response.get_data() == 'Some console output'
+        response = api.follow_console('node-99', tail=6)
+        assert response.get_data() == 'output'
+        api.stop_console('node-99')
+        with pytest.raises(errors.NotFoundError):
+            api.follow_console('node-99')
@@ -105,3 +105,16 @@ class TestProjectDetachNodeMaintenance:
         maintenance_proj = api.get_or_404(model.Project, 'maintenance')
         node = api.get_or_404(model.Node, 'node-99')
         assert node.project == maintenance_proj
+
+    def test_project_detach_node_shutdown(self, maintenance_proj_init):
+        """With ``shutdown`` set, powering the node off is queued."""
+        config_merge({'maintenance': {'shutdown': 'True'}})
+        api.project_create('anvil-nextgen')
+        new_node('node-99')
+        api.project_connect_node('anvil-nextgen', 'node-99')
+        with pytest.raises(LoggedWarningError):
+            api.project_detach_node('anvil-nextgen', 'node-99')
+        action = model.ObmAction.query.one()
+        assert action.node.label == 'node-99'
+        assert action.type == 'power_off'
+        assert action.status == 'PENDING'
@@ -26,15 +26,16 @@ class FlaskHTTPClient(HTTPClient):
     def __init__(self):
         self._flask_client = app.test_client()
 
-    def request(self, method, url, data=None, params=None):
+    def request(self, method, url, data=None, params=None, headers=None):
 
         # Flask doesn't provide a straightforward way to do basic auth,
         # but it's not actually that complicated:
         auth_header = 'Basic ' + urlsafe_b64encode(username + ':' + password)
+        headers = dict(headers or {}, Authorization=auth_header)
 
         resp = self._flask_client.open(
             method=method,
-            headers={'Authorization': auth_header},
+            headers=headers,
             # flask expects just a path, and assumes
             # the host & scheme:
             path=urlparse(url).path,
@@ -344,15 +345,15 @@ class Test_node:
 
     def test_power_cycle(self):
         """(successful) to node_power_cycle"""
-        assert C.node.power_cycle('node-07') is None
+        assert 'status_id' in C.node.power_cycle('node-07')
 
     def test_power_cycle_force(self):
         """(successful) to node_power_cycle(force=True)"""
-        assert C.node.power_cycle('node-07', True) is None
+        assert 'status_id' in C.node.power_cycle('node-07', True)
 
     def test_power_cycle_no_force(self):
         """(successful) to node_power_cycle(force=False)"""
-        assert C.node.power_cycle('node-07', False) is None
+        assert 'status_id' in C.node.power_cycle('node-07', False)
 
     def test_power_cycle_bad_arg(self):
         """error on call to power_cycle with bad argument."""
@@ -366,7 +367,13 @@ class Test_node:
 
     def test_power_off(self):
         """(successful) to node_power_off"""
-        assert C.node.power_off('node-07') is None
+        status_id = C.node.power_off('node-07')['status_id']
+        assert C.node.show_obm_action(status_id) == {
+            'status': 'PENDING',
+            'error': None,
+            'node': 'node-07',
+            'type': 'power_off',
+        }
 
     def test_power_off_reserved_chars(self):
         """ test for catching illegal argument characters"""
@@ -375,7 +382,7 @@ class Test_node:
 
     def test_set_bootdev(self):
         """ (successful) to node_set_bootdev """
-        assert C.node.set_bootdev("node-08", "pxe") is None
+        assert 'status_id' in C.node.set_bootdev("node-08", "pxe")
 
     def test_node_add_nic(self):
         """Test removing and then adding a nic."""
@@ -443,6 +450,9 @@ class Test_node:
 
         C.node.start_console('node-01')
         assert C.node.show_console('node-01') == 'Some console output'
+        assert C.node.show_console('node-01', tail=6) == 'output'
+        assert C.node.read_console('node-01', offset=5) == \
+            ('console output', 19)
 
         C.node.stop_console('node-01')
         with pytest.raises(FailedAPICallException):
@@ -950,6 +960,15 @@ class Test_network:
         with pytest.raises(BadArgumentError):
             C.network.create('net/%]-123', 'proj-01', 'proj-01', '')
 
+    def test_network_allocator_usage(self):
+        """ Test showing how many network ids are in use. """
+        usage = C.network.allocator_usage()
+        assert sorted(usage) == [u'default']
+        assert usage['default']['free'] + usage['default']['used'] == 40
+        C.network.create('net-abcd', 'proj-01', 'proj-01', '')
+        assert C.network.allocator_usage()['default']['used'] == \
+            usage['default']['used'] + 1
+
     def test_network_delete(self):
         """ Test network deletion """
         C.network.create('net-xyz', 'proj-01', 'proj-01', '')
@@ -1049,3 +1068,30 @@ class TestShowNetworkingAction:
         """(unsuccessful) call to show_networking_action"""
         with pytest.raises(FailedAPICallException):
             C.node.show_networking_action('non-existent-entry')
+
+
+class TestResponseCache:
+    """Test caching and revalidation of GET responses."""
+
+    def test_revalidate(self):
+        """Unchanged responses are served from the cache."""
+        requests = []
+
+        class RecordingHTTPClient(FlaskHTTPClient):
+            """Records the status of each response."""
+
+            def request(self, method, url, data=None, params=None,
+                        headers=None):
+                resp = FlaskHTTPClient.request(self, method, url, data=data,
+                                               params=params, headers=headers)
+                requests.append(resp.status_code)
+                return resp
+
+        client = Client(ep, RecordingHTTPClient())
+        projects = client.project.list()
+        assert client.project.list() == projects
+        assert requests == [200, 304]
+
+        client.project.create('proj-99')
+        assert client.project.list() == projects + ['proj-99']
+        assert requests == [200, 304, 200, 200]
@@ -46,6 +46,15 @@ def test_validate_config():
         'client': {
             'endpoint': 'http://127.0.0.1:5000',
         },
+        'database': {
+            'replica_uri': 'postgresql://hil@replica/hil',
+            'pool_size': '10',
+            'max_overflow': '5',
+            'pool_timeout': '30',
+            'pool_recycle': '3600',
+            'pool_pre_ping': 'True',
+            'statement_timeout': '30000',
+        },
         'maintenance': {
             'maintenance_project': 'maintenance',
             'url': 'http://test.xyz',
@@ -185,3 +194,10 @@ def test_bad_vlans():
     "Test strings for invalid VLAN ranges."""
     opts = ['12-', 'p13,q14,15,16,17,18,1234x', '1-900, 902-904, 905, 5000']
     assert all(not config.string_has_vlans(s) for s in opts)
+
+
+def test_nonnegative_ints():
+    """Test strings for valid and invalid non-negative integers."""
+    assert all(config.string_is_nonnegative_int(s) for s in ['0', '42'])
+    assert not any(config.string_is_nonnegative_int(s)
+                   for s in ['-1', '1.5', 'ten', ''])
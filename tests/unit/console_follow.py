@@ -0,0 +1,143 @@
+"""Test following console logs."""
+import threading
+
+import pytest
+
+from hil import console_follow, console_logs
+from hil.errors import BlockedError
+from hil.test_common import config_testsuite, config_merge
+
+
+@pytest.fixture(autouse=True)
+def configure(tmpdir):
+    """Configure HIL, with the logs in `tmpdir`."""
+    config_testsuite()
+    config_merge({
+        'console': {
+            'log_dir': str(tmpdir),
+        },
+    })
+
+
+@pytest.fixture
+def writer(tmpdir):
+    """Return a `console_logs.Writer` for a log with some output."""
+    writer = console_logs.Writer(str(tmpdir.join('node.log')))
+    writer.write('PXE boot\n')
+    yield writer
+    writer.close()
+
+
+def _next(stream, timeout=10):
+    """Return the next chunk from `stream`, failing if it takes too long.
+
+    Returns None if the stream has ended.
+    """
+    result = []
+
+    def _read():
+        result.append(next(stream, None))
+    thread = threading.Thread(target=_read)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    assert result, 'Timed out'
+    return result[0]
+
+
+def test_follow(writer):
+    """Following a log streams it, and then the output added to it."""
+    stream = console_follow.follow(writer.name)
+    assert _next(stream) == 'PXE boot\n'
+    writer.write('Loading kernel\xff\n')
+    assert _next(stream) == 'Loading kernel\n'
+
+
+def test_offset_tail(writer):
+    """offset and tail select where to start following."""
+    assert _next(console_follow.follow(writer.name, tail=5)) == 'boot\n'
+    assert _next(console_follow.follow(writer.name, offset=4)) == 'boot\n'
+
+
+def test_fan_out(writer):
+    """All of a log's viewers share a single follower."""
+    first = console_follow.follow(writer.name)
+    second = console_follow.follow(writer.name)
+    assert _next(first) == _next(second) == 'PXE boot\n'
+    assert len(console_follow._followers) == 1
+    follower = console_follow._followers[writer.name]
+    assert len(follower.viewers) == 2
+
+    writer.write('login: ')
+    assert _next(first) == _next(second) == 'login: '
+    first.close()
+    assert len(follower.viewers) == 1
+
+
+def test_delete(writer):
+    """Streams end when the log is deleted."""
+    stream = console_follow.follow(writer.name)
+    assert _next(stream) == 'PXE boot\n'
+    console_logs.delete(writer.name)
+    assert _next(stream) is None
+    assert console_follow._followers == {}
+
+
+def test_missing(tmpdir):
+    """Following a log which doesn't exist returns None."""
+    assert console_follow.follow(str(tmpdir.join('nonexistent.log'))) is None
+    assert console_follow._followers == {}
+
+
+def test_polling(writer, monkeypatch):
+    """Logs are still followed if inotify isn't available."""
+    monkeypatch.setattr(console_follow, '_libc', None)
+    monkeypatch.setattr(console_follow, 'POLL_INTERVAL', 0.1)
+    stream = console_follow.follow(writer.name)
+    assert _next(stream) == 'PXE boot\n'
+    writer.write('login: ')
+    assert _next(stream) == 'login: '
+
+
+def test_keepalive(writer, monkeypatch):
+    """Quiet logs send keep-alives, so disconnected clients are noticed."""
+    monkeypatch.setattr(console_follow, 'KEEPALIVE_INTERVAL', 0.1)
+    stream = console_follow.follow(writer.name)
+    assert _next(stream) == 'PXE boot\n'
+    assert _next(stream) == console_follow.KEEPALIVE
+    writer.write('login: ')
+    chunk = _next(stream)
+    while chunk == console_follow.KEEPALIVE:
+        chunk = _next(stream)
+    assert chunk == 'login: '
+    # The client going away closes the stream, and its viewer:
+    stream.close()
+    assert console_follow._followers == {}
+
+
+def test_max_followers(writer):
+    """Each process only allows so many followers at once."""
+    config_merge({'console': {'max_followers': '2'}})
+    first = console_follow.follow(writer.name)
+    second = console_follow.follow(writer.name)
+    with pytest.raises(BlockedError):
+        console_follow.follow(writer.name)
+    first.close()
+    second.close()
+    assert _next(console_follow.follow(writer.name)) == 'PXE boot\n'
+
+
+def test_max_followers_threads(writer, monkeypatch):
+    """By default, serve-api leaves a thread free for other requests."""
+    from hil.flaskapp import app
+    monkeypatch.setitem(app.config, 'HIL_API_THREADS', 2)
+    stream = console_follow.follow(writer.name)
+    with pytest.raises(BlockedError):
+        console_follow.follow(writer.name)
+    stream.close()
+
+    # 0 means there is no limit:
+    config_merge({'console': {'max_followers': '0'}})
+    streams = [console_follow.follow(writer.name) for _ in range(3)]
+    for stream in streams:
+        stream.close()
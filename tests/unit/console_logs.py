@@ -0,0 +1,189 @@
+"""Test writing and reading console logs."""
+import gzip
+import os
+
+import pytest
+
+from hil import console_logs
+from hil.test_common import config_testsuite, config_merge
+
+
+@pytest.fixture(autouse=True)
+def configure(tmpdir):
+    """Configure HIL, with small segments."""
+    config_testsuite()
+    config_merge({
+        'console': {
+            'log_dir': str(tmpdir),
+            'segment_size': '10',
+            'max_node_size': '0',
+        },
+    })
+
+
+@pytest.fixture
+def log(tmpdir):
+    """Return the name of a console log, 10 bytes long, in one segment."""
+    name = str(tmpdir.join('node.log'))
+    writer = console_logs.Writer(name)
+    writer.write('012345678')
+    writer.close()
+    # Add the last byte separately, so the segment isn't rotated:
+    with open(os.path.join(name, '0'), 'a') as f:
+        f.write('9')
+    return name
+
+
+def _read(name, offset=None, tail=None):
+    """Read `name`, returning the end offset and the joined chunks."""
+    end, chunks = console_logs.read(name, offset, tail)
+    return end, ''.join(chunks)
+
+
+def test_missing(tmpdir):
+    """Reading a log which doesn't exist returns None."""
+    assert console_logs.read(str(tmpdir.join('nonexistent.log'))) is None
+
+
+@pytest.mark.parametrize('offset,tail,expected', [
+    (None, None, '0123456789'),
+    (4, None, '456789'),
+    (10, None, ''),
+    # The log must have been started again:
+    (11, None, '0123456789'),
+    (None, 3, '789'),
+    (None, 0, ''),
+    (None, 20, '0123456789'),
+    # Whichever of offset and tail starts later wins:
+    (4, 3, '789'),
+    (8, 3, '89'),
+])
+def test_ranges(log, offset, tail, expected):
+    """offset and tail select the part of the log to read."""
+    assert _read(log, offset, tail) == (10, expected)
+
+
+def test_chunks(log, monkeypatch):
+    """Logs are read a chunk at a time, stopping at the end offset."""
+    monkeypatch.setattr(console_logs, 'CHUNK_SIZE', 4)
+    end, chunks = console_logs.read(log, 1)
+    with open(os.path.join(log, '0'), 'a') as f:
+        f.write('written later')
+    assert end == 10
+    assert list(chunks) == ['1234', '5678', '9']
+    assert _read(log, end) == (23, 'written later')
+
+
+def test_non_ascii(tmpdir, monkeypatch):
+    """Non-ASCII bytes are removed, but still count towards offsets."""
+    monkeypatch.setattr(console_logs, 'CHUNK_SIZE', 3)
+    name = str(tmpdir.join('node.log'))
+    writer = console_logs.Writer(name)
+    writer.write(b'ab\xff\xfecd\x80\n')
+    writer.close()
+    assert _read(name) == (8, 'abcd\n')
+    assert _read(name, 3) == (8, 'cd\n')
+
+
+def test_rotation(tmpdir):
+    """Segments are rotated and compressed, and read across seamlessly."""
+    name = str(tmpdir.join('node.log'))
+    writer = console_logs.Writer(name)
+    for line in ['line %02d\n' % i for i in range(10)]:
+        writer.write(line)
+    assert sorted(os.listdir(name)) == \
+        ['0.gz', '16.gz', '32.gz', '48.gz', '64.gz', '80']
+    with gzip.open(os.path.join(name, '16.gz')) as f:
+        assert f.read() == 'line 02\nline 03\n'
+
+    assert _read(name)[1] == ''.join('line %02d\n' % i for i in range(10))
+    assert _read(name, 20) == (80, ' 02\nline 03\nline 04\nline 05\n'
+                                   'line 06\nline 07\nline 08\nline 09\n')
+    assert _read(name, tail=12) == (80, ' 08\nline 09\n')
+
+    # A new writer carries on where the last one left off:
+    writer.close()
+    writer = console_logs.Writer(name)
+    writer.write('line 10\n')
+    assert _read(name, 80) == (88, 'line 10\n')
+
+
+def test_max_node_size(tmpdir):
+    """The oldest segments are removed when a log gets too big."""
+    config_merge({'console': {'max_node_size': '100'}})
+    name = str(tmpdir.join('node.log'))
+    writer = console_logs.Writer(name)
+    for _ in range(10):
+        writer.write('0123456789' * 2)
+    segments = sorted(int(s.split('.')[0]) for s in os.listdir(name))
+    assert segments[-1] == 200
+    assert 0 not in segments
+    assert sum(os.path.getsize(os.path.join(name, s))
+               for s in os.listdir(name)) <= 100
+
+    # Offsets are unchanged, and reads start at the oldest output left:
+    end, data = _read(name)
+    assert end == 200
+    assert data == '0123456789' * ((200 - segments[0]) // 10)
+    assert _read(name, 10) == (end, data)
+
+
+def test_disk_budget(tmpdir):
+    """The oldest segments of all logs are removed to fit the budget."""
+    config_merge({'console': {'disk_budget': '150'}})
+    first = console_logs.Writer(str(tmpdir.join('first.log')))
+    second = console_logs.Writer(str(tmpdir.join('second.log')))
+    for _ in range(3):
+        first.write('a' * 20)
+    for _ in range(3):
+        second.write('b' * 20)
+
+    def _usage():
+        return dict((log, sorted(os.listdir(str(tmpdir.join(log))),
+                                 key=lambda s: int(s.split('.')[0])))
+                    for log in os.listdir(str(tmpdir)))
+
+    before = _usage()
+    for _ in range(3):
+        second.write('b' * 20)
+    after = _usage()
+    # Segments of the first log were older, so they went first:
+    assert len(after['first.log']) < len(before['first.log'])
+    assert after['first.log'][-1] == '60'
+    assert after['second.log'][-1] == '120'
+    total = 0
+    for log, segments in after.items():
+        for segment in segments:
+            total += os.path.getsize(str(tmpdir.join(log, segment)))
+    assert total <= 150
+
+
+def test_delete(log):
+    """Deleting a log removes all of its segments."""
+    console_logs.delete(log)
+    assert not os.path.exists(log)
+    assert console_logs.read(log) is None
+
+
+def test_legacy_log(tmpdir):
+    """A log from before segments is read, and carried on by a writer."""
+    name = str(tmpdir.join('node.log'))
+    with open(name, 'w') as f:
+        f.write('01234')
+    assert _read(name) == (5, '01234')
+    assert _read(name, offset=2) == (5, '234')
+
+    writer = console_logs.Writer(name)
+    writer.write('56789')
+    writer.close()
+    assert os.path.isdir(name)
+    assert _read(name) == (10, '0123456789')
+
+
+def test_create(log, tmpdir):
+    """Creating a log leaves an existing one alone."""
+    console_logs.create(log)
+    assert _read(log) == (10, '0123456789')
+    name = str(tmpdir.join('new.log'))
+    console_logs.create(name)
+    assert _read(name) == (0, '')
@@ -0,0 +1,128 @@
+"""Test the console supervisor."""
+import threading
+import time
+
+import pytest
+
+from hil import console_logs, console_supervisor
+from hil.errors import OBMError
+from hil.test_common import config_testsuite, config_merge, \
+    console_supervisor as supervisor
+
+supervisor = pytest.yield_fixture(supervisor)
+
+
+@pytest.fixture(autouse=True)
+def configure(tmpdir, monkeypatch):
+    """Configure HIL, with the logs and socket in `tmpdir`."""
+    config_testsuite()
+    config_merge({
+        'console': {
+            'log_dir': str(tmpdir),
+            'supervisor_socket': str(tmpdir.join('supervisor.sock')),
+        },
+    })
+    monkeypatch.setattr(console_supervisor, 'RESTART_DELAY', 0.1)
+
+
+def _wait_for(condition, timeout=10):
+    """Wait until `condition()` is true, failing if it takes too long."""
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'Timed out'
+        time.sleep(0.05)
+
+
+def _log_contents(log_name):
+    """Return the contents of the console log `log_name`."""
+    log = console_logs.read(log_name)
+    if log is None:
+        return ''
+    return ''.join(log[1])
+
+
+def test_start_stop(supervisor, tmpdir):
+    """Consoles are logged until they are stopped."""
+    # pylint: disable=redefined-outer-name,unused-argument
+    log_name = str(tmpdir.join('node.log'))
+    cleanups = tmpdir.join('cleanups')
+    command = ['sh', '-c', 'echo hello; exec sleep 60']
+    stop_command = ['sh', '-c', 'echo >> %s' % cleanups]
+    console_supervisor.start(log_name, command, stop_command)
+    # The log exists as soon as the console has been started:
+    assert console_logs.read(log_name) is not None
+    _wait_for(lambda: _log_contents(log_name) == 'hello\n')
+    assert console_supervisor.status() == {
+        log_name: {'running': True, 'restarts': 0},
+    }
+    assert len(cleanups.readlines()) == 1
+
+    # Starting it again changes nothing:
+    console_supervisor.start(log_name, command, stop_command)
+    assert _log_contents(log_name) == 'hello\n'
+
+    console_supervisor.stop(log_name)
+    assert console_supervisor.status() == {}
+    assert len(cleanups.readlines()) == 2
+    # Stopping a console which isn't being logged does nothing:
+    console_supervisor.stop(log_name)
+
+
+def test_restart(supervisor, tmpdir):
+    """Console processes are started again when they exit."""
+    # pylint: disable=redefined-outer-name,unused-argument
+    log_name = str(tmpdir.join('node.log'))
+    console_supervisor.start(log_name, ['echo', 'booting'])
+    _wait_for(lambda: console_supervisor.status()[log_name]['restarts'] >= 2)
+    assert _log_contents(log_name).startswith('booting\nbooting\n')
+
+    # A command which can't be run at all is retried too:
+    console_supervisor.start(log_name, ['/nonexistent/ipmitool'])
+    _wait_for(lambda: console_supervisor.status()[log_name]['restarts'] >= 1)
+    assert not console_supervisor.status()[log_name]['running']
+
+
+def test_stop_command_timeout(supervisor, tmpdir, monkeypatch):
+    """A stop command which hangs is killed."""
+    # pylint: disable=redefined-outer-name,unused-argument
+    monkeypatch.setattr(console_supervisor, 'STOP_COMMAND_TIMEOUT', 0.2)
+    log_name = str(tmpdir.join('node.log'))
+    console_supervisor.start(log_name, ['sleep', '60'], ['sleep', '60'])
+    _wait_for(lambda: console_supervisor.status()[log_name]['running'])
+    start = time.time()
+    console_supervisor.stop(log_name)
+    assert time.time() - start < 10
+
+
+def test_replace_session(supervisor, tmpdir):
+    """Other requests aren't held up while a session is being replaced."""
+    # pylint: disable=redefined-outer-name,unused-argument
+    log_name = str(tmpdir.join('node.log'))
+    other_log = str(tmpdir.join('other.log'))
+    stopped = tmpdir.join('stopped')
+    console_supervisor.start(log_name, ['sleep', '60'],
+                             ['sh', '-c', 'sleep 3; echo >> %s' % stopped])
+    _wait_for(lambda: console_supervisor.status()[log_name]['running'])
+
+    replace = threading.Thread(target=console_supervisor.start, args=(
+        log_name, ['sh', '-c', 'echo new; exec sleep 60']))
+    replace.start()
+    start = time.time()
+    # The new session waits for the old one to stop before it runs:
+    _wait_for(lambda: not console_supervisor.status()[log_name]['running'])
+    console_supervisor.start(other_log, ['echo', 'other'])
+    assert time.time() - start < 2
+    replace.join()
+    # The new session only writes once the old one has cleaned up:
+    _wait_for(lambda: _log_contents(log_name) == 'new\n')
+    assert stopped.check()
+
+
+def test_not_running():
+    """Requests fail if the supervisor isn't running."""
+    with pytest.raises(OBMError):
+        console_supervisor.status()
+    with pytest.raises(OBMError):
+        console_supervisor.start('node.log', ['echo', 'hello'])
+    # ...but no consoles are being logged, so stopping one succeeds:
+    console_supervisor.stop('node.log')
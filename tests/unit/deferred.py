@@ -3,6 +3,7 @@
 import pytest
 import tempfile
 import uuid
+from datetime import datetime, timedelta
 
 from hil import config, deferred, model, api
 from hil.model import db, Switch
@@ -309,3 +310,54 @@ def test_apply_networking(switch, network, fresh_database):
 
     local_db.session.commit()
     local_db.session.close()
+
+
+def _finished_actions(switch, network, ages):
+    """Create a finished networking action for each age (in seconds) in
+    `ages`, each on a new nic. Returns their uuids, in the same order.
+    """
+    uuids = []
+    for i, age in enumerate(ages):
+        nic = new_nic(str(i))
+        nic.port = model.Port(label='gi1/0/%d' % i, switch=switch)
+        action = model.NetworkingAction(
+            nic=nic,
+            new_network=network,
+            channel='vlan/native',
+            type='modify_port',
+            uuid=str(uuid.uuid4()),
+            status='DONE',
+            finished=datetime.utcnow() - timedelta(seconds=age))
+        db.session.add(action)
+        uuids.append(action.uuid)
+    db.session.commit()
+    return uuids
+
+
+@pytest.mark.parametrize('archive', [True, False])
+def test_compact_journal(switch, network, fresh_database, archive):
+    """Old finished actions are removed from the journal, in batches."""
+    config_merge({
+        'network-daemon': {
+            'action_retention': '3600',
+            'archive_actions': str(archive),
+            'compaction_batch_size': '2',
+        },
+    })
+    uuids = _finished_actions(switch, network, [7200, 7200, 7200, 60])
+
+    assert deferred.compact_journal(max_batches=1) == 2
+    assert deferred.compact_journal() == 1
+    assert deferred.compact_journal() == 0
+
+    remaining = [a.uuid for a in model.NetworkingAction.query]
+    assert remaining == uuids[3:]
+    archived = model.ArchivedNetworkingAction.query \
+        .order_by(model.ArchivedNetworkingAction.id).all()
+    if archive:
+        assert [a.uuid for a in archived] == uuids[:3]
+        assert archived[0].status == 'DONE'
+        assert archived[0].nic == '0'
+        assert archived[0].new_network == 'hammernet'
+    else:
+        assert archived == []
@@ -0,0 +1,253 @@
+"""Tests for hil.events and the stream_events api call."""
+import json
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import pytest
+
+from hil import api, config, deferred, events, model
+from hil.auth import get_auth_backend
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init
+
+MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.null': None,
+            'hil.ext.auth.mock': '',
+            'hil.ext.switches.mock': '',
+            'hil.ext.obm.mock': '',
+            'hil.ext.network_allocators.null': None,
+            'hil.ext.network_allocators.vlan_pool': '',
+        },
+        'hil.ext.network_allocators.vlan_pool': {
+            'vlans': '40-80',
+        },
+    })
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def set_admin_auth():
+    """Set admin auth for all calls"""
+    get_auth_backend().set_admin(True)
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context',
+                                     'set_admin_auth')
+
+
+def _parse(message):
+    """Parse a server-sent event into (id, data)."""
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    data = json.loads(fields['data'])
+    assert fields['event'] == data['type']
+    del data['time']
+    return int(fields['id']), data
+
+
+def _read(count, last_event_id=0):
+    """Read ``count`` events from the stream, as (id, data) pairs."""
+    return [_parse(message)
+            for message in islice(events.stream(last_event_id), count)]
+
+
+def _register_node(name):
+    """Register a node with a nic named eth0."""
+    api.node_register(
+        node=name,
+        obm={
+            'type': OBM_TYPE_MOCK,
+            'host': 'ipmihost',
+            'user': 'root',
+            'password': 'tapeworm',
+        },
+        obmd={
+            'uri': 'http://obmd.example.com/nodes/' + name,
+            'admin_token': 'secret',
+        },
+    )
+    api.node_register_nic(name, 'eth0', 'de:ad:be:ef:20:14')
+
+
+def test_lifecycle_events():
+    """Creating, connecting and deleting things should produce events."""
+    api.project_create('runway')
+    _register_node('node-1')
+    api.project_connect_node('runway', 'node-1')
+    api.project_detach_node('runway', 'node-1')
+    api.node_delete_nic('node-1', 'eth0')
+    api.node_delete('node-1')
+
+    assert [data for _, data in _read(7)] == [
+        {'type': 'project_create', 'project': 'runway'},
+        {'type': 'node_create', 'node': 'node-1', 'project': None},
+        {'type': 'nic_create', 'node': 'node-1', 'nic': 'eth0'},
+        {'type': 'node_connect_project', 'node': 'node-1',
+         'project': 'runway'},
+        {'type': 'node_detach_project', 'node': 'node-1',
+         'project': 'runway'},
+        {'type': 'nic_delete', 'node': 'node-1', 'nic': 'eth0'},
+        {'type': 'node_delete', 'node': 'node-1', 'project': None},
+    ]
+
+
+def _last_event_id():
+    """Return the id of the most recent event."""
+    return db.session.query(db.func.max(model.Event.id)).scalar()
+
+
+def test_networking_events():
+    """Networking actions and the attachments they make produce events."""
+    api.project_create('runway')
+    api.switch_register('sw0',
+                        type=MOCK_SWITCH_TYPE,
+                        username='switch_user',
+                        password='switch_pass',
+                        hostname='switchname')
+    api.switch_register_port('sw0', 'gi1/0/1')
+    _register_node('node-1')
+    api.port_connect_nic('sw0', 'gi1/0/1', 'node-1', 'eth0')
+    api.project_connect_node('runway', 'node-1')
+    api.network_create('runway_pxe', 'runway', 'runway', '')
+    start = _last_event_id()
+
+    status_id = json.loads(api.node_connect_network(
+        'node-1', 'eth0', 'runway_pxe')[0])['status_id']
+    deferred.apply_networking()
+
+    action = {
+        'type': 'networking_action',
+        'status_id': status_id,
+        'node': 'node-1',
+        'nic': 'eth0',
+        'action_type': 'modify_port',
+        'channel': 'vlan/native',
+        'new_network': 'runway_pxe',
+    }
+    assert [data for _, data in _read(3, start)] == [
+        dict(action, status='PENDING'),
+        {'type': 'network_attach', 'node': 'node-1', 'nic': 'eth0',
+         'network': 'runway_pxe', 'channel': 'vlan/native'},
+        dict(action, status='DONE'),
+    ]
+
+
+def test_resume():
+    """Only events after `last_event_id` should be sent."""
+    api.project_create('runway')
+    api.project_create('taxiway')
+    [(first, _), (second, data)] = _read(2)
+    assert data['project'] == 'taxiway'
+    assert _read(1, first) == [(second, data)]
+
+
+def test_project_filter():
+    """Non-admins only see the events of projects they have access to."""
+    api.project_create('runway')
+    api.project_create('taxiway')
+    _register_node('node-1')
+    _register_node('node-2')
+    api.project_connect_node('runway', 'node-1')
+    api.project_connect_node('taxiway', 'node-2')
+
+    auth_backend = get_auth_backend()
+    auth_backend.set_admin(False)
+    auth_backend.set_project(api.get_or_404(model.Project, 'runway'))
+    assert [data for _, data in _read(2)] == [
+        {'type': 'project_create', 'project': 'runway'},
+        {'type': 'node_connect_project', 'node': 'node-1',
+         'project': 'runway'},
+    ]
+
+
+def test_keepalive():
+    """With no new events, the stream should send keepalive comments."""
+    api.project_create('runway')
+    stream = events.stream(keepalive=0.01)
+    assert next(stream) == ': keepalive\n\n'
+    api.project_create('taxiway')
+    db.session.commit()
+    assert _parse(next(stream))[1]['project'] == 'taxiway'
+
+
+def _add_event(event_id, project):
+    """Record a project_create event with the id ``event_id``.
+
+    Leaving out an id makes it look like the event with that id has been
+    written, but its transaction has not committed yet.
+    """
+    db.session.add(model.Event(id=event_id,
+                               time=datetime.utcnow(),
+                               type='project_create',
+                               payload=json.dumps({'project': project})))
+    db.session.commit()
+
+
+def test_gap_held_back():
+    """Events after a gap are held back until the gap is filled."""
+    api.project_create('runway')
+    last = _last_event_id()
+    stream = events.stream(last, keepalive=0.01, gap_timeout=30)
+    _add_event(last + 2, 'apron')
+    assert next(stream) == ': keepalive\n\n'
+    _add_event(last + 1, 'taxiway')
+    assert [_parse(next(stream)) for _ in range(2)] == [
+        (last + 1, {'type': 'project_create', 'project': 'taxiway'}),
+        (last + 2, {'type': 'project_create', 'project': 'apron'}),
+    ]
+
+
+def test_gap_timeout():
+    """Gaps which are never filled are given up on after gap_timeout."""
+    api.project_create('runway')
+    last = _last_event_id()
+    stream = events.stream(last, gap_timeout=0.1)
+    # The event is released once it is gap_timeout old, so time it from
+    # before it is written:
+    start = time.time()
+    _add_event(last + 2, 'apron')
+    assert _parse(next(stream))[0] == last + 2
+    assert time.time() - start >= 0.1
+
+
+def test_stream_events_api():
+    """The api call should honor last_event_id, and send an event stream."""
+    api.project_create('runway')
+    api.project_create('taxiway')
+    response = api.stream_events(last_event_id=_last_event_id() - 1)
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    [message] = islice(response.response, 1)
+    assert _parse(message)[1]['project'] == 'taxiway'
+
+
+def test_prune():
+    """Events older than the retention period should be deleted."""
+    api.project_create('runway')
+    api.project_create('taxiway')
+    old, new = model.Event.query.order_by(model.Event.id).all()
+    old.time -= timedelta(seconds=events.retention() + 1)
+    new_id = new.id
+    db.session.commit()
+    events.prune()
+    assert [e.id for e in model.Event.query.all()] == [new_id]
@@ -95,6 +95,8 @@ class FakeAuthRequest(object):
     database auth plugin to work.
     """
 
+    headers = {}
+
     def __init__(self, username, password):
         self.username = username
         self.password = password
@@ -116,6 +118,15 @@ class FakeNoAuthRequest(object):
     unauthenticated.
     """
     authorization = None
+    headers = {}
+
+
+class FakeTokenRequest(object):
+    """Fake request object, authenticated with an api token."""
+    authorization = None
+
+    def __init__(self, token):
+        self.headers = {'Authorization': 'Bearer ' + token}
 
 
 @pytest.fixture
@@ -401,3 +412,246 @@ def test_admin_noauth_fail(fn, args):
     fn = getattr(dbauth, fn)
     with pytest.raises(errors.AuthorizationError):
         fn(*args)
+
+
+def _authenticate(username, password):
+    """Authenticate as `username`, returning whether it succeeded."""
+    from hil.auth import get_auth_backend
+    flask.request = FakeAuthRequest(username, password)
+    return get_auth_backend().authenticate()
+
+
+@use_fixtures('admin_auth')
+class TestCredentialCache(DBAuthTestCase):
+    """Tests for the cache of verified credentials."""
+
+    def setUp(self):
+        from hil.ext.auth import database as dbauth
+        self.dbauth = dbauth
+        self.cache = dbauth.credential_cache
+        self.cache.clear()
+
+    def test_hit(self):
+        """Verified credentials should be served from the cache."""
+        assert _authenticate('bob', 'password')
+        assert (self.cache.hits, self.cache.misses) == (0, 1)
+        assert _authenticate('bob', 'password')
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_bad_password_not_cached(self):
+        """Failed authentication should not populate the cache."""
+        assert not _authenticate('bob', 'guess')
+        assert not _authenticate('bob', 'guess')
+        assert (self.cache.hits, self.cache.misses) == (0, 2)
+
+    def test_password_change(self):
+        """Changing a user's password should invalidate cached entries."""
+        assert _authenticate('bob', 'password')
+        user = api.get_or_404(self.dbauth.User, 'bob')
+        user.set_password('hunter2')
+        db.session.commit()
+        assert not _authenticate('bob', 'password')
+        assert _authenticate('bob', 'hunter2')
+        assert self.cache.hits == 0
+
+    def test_stale_hash(self):
+        """Entries recorded against an old password hash aren't honored."""
+        assert _authenticate('bob', 'password')
+        user = api.get_or_404(self.dbauth.User, 'bob')
+        # Simulate a change made by another process, which can't have
+        # invalidated our cache:
+        user.hashed_password = self.dbauth.User('bob', 'hunter2') \
+            .hashed_password
+        assert not _authenticate('bob', 'password')
+        assert self.cache.hits == 0
+
+    def test_set_admin_and_delete(self):
+        """user_set_admin and user_delete should invalidate entries."""
+        self.dbauth.user_create('charlie', 'foo')
+        assert _authenticate('charlie', 'foo')
+        assert _authenticate('alice', 'secret')
+        self.dbauth.user_set_admin('charlie', True)
+        assert _authenticate('charlie', 'foo')
+        assert _authenticate('alice', 'secret')
+        self.dbauth.user_delete('charlie')
+        assert self.cache.hits == 1
+        with pytest.raises(errors.NotFoundError):
+            _authenticate('charlie', 'foo')
+
+    def test_bounds(self):
+        """The cache should respect its size and ttl."""
+        self.cache.size = 1
+        try:
+            assert _authenticate('alice', 'secret')
+            assert _authenticate('bob', 'password')
+            assert _authenticate('alice', 'secret')
+            assert self.cache.hits == 0
+            self.cache.ttl = 0
+            self.cache.clear()
+            assert _authenticate('alice', 'secret')
+            assert _authenticate('alice', 'secret')
+            assert self.cache.hits == 0
+        finally:
+            self.cache.size = 1024
+            self.cache.ttl = 60
+
+
+@use_fixtures('admin_auth')
+class TestAuthorizationMemo(DBAuthTestCase):
+    """Authorization decisions should be computed once per request."""
+
+    def test_project_ids_memoized(self):
+        """Project access is answered from a set computed once."""
+        from hil.auth import get_auth_backend
+        auth_backend = get_auth_backend()
+        runway = api.get_or_404(model.Project, 'runway')
+        api.project_create('taxiway')
+        taxiway = api.get_or_404(model.Project, 'taxiway')
+
+        self.dbauth.user_add_project('bob', 'taxiway')
+
+        calls = []
+        compute = auth_backend._accessible_project_ids
+
+        def _accessible_project_ids():
+            calls.append(None)
+            return compute()
+
+        auth_backend._accessible_project_ids = _accessible_project_ids
+        try:
+            assert _authenticate('bob', 'password')
+            for _ in range(3):
+                assert auth_backend.have_project_access(taxiway)
+                assert not auth_backend.have_project_access(runway)
+            assert not auth_backend.have_admin()
+            assert len(calls) == 1
+
+            # Switching users should not reuse the old decisions:
+            assert _authenticate('alice', 'secret')
+            assert auth_backend.have_project_access(taxiway)
+        finally:
+            del auth_backend._accessible_project_ids
+
+
+def _token_authenticate(token):
+    """Authenticate with the api token `token`, returning whether it worked."""
+    from hil.auth import get_auth_backend
+    flask.request = FakeTokenRequest(token)
+    return get_auth_backend().authenticate()
+
+
+@use_fixtures('admin_auth')
+class TestApiTokens(DBAuthTestCase):
+    """Tests for api tokens."""
+
+    def setUp(self):
+        from hil.ext.auth import database as dbauth
+        from hil.auth import get_auth_backend
+        self.dbauth = dbauth
+        self.auth_backend = get_auth_backend()
+        api.project_create('taxiway')
+        self.runway = api.get_or_404(model.Project, 'runway')
+        self.taxiway = api.get_or_404(model.Project, 'taxiway')
+        self.dbauth.user_add_project('alice', 'taxiway')
+
+    def _create(self, **kwargs):
+        """Create a token, returning the parsed response."""
+        return json.loads(self.dbauth.token_create(**kwargs))
+
+    def test_default_scope(self):
+        """By default, tokens grant project access, but not admin."""
+        token = self._create()['token']
+        assert _token_authenticate(token)
+        assert local.auth.label == 'alice'
+        assert not self.auth_backend.have_admin()
+        assert self.auth_backend.have_project_access(self.runway)
+        assert self.auth_backend.have_project_access(self.taxiway)
+
+    def test_admin_scope(self):
+        """Admin tokens grant admin access."""
+        token = self._create(admin=True)['token']
+        assert _token_authenticate(token)
+        assert self.auth_backend.have_admin()
+
+    def test_project_scope(self):
+        """Project tokens only grant access to their project."""
+        token = self._create(project='runway')['token']
+        assert _token_authenticate(token)
+        assert self.auth_backend.have_project_access(self.runway)
+        assert not self.auth_backend.have_project_access(self.taxiway)
+
+        # Tokens made with it can't escape the scope:
+        child = self._create()
+        assert _token_authenticate(child['token'])
+        assert not self.auth_backend.have_project_access(self.taxiway)
+        with pytest.raises(errors.AuthorizationError):
+            self._create(admin=True)
+
+    def test_bad_tokens(self):
+        """Expired, revoked and unknown tokens are rejected."""
+        assert not _token_authenticate('bogus')
+        assert local.auth is None
+        _authenticate('alice', 'secret')
+
+        expired = self._create()
+        token = self.dbauth.ApiToken.query.get(expired['id'])
+        token.expires = token.expires.replace(year=2000)
+        db.session.commit()
+        assert not _token_authenticate(expired['token'])
+
+        _authenticate('alice', 'secret')
+        revoked = self._create()
+        self.dbauth.token_revoke(revoked['id'])
+        assert not _token_authenticate(revoked['token'])
+        with pytest.raises(errors.NotFoundError):
+            self.dbauth.token_revoke(revoked['id'])
+
+    def test_revoke_others(self):
+        """Non-admins can't revoke other users' tokens."""
+        token = self._create()
+        _authenticate('bob', 'password')
+        with pytest.raises(errors.AuthorizationError):
+            self.dbauth.token_revoke(token['id'])
+
+    def test_bad_arguments(self):
+        """Invalid scopes and lifetimes are rejected."""
+        with pytest.raises(errors.BadArgumentError):
+            self._create(ttl=10 ** 6)
+        with pytest.raises(errors.BadArgumentError):
+            self._create(admin=True, project='runway')
+        _authenticate('bob', 'password')
+        with pytest.raises(errors.AuthorizationError):
+            self._create(project='runway')
+
+    def test_user_delete(self):
+        """Deleting a user deletes their tokens."""
+        self.dbauth.user_create('charlie', 'foo', True)
+        _authenticate('charlie', 'foo')
+        token = self._create()['token']
+        _authenticate('alice', 'secret')
+        self.dbauth.user_delete('charlie')
+        assert self.dbauth.ApiToken.query.count() == 0
+        assert not _token_authenticate(token)
+
+
+@pytest.mark.usefixtures('configure', 'initial_db')
+def test_conditional_get_rechecks_access(dbauth):
+    """Losing access to a project invalidates cached responses about it."""
+    from hil import rest
+    with app.app_context():
+        db.session.add(model.Project('taxiway'))
+        db.session.commit()
+    headers = {'Authorization': 'Basic YWxpY2U6c2VjcmV0'}  # alice:secret
+    client = rest.app.test_client()
+    resp = client.get('/v0/project/taxiway/nodes', headers=headers)
+    assert resp.status_code == 200
+    headers['If-None-Match'] = resp.headers['ETag']
+    assert client.get('/v0/project/taxiway/nodes',
+                      headers=headers).status_code == 304
+
+    # alice only had access as an admin:
+    with app.app_context():
+        dbauth.User.query.filter_by(label='alice').one().is_admin = False
+        db.session.commit()
+    assert client.get('/v0/project/taxiway/nodes',
+                      headers=headers).status_code == 401
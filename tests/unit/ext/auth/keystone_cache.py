@@ -0,0 +1,176 @@
+"""Test the caches used by the keystone auth backend.
+
+These use a stand-in for keystonemiddleware, so they don't require keystone.
+"""
+import json
+import time
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from hil import api, config, model
+from hil.auth import get_auth_backend
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+# Tokens known to the stand-in keystone, and the identities they confirm:
+TOKENS = {
+    'admin-token': {'HTTP_X_PROJECT_ID': 'admin', 'HTTP_X_ROLES': 'admin'},
+    'user-token': {'HTTP_X_PROJECT_ID': 'runway', 'HTTP_X_ROLES': 'member'},
+}
+
+
+class FakeKeystone(object):
+    """A stand-in for keystonemiddleware's auth_token filter.
+
+    Like the real thing, it strips identity headers sent by the client and
+    replaces them with the ones for the token. It counts validations.
+    """
+
+    def __init__(self):
+        self.validations = 0
+
+    def __call__(self, app):
+        def _middleware(environ, start_response):
+            self.validations += 1
+            environ.pop('HTTP_X_PROJECT_ID', None)
+            environ.pop('HTTP_X_ROLES', None)
+            token = environ.get('HTTP_X_AUTH_TOKEN')
+            if token in TOKENS:
+                environ['HTTP_X_IDENTITY_STATUS'] = 'Confirmed'
+                environ.update(TOKENS[token])
+            else:
+                environ['HTTP_X_IDENTITY_STATUS'] = 'Invalid'
+            return app(environ, start_response)
+        return _middleware
+
+
+def _identity_app(environ, start_response):
+    """A wsgi app which responds with the request's identity variables."""
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [json.dumps(dict((k, v) for k, v in environ.items()
+                            if k.startswith('HTTP_X_') and
+                            k != 'HTTP_X_AUTH_TOKEN'))]
+
+
+@pytest.fixture
+def keystone():
+    """Return a fresh stand-in keystone."""
+    return FakeKeystone()
+
+
+@pytest.fixture
+def keystone_cache():
+    """Fixture returning hil.ext.auth.keystone_cache.
+
+    It is not imported at top level, so that it isn't loaded when other
+    tests don't expect it to be.
+    """
+    from hil.ext.auth import keystone_cache
+    return keystone_cache
+
+
+def _get(app, token, **headers):
+    """Make a request to `app` with `token`, returning the identity."""
+    headers['X-Auth-Token'] = token
+    resp = Client(app, BaseResponse).get('/', headers=headers)
+    return json.loads(resp.data)
+
+
+def test_token_cache(keystone, keystone_cache):
+    """Confirmed tokens should only be validated once."""
+    app = keystone_cache.TokenCache(_identity_app, keystone)
+    expected = dict(TOKENS['user-token'],
+                    HTTP_X_IDENTITY_STATUS='Confirmed')
+    assert _get(app, 'user-token') == expected
+    assert _get(app, 'user-token') == expected
+    assert keystone.validations == 1
+    assert (app.cache.hits, app.cache.misses) == (1, 1)
+
+    # Client-supplied identity headers must not survive a cache hit:
+    assert _get(app, 'user-token', **{'X-Roles': 'admin',
+                                      'X-User-Id': 'mallory'}) == expected
+
+    assert _get(app, 'admin-token')['HTTP_X_ROLES'] == 'admin'
+    assert keystone.validations == 2
+
+
+def test_token_cache_invalid(keystone, keystone_cache):
+    """Invalid tokens should be validated every time."""
+    app = keystone_cache.TokenCache(_identity_app, keystone)
+    for _ in range(2):
+        assert _get(app, 'bogus')['HTTP_X_IDENTITY_STATUS'] == 'Invalid'
+    assert keystone.validations == 2
+
+
+def test_token_cache_bounds(keystone, keystone_cache):
+    """The token cache should respect its size and ttl."""
+    app = keystone_cache.TokenCache(_identity_app, keystone, size=1)
+    _get(app, 'user-token')
+    _get(app, 'admin-token')
+    _get(app, 'user-token')
+    assert keystone.validations == 3
+
+    app = keystone_cache.TokenCache(_identity_app, keystone, ttl=0)
+    _get(app, 'user-token')
+    _get(app, 'user-token')
+    assert keystone.validations == 5
+
+
+def test_token_expiry(keystone, keystone_cache):
+    """Tokens should not be cached past their expiry."""
+    def _expired_token_info(app):
+        def _middleware(environ, start_response):
+            environ['keystone.token_info'] = {
+                'token': {'expires_at': time.strftime(
+                    '%Y-%m-%dT%H:%M:%S.000000Z',
+                    time.gmtime(time.time() - 1))},
+            }
+            return app(environ, start_response)
+        return keystone(_middleware)
+
+    app = keystone_cache.TokenCache(_identity_app, _expired_token_info)
+    _get(app, 'user-token')
+    _get(app, 'user-token')
+    assert keystone.validations == 2
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.null': None,
+            'hil.ext.auth.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.mark.usefixtures('configure', 'fresh_database', 'server_init',
+                         'with_request_context')
+def test_project_cache(keystone_cache):
+    """Existing projects are cached until deleted; absent ones aren't."""
+    get_auth_backend().set_admin(True)
+    cache = keystone_cache.ProjectCache()
+    assert cache.get_id('runway') is None
+    api.project_create('runway')
+    project_id = cache.get_id('runway')
+    assert project_id == api.get_or_404(model.Project, 'runway').id
+    assert cache.get_id('runway') == project_id
+    assert cache.cache.hits == 1
+
+    # The module's cache is the one invalidated on deletion:
+    project_cache = keystone_cache.project_cache
+    assert project_cache.get_id('runway') == project_id
+    api.project_delete('runway')
+    assert project_cache.get_id('runway') is None
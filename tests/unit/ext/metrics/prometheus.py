@@ -0,0 +1,106 @@
+"""Test the Prometheus metrics extension."""
+import flask
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+from schema import Schema
+
+from hil import config, model, rest
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL, with the Prometheus extension."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.metrics.prometheus': '',
+        },
+    })
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure',
+                                     'fresh_database',
+                                     'server_init')
+
+
+@pytest.fixture
+def client():
+    """Return a flask test client."""
+    return rest.app.test_client()
+
+
+def _scrape(client):
+    """Fetch the metrics, and return the samples.
+
+    The samples are returned as a dict mapping ``(name, labels)`` to their
+    values, where ``labels`` is a sorted tuple of (label, value) pairs.
+    """
+    # pylint: disable=redefined-outer-name
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    samples = {}
+    for family in text_string_to_metric_families(resp.get_data()):
+        for name, labels, value in family.samples:
+            samples[name, tuple(sorted(labels.items()))] = value
+    return samples
+
+
+def test_request_metrics(client):
+    """Api calls are counted, and their costs recorded in histograms."""
+    # pylint: disable=redefined-outer-name
+    assert client.put('/v0/project/runway').status_code == 200
+    for _ in range(2):
+        assert client.get('/v0/projects').status_code == 200
+    assert client.get('/v0/node/no-such-node').status_code == 404
+
+    samples = _scrape(client)
+    endpoint = (('endpoint', 'list_projects'),)
+    assert samples['hil_api_requests_total',
+                   endpoint + (('status', '200'),)] == 2
+    assert samples['hil_api_requests_total',
+                   (('endpoint', 'show_node'), ('status', '404'))] == 1
+    assert samples['hil_api_request_seconds_count', endpoint] == 2
+    assert samples['hil_api_request_sql_statements_count', endpoint] == 2
+    assert samples['hil_api_request_sql_statements_sum', endpoint] >= 2
+    assert samples['hil_api_request_sql_seconds_count', endpoint] == 2
+    for phase in 'validate', 'auth', 'handler', 'serialize':
+        assert samples['hil_api_request_phase_seconds_count',
+                       endpoint + (('phase', phase),)] == 2
+
+
+def test_streamed_metrics(client):
+    """Streamed responses are recorded once they have been sent."""
+    # pylint: disable=redefined-outer-name
+
+    @rest.rest_call('GET', '/stream', Schema({}))
+    # pylint: disable=unused-variable
+    def stream():
+        """Stream a couple of chunks."""
+        return flask.Response(iter(['one', 'two']))
+
+    resp = client.get('/v0/stream', buffered=False)
+    endpoint = (('endpoint', 'stream'),)
+    assert ('hil_api_request_seconds_count', endpoint) not in _scrape(client)
+    assert resp.get_data() == 'onetwo'
+    resp.close()
+    samples = _scrape(client)
+    assert samples['hil_api_request_seconds_count', endpoint] == 1
+    assert samples['hil_api_request_phase_seconds_count',
+                   endpoint + (('phase', 'stream'),)] == 1
+
+
+def test_pool_metrics(client):
+    """The state of the connection pool is reported."""
+    # pylint: disable=redefined-outer-name
+    samples = _scrape(client)
+    if model.pool_status() is None:
+        pytest.skip('The database has no connection pool')
+    assert ('hil_db_pool_connections', (('state', 'checked_out'),)) \
+        in samples
@@ -3,11 +3,16 @@ from hil.config import load_extensions
 from hil.flaskapp import app
 from hil.model import db
 from hil.migrations import create_db
-from hil import api, errors
+from hil.network_allocator import get_network_allocator
+from hil import api, config, errors
 from hil.test_common import fail_on_log_warnings, with_request_context, \
-    fresh_database, config_testsuite, config_merge, server_init
+    fresh_database, config_testsuite, config_merge, server_init, newDB, \
+    releaseDB
 from hil import model
 import pytest
+import json
+import threading
+from sqlalchemy import event
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
 with_request_context = pytest.yield_fixture(with_request_context)
@@ -134,3 +139,216 @@ class TestAdminCreatedNetworks():
         net_id = int(network.network_id)
         assert network.allocated is False
         assert net_id == 1511
+
+
+@pytest.fixture
+def shared_database(configure, fresh_database, tmpdir):
+    """Use a database which several connections can share.
+
+    If the configured database is in-memory sqlite, which can't be shared,
+    a temporary file is used instead. The pool of vlans is 100-139.
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+    database = {}
+    if config.cfg.get('database', 'uri') == 'sqlite:///:memory:':
+        database['uri'] = 'sqlite:///' + str(tmpdir.join('hil.db'))
+    config_merge({
+        'database': database,
+        'hil.ext.network_allocators.vlan_pool': {'vlans': '100-139'},
+    })
+    newDB()
+    yield
+    releaseDB()
+
+
+@pytest.mark.usefixtures('shared_database')
+def test_concurrent_allocation():
+    """Concurrent allocations never get the same vlan."""
+    allocator = get_network_allocator()
+    creators = 50
+    start = threading.Event()
+    allocated = []
+    errors_seen = []
+
+    def _create():
+        try:
+            with app.app_context():
+                start.wait()
+                allocated.append(allocator.get_new_network_id())
+                db.session.commit()
+        except Exception as e:  # pylint: disable=broad-except
+            errors_seen.append(e)
+
+    threads = [threading.Thread(target=_create) for _ in range(creators)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors_seen == []
+    vlans = [net_id for net_id in allocated if net_id is not None]
+    # All 40 vlans are handed out, each exactly once; the other 10 creators
+    # get nothing:
+    assert sorted(vlans) == [str(vlan) for vlan in range(100, 140)]
+    assert allocated.count(None) == creators - 40
+
+    from hil.ext.network_allocators.vlan_pool import Vlan
+    with app.app_context():
+        assert Vlan.query.filter_by(available=True).count() == 0
+
+
+def test_populate_adds_missing_vlans():
+    """populate() adds newly configured vlans, leaving the others alone."""
+    from hil.ext.network_allocators.vlan_pool import Vlan
+    with app.app_context():
+        Vlan.query.filter_by(vlan_no=100).one().available = False
+        db.session.commit()
+        config_merge({
+            'hil.ext.network_allocators.vlan_pool': {
+                'vlans': '100-104, 300, 702-703, 104',
+            },
+        })
+        get_network_allocator().populate()
+        vlans = dict((v.vlan_no, v.available) for v in Vlan.query)
+    assert sorted(vlans) == [100, 101, 102, 103, 104, 300, 702, 703]
+    assert vlans[100] is False
+    assert vlans[703] is True
+
+
+def _count_queries(func):
+    """Call `func`, and return the number of SQL statements it executed."""
+    statements = []
+
+    def _record(*args):
+        statements.append(args)
+
+    event.listen(db.engine, 'before_cursor_execute', _record)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _record)
+    return len(statements)
+
+
+def test_pool_checks_are_cached():
+    """Pool membership is answered from memory once the cache is loaded."""
+    allocator = get_network_allocator()
+    assert allocator.is_network_id_in_pool('300')
+    assert _count_queries(
+        lambda: allocator.is_network_id_in_pool('100')) == 0
+    assert not allocator.is_network_id_in_pool('1511')
+    assert _count_queries(lambda: allocator.claim_network_id('1511')) == 0
+    # Claiming a vlan in the pool still goes to the database:
+    assert _count_queries(lambda: allocator.claim_network_id('103')) == 1
+    assert allocator.get_new_network_id() == '100'
+    db.session.commit()
+
+
+def test_cache_coherence():
+    """The cache doesn't hand out stale vlans, or hold on to freed ones."""
+    from hil.ext.network_allocators.vlan_pool import Vlan
+    allocator = get_network_allocator()
+    assert allocator.get_new_network_id() == '100'
+    db.session.commit()
+
+    # Take 101 behind the cache's back, as another process would; the
+    # database has the final say:
+    Vlan.query.filter_by(vlan_no=101).one().available = False
+    db.session.commit()
+    assert allocator.get_new_network_id() == '102'
+    db.session.commit()
+
+    # Freed vlans are announced, so they are reused right away, without
+    # reloading the cache; only the claim itself goes to the database:
+    allocator.free_network_id('100')
+    db.session.commit()
+    assert _count_queries(allocator.get_new_network_id) == 1
+    db.session.commit()
+    assert Vlan.query.filter_by(vlan_no=100).one().available is False
+
+    # Allocations which are rolled back don't leak vlans:
+    assert allocator.get_new_network_id() == '103'
+    db.session.rollback()
+    assert allocator.get_new_network_id() == '103'
+    db.session.commit()
+
+
+@pytest.fixture
+def pools(configure, fresh_database, with_request_context):
+    """Add a second pool, 'pod1', with a quota of one vlan per project."""
+    # pylint: disable=redefined-outer-name,unused-argument
+    config_merge({
+        'hil.ext.network_allocators.vlan_pool': {
+            'pool.pod1': '200-201',
+            'project_quota.pod1': '1',
+        },
+    })
+    get_network_allocator().populate()
+
+
+@pytest.mark.usefixtures('pools')
+def test_named_pools():
+    """Networks are allocated from the requested pool, within quota."""
+    api.project_create('nuggets')
+    api.network_create('hammernet', 'nuggets', 'nuggets', '', pool='pod1')
+    assert api.get_or_404(model.Network, 'hammernet').network_id == '200'
+
+    # nuggets has used its quota for pod1, but not for the default pool:
+    with pytest.raises(errors.QuotaExceededError):
+        api.network_create('nailnet', 'nuggets', 'nuggets', '', pool='pod1')
+    api.network_create('nailnet', 'nuggets', 'nuggets', '')
+    assert api.get_or_404(model.Network, 'nailnet').network_id == '100'
+
+    # Administrators don't have quotas:
+    api.network_create('redbone', 'admin', '', '', pool='pod1')
+    assert api.get_or_404(model.Network, 'redbone').network_id == '201'
+    with pytest.raises(errors.AllocationError):
+        api.network_create('starfish', 'admin', '', '', pool='pod1')
+
+    # Freeing a vlan gives the project its quota back:
+    api.network_delete('hammernet')
+    api.network_create('hammernet', 'nuggets', 'nuggets', '', pool='pod1')
+    assert api.get_or_404(model.Network, 'hammernet').network_id == '200'
+
+    with pytest.raises(errors.BadArgumentError):
+        api.network_create('starfish', 'admin', '', '', pool='pod2')
+    with pytest.raises(errors.BadArgumentError):
+        api.network_create('starfish', 'admin', '', '300', pool='pod1')
+
+
+@pytest.mark.usefixtures('pools')
+def test_usage():
+    """The usage report counts the free and used vlans in each pool."""
+    api.project_create('nuggets')
+    api.network_create('hammernet', 'nuggets', 'nuggets', '', pool='pod1')
+    api.network_create('nailnet', 'admin', '', '103')
+    api.network_create('redbone', 'admin', '', '1511')
+    assert json.loads(api.show_network_allocator_usage()) == {
+        'default': {'free': 6, 'used': 1},
+        'pod1': {'free': 1, 'used': 1},
+    }
+
+
+def test_populate_moves_vlans():
+    """populate() moves vlans whose pool has changed."""
+    from hil.ext.network_allocators.vlan_pool import Vlan
+    config_merge({
+        'hil.ext.network_allocators.vlan_pool': {
+            'vlans': '100-103, 300, 702',
+            'pool.pod1': '104',
+        },
+    })
+    get_network_allocator().populate()
+    assert Vlan.query.filter_by(vlan_no=104).one().pool == 'pod1'
+    assert get_network_allocator().get_new_network_id(pool='pod1') == '104'
+
+
+def test_overlapping_pools():
+    """Pools which share vlans are refused."""
+    from hil.ext.network_allocators import vlan_pool
+    config_merge({
+        'hil.ext.network_allocators.vlan_pool': {'pool.pod1': '104-110'},
+    })
+    with pytest.raises(SystemExit):
+        vlan_pool.setup()
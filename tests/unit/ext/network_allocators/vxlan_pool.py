@@ -0,0 +1,122 @@
+"""Test the vxlan_pool network allocator."""
+import json
+
+import pytest
+
+from hil import api, errors, model
+from hil.config import load_extensions
+from hil.network_allocator import get_network_allocator
+from hil.test_common import fail_on_log_warnings, with_request_context, \
+    fresh_database, config_testsuite, config_merge, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+with_request_context = pytest.yield_fixture(with_request_context)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.network_allocators.null': None,
+            'hil.ext.network_allocators.vxlan_pool': '',
+        },
+        'hil.ext.network_allocators.vxlan_pool': {
+            'vnis': '5000-5004, 16777000-16777215',
+        },
+    })
+    load_extensions()
+
+
+default_fixtures = ['fail_on_log_warnings',
+                    'configure',
+                    'fresh_database',
+                    'server_init',
+                    'with_request_context']
+
+pytestmark = pytest.mark.usefixtures(*default_fixtures)
+
+
+def _free_ranges():
+    """Return the free VNI ranges in the database, in order."""
+    from hil.ext.network_allocators.vxlan_pool import VniRange
+    return [(r.first_vni, r.last_vni)
+            for r in VniRange.query.order_by(VniRange.first_vni)]
+
+
+def test_allocate_and_free():
+    """VNIs are allocated lowest first, and freed VNIs are reused."""
+    allocator = get_network_allocator()
+    assert [allocator.get_new_network_id() for _ in range(3)] == \
+        ['5000', '5001', '5002']
+    assert _free_ranges() == [(5003, 5004), (16777000, 16777215)]
+
+    allocator.free_network_id('5001')
+    assert allocator.get_new_network_id() == '5001'
+
+
+def test_free_joins_ranges():
+    """Freeing VNIs extends and joins the neighbouring free ranges."""
+    allocator = get_network_allocator()
+    for _ in range(5):
+        allocator.get_new_network_id()
+    assert _free_ranges() == [(16777000, 16777215)]
+
+    allocator.free_network_id('5001')
+    allocator.free_network_id('5003')
+    assert _free_ranges() == [(5001, 5001), (5003, 5003),
+                              (16777000, 16777215)]
+    allocator.free_network_id('5002')
+    allocator.free_network_id('5004')
+    assert _free_ranges() == [(5001, 5004), (16777000, 16777215)]
+
+
+def test_claim():
+    """Claiming a VNI splits its free range."""
+    allocator = get_network_allocator()
+    allocator.claim_network_id('5002')
+    assert _free_ranges() == [(5000, 5001), (5003, 5004),
+                              (16777000, 16777215)]
+    with pytest.raises(errors.BlockedError):
+        allocator.claim_network_id('5002')
+    # VNIs outside the pool aren't tracked:
+    allocator.claim_network_id('7000')
+    allocator.claim_network_id('7000')
+    assert not allocator.is_network_id_in_pool('7000')
+    assert allocator.is_network_id_in_pool('16777215')
+
+
+def test_populate():
+    """populate() only adds VNIs which haven't been added before."""
+    allocator = get_network_allocator()
+    allocator.get_new_network_id()
+    allocator.populate()
+    assert _free_ranges() == [(5001, 5004), (16777000, 16777215)]
+
+    config_merge({
+        'hil.ext.network_allocators.vxlan_pool': {'vnis': '1-16777215'},
+    })
+    allocator.populate()
+    assert _free_ranges() == [(1, 4999), (5001, 5004), (5005, 16776999),
+                              (16777000, 16777215)]
+    assert allocator.get_new_network_id() == '1'
+
+
+def test_networks():
+    """Networks get VNIs, and channels to match."""
+    api.project_create('nuggets')
+    api.network_create('hammernet', 'nuggets', 'nuggets', '')
+    api.network_create('nailnet', 'admin', '', '7000')
+    assert api.get_or_404(model.Network, 'hammernet').network_id == '5000'
+    assert api.get_or_404(model.Network, 'hammernet').allocated
+    assert not api.get_or_404(model.Network, 'nailnet').allocated
+    assert json.loads(api.show_network('hammernet'))['channels'] == \
+        ['vxlan/native', 'vxlan/5000']
+    with pytest.raises(errors.BadArgumentError):
+        api.network_create('redbone', 'admin', '', '16777216')
+    assert json.loads(api.show_network_allocator_usage()) == {
+        'default': {'free': 220, 'used': 1},
+    }
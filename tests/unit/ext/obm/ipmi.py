@@ -1,8 +1,16 @@
 """Unit tests for ipmi.py"""
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
 import pytest
 from hil import api, errors
 from hil.test_common import config, config_testsuite, fresh_database, \
-    fail_on_log_warnings, with_request_context, config_merge, server_init
+    fail_on_log_warnings, with_request_context, config_merge, server_init, \
+    console_supervisor
 
 
 @pytest.fixture
@@ -24,6 +32,7 @@ fresh_database = pytest.fixture(fresh_database)
 fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
 with_request_context = pytest.yield_fixture(with_request_context)
 server_init = pytest.fixture(server_init)
+console_supervisor = pytest.yield_fixture(console_supervisor)
 
 
 default_fixtures = ['fail_on_log_warnings',
@@ -74,3 +83,294 @@ class TestIpmi:
 
         with pytest.raises(errors.BadArgumentError):
             instance.require_legal_bootdev("not_valid_bootdev")
+
+    def test_ipmitool_timeout(self, tmpdir, monkeypatch):
+        """ipmitool is killed if the BMC takes too long to respond."""
+        from hil.ext.obm import ipmi
+        from hil.test_common import LoggedWarningError
+        config_merge({'obm': {'timeout': '1'}})
+        ipmitool = tmpdir.join('ipmitool')
+        ipmitool.write('#!/bin/sh\n'
+                       'case "$*" in *status) exit 0;; esac\n'
+                       'sleep 30\n')
+        ipmitool.chmod(0o755)
+        monkeypatch.setenv('PATH', str(tmpdir), prepend=':')
+        instance = ipmi.Ipmi(host="ipmihost",
+                             user="root",
+                             password="tapeworm")
+        assert instance._ipmitool(['chassis', 'power', 'status']) == 0
+
+        start = time.time()
+        # Timing out logs an error:
+        with pytest.raises(LoggedWarningError):
+            instance._ipmitool(['chassis', 'power', 'cycle'])
+        assert time.time() - start < 10
+
+
+class SimulatedBmc(object):
+    """A BMC which speaks just enough RMCP+ for the native transport.
+
+    It listens on a UDP port on localhost, and records the sessions it
+    establishes and the commands it receives. Everything is handled by a
+    background thread.
+    """
+
+    def __init__(self, user, password):
+        self.user = user
+        self.kuid = password.ljust(20, '\0')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        # Map from our session ids to the state of the session:
+        self.sessions = {}
+        # The number of sessions established, and closed:
+        self.opened = 0
+        self.closed = 0
+        # (netfn, command, data) for each command received:
+        self.commands = []
+        # If True, refuse to open sessions:
+        self.refuse = False
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        """Handle packets, forever."""
+        from hil.ext.obm import ipmi_lan
+        while True:
+            packet, addr = self.sock.recvfrom(4096)
+            parsed = ipmi_lan.parse_session_packet(packet)
+            if parsed is None:
+                continue
+            payload_type, session_id, payload = parsed
+            if payload_type == ipmi_lan.PAYLOAD_IPMI:
+                session = self.sessions.get(session_id)
+                if session is None or 'k1' not in session or \
+                        ipmi_lan.parse_session_packet(
+                            packet, session['k1']) is None:
+                    # Real BMCs ignore such packets too.
+                    continue
+                reply = self._command(session_id, payload)
+                reply_type = ipmi_lan.PAYLOAD_IPMI
+                k1 = session['k1']
+            else:
+                reply = self._handshake(payload_type, payload)
+                reply_type = payload_type + 1
+                k1 = None
+                session = {'console_id': 0}
+            self.sock.sendto(ipmi_lan.session_packet(
+                reply_type, session['console_id'], 0, reply, k1), addr)
+
+    def _handshake(self, payload_type, payload):
+        """Handle a message which establishes a session; return the reply."""
+        from hil.ext.obm import ipmi_lan
+        tag = ord(payload[0])
+        if payload_type == ipmi_lan.PAYLOAD_OPEN_SESSION_REQUEST:
+            console_id = struct.unpack('<I', payload[4:8])[0]
+            if self.refuse:
+                # Status 0x11 means "invalid integrity algorithm":
+                return struct.pack('<BBxxI', tag, 0x11, console_id)
+            bmc_id = len(self.sessions) + 1000
+            self.sessions[bmc_id] = {'console_id': console_id}
+            return struct.pack('<BBBxII', tag, 0, 4, console_id, bmc_id) + \
+                payload[8:32]
+        bmc_id = struct.unpack('<I', payload[4:8])[0]
+        session = self.sessions[bmc_id]
+        console_id = struct.pack('<I', session['console_id'])
+        if payload_type == ipmi_lan.PAYLOAD_RAKP1:
+            user_len = ord(payload[27])
+            assert payload[28:28 + user_len] == self.user
+            session['rm'] = payload[8:24]
+            session['rc'] = os.urandom(16)
+            session['guid'] = os.urandom(16)
+            session['role'] = payload[24] + payload[27:28 + user_len]
+            return struct.pack('<BBxx', tag, 0) + console_id + \
+                session['rc'] + session['guid'] + ipmi_lan.hmac_sha1(
+                    self.kuid,
+                    console_id + payload[4:8] + session['rm'] +
+                    session['rc'] + session['guid'] + session['role'])
+        assert payload_type == ipmi_lan.PAYLOAD_RAKP3
+        assert payload[8:28] == ipmi_lan.hmac_sha1(
+            self.kuid, session['rc'] + console_id + session['role'])
+        sik = ipmi_lan.hmac_sha1(self.kuid, session['rm'] + session['rc'] +
+                                 session['role'])
+        session['k1'] = ipmi_lan.hmac_sha1(sik, '\x01' * 20)
+        self.opened += 1
+        return struct.pack('<BBxx', tag, 0) + console_id + ipmi_lan.hmac_sha1(
+            sik, session['rm'] + payload[4:8] + session['guid'])[:12]
+
+    def _command(self, session_id, message):
+        """Handle an IPMI request; return the response."""
+        from hil.ext.obm import ipmi_lan
+        netfn = ord(message[1]) >> 2
+        command = ord(message[5])
+        data = message[6:-1]
+        self.commands.append((netfn, command, data))
+        if (netfn, command) == (ipmi_lan.NETFN_APP,
+                                ipmi_lan.CMD_CLOSE_SESSION):
+            del self.sessions[session_id]
+            self.closed += 1
+        return ipmi_lan.ipmi_message(ipmi_lan.CONSOLE_ADDRESS, netfn + 1,
+                                     ord(message[4]), command, '\0',
+                                     ipmi_lan.BMC_ADDRESS)
+
+
+class TestNativeTransport:
+    """Test sending commands over sessions kept open with the BMC."""
+
+    @pytest.fixture
+    def bmc(self, configure, tmpdir, monkeypatch):
+        """Start a simulated BMC, and use it for the node 'node-99'.
+
+        The ipmitool on the path logs its arguments to ``ipmitool.log`` in
+        `tmpdir`.
+        """
+        # pylint: disable=redefined-outer-name,unused-argument
+        from hil.ext.obm import ipmi_lan
+        bmc = SimulatedBmc('root', 'tapeworm')
+        config_merge({
+            'hil.ext.obm.ipmi': {'port': str(bmc.port)},
+            'obm': {'timeout': '5'},
+        })
+        monkeypatch.setattr(ipmi_lan, 'RETRY_INTERVAL', 0.1)
+        monkeypatch.setattr(ipmi_lan, 'QUICK_TIMEOUT', 0.5)
+        ipmitool = tmpdir.join('ipmitool')
+        ipmitool.write('#!/bin/sh\n'
+                       'echo "$@" >> %s\n' % tmpdir.join('ipmitool.log'))
+        ipmitool.chmod(0o755)
+        monkeypatch.setenv('PATH', str(tmpdir), prepend=':')
+        return bmc
+
+    @staticmethod
+    def _ipmi():
+        """Return an Ipmi obm talking to the simulated BMC."""
+        from hil.ext.obm import ipmi
+        return ipmi.Ipmi(host="127.0.0.1", user="root", password="tapeworm")
+
+    def test_session_reuse(self, bmc):
+        """Consecutive commands share one session."""
+        from hil.ext.obm import ipmi_lan
+        obm = self._ipmi()
+        obm.power_cycle(force=False)
+        obm.set_bootdev('disk')
+        assert bmc.commands == [
+            (ipmi_lan.NETFN_CHASSIS, ipmi_lan.CMD_SET_BOOT_OPTIONS,
+             '\x05\x80\x04\x00\x00\x00'),
+            (ipmi_lan.NETFN_CHASSIS, ipmi_lan.CMD_CHASSIS_CONTROL, '\x02'),
+            (ipmi_lan.NETFN_CHASSIS, ipmi_lan.CMD_SET_BOOT_OPTIONS,
+             '\x05\xc0\x08\x00\x00\x00'),
+        ]
+        assert bmc.opened == 1
+
+        ipmi_lan.close_all()
+        assert bmc.closed == 1
+
+    def test_idle_timeout(self, bmc):
+        """Sessions which have been idle too long are closed."""
+        config_merge({'hil.ext.obm.ipmi': {'session_idle_timeout': '0'}})
+        obm = self._ipmi()
+        obm.power_off()
+        time.sleep(0.01)
+        obm.power_off()
+        assert bmc.opened == 2
+        assert bmc.closed == 1
+
+    def test_dropped_session(self, bmc):
+        """If the BMC drops a session, a new one is established."""
+        obm = self._ipmi()
+        obm.power_off()
+        bmc.sessions.clear()
+        obm.power_off()
+        assert bmc.opened == 2
+        assert len(bmc.commands) == 2
+
+    def test_fallback(self, bmc, tmpdir):
+        """ipmitool is used for BMCs which won't open a session."""
+        bmc.refuse = True
+        obm = self._ipmi()
+        obm.power_off()
+        obm.power_off()
+        assert bmc.commands == []
+        assert tmpdir.join('ipmitool.log').read().splitlines() == [
+            '-I lanplus -U root -P tapeworm -H 127.0.0.1 chassis power off'
+        ] * 2
+
+    def test_ipmitool_transport(self, bmc, tmpdir):
+        """The native transport can be turned off."""
+        config_merge({'hil.ext.obm.ipmi': {'transport': 'ipmitool'}})
+        self._ipmi().set_bootdev('pxe')
+        assert bmc.commands == []
+        assert len(tmpdir.join('ipmitool.log').read().splitlines()) == 1
+
+
+class TestConsole:
+    """Test logging the console through the console supervisor."""
+
+    @pytest.fixture
+    def console_config(self, configure, tmpdir, monkeypatch):
+        """Configure console logging, and register an ipmi node 'node-99'.
+
+        The ipmitool on the path logs its arguments to ``ipmitool.log`` in
+        `tmpdir`, and prints a line of console output.
+        """
+        # pylint: disable=redefined-outer-name,unused-argument
+        config_merge({
+            'console': {
+                'log_dir': str(tmpdir),
+                'supervisor_socket': str(tmpdir.join('supervisor.sock')),
+            },
+        })
+        ipmitool = tmpdir.join('ipmitool')
+        ipmitool.write('#!/bin/sh\n'
+                       'echo "$@" >> %s\n'
+                       'case "$*" in *"sol activate")\n'
+                       '    echo "PXE boot"; exec sleep 60;;\n'
+                       'esac\n' % tmpdir.join('ipmitool.log'))
+        ipmitool.chmod(0o755)
+        monkeypatch.setenv('PATH', str(tmpdir), prepend=':')
+        api.node_register(
+            node='node-99',
+            obm={
+                "type": "http://schema.massopencloud.org/haas/v0/obm/ipmi",
+                "host": "ipmihost",
+                "user": "root",
+                "password": "tapeworm",
+            },
+            obmd={
+                "uri": "http://obmd.example.com/nodes/node-99",
+                "admin_token": "secret",
+            },
+        )
+
+    def test_console(self, console_config, console_supervisor, tmpdir):
+        """The console is logged by the supervisor until it is stopped."""
+        # pylint: disable=redefined-outer-name,unused-argument
+        api.start_console('node-99')
+        deadline = time.time() + 10
+        while api.show_console('node-99').get_data() != 'PXE boot\n':
+            assert time.time() < deadline
+            time.sleep(0.05)
+        assert json.loads(api.list_consoles()) == {
+            'node-99': {'running': True, 'restarts': 0},
+        }
+
+        api.stop_console('node-99')
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+        assert json.loads(api.list_consoles()) == {}
+        sol = '-H ipmihost -U root -P tapeworm -I lanplus sol '
+        assert tmpdir.join('ipmitool.log').read().splitlines() == [
+            sol + 'deactivate', sol + 'activate', sol + 'deactivate',
+        ]
+
+    def test_no_supervisor(self, console_config, monkeypatch):
+        """Nodes can be deleted when the supervisor isn't running."""
+        # pylint: disable=redefined-outer-name,unused-argument
+        from hil import console_supervisor as supervisor
+        warnings = []
+        monkeypatch.setattr(supervisor.logger, 'warning',
+                            lambda *args: warnings.append(args))
+        api.node_delete('node-99')
+        assert len(warnings) == 1
+        with pytest.raises(errors.NotFoundError):
+            api.show_node('node-99')
@@ -0,0 +1,169 @@
+"""Tests for hil.inventory and the export_inventory api call."""
+import json
+
+import pytest
+
+from hil import api, config, deferred, errors, inventory, model
+from hil.auth import get_auth_backend
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init, newDB, releaseDB
+
+MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.null': None,
+            'hil.ext.auth.mock': '',
+            'hil.ext.switches.mock': '',
+            'hil.ext.obm.mock': '',
+            'hil.ext.network_allocators.null': None,
+            'hil.ext.network_allocators.vlan_pool': '',
+        },
+        'hil.ext.network_allocators.vlan_pool': {
+            'vlans': '40-80',
+        },
+    })
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def set_admin_auth():
+    """Set admin auth for all calls"""
+    get_auth_backend().set_admin(True)
+
+
+@pytest.fixture
+def populated():
+    """Create a small inventory with one of each kind of object."""
+    api.project_create('runway')
+    api.switch_register('sw0',
+                        type=MOCK_SWITCH_TYPE,
+                        username='switch_user',
+                        password='switch_pass',
+                        hostname='switchname')
+    api.switch_register_port('sw0', 'gi1/0/1')
+    api.switch_register_port('sw0', 'gi1/0/2')
+    for name in 'node-1', 'node-2':
+        api.node_register(
+            node=name,
+            obm={
+                'type': OBM_TYPE_MOCK,
+                'host': 'ipmihost',
+                'user': 'root',
+                'password': 'tapeworm',
+            },
+            obmd={
+                'uri': 'http://obmd.example.com/nodes/' + name,
+                'admin_token': 'secret',
+            },
+            metadata={'EK': {'pk': 'abcd'}},
+        )
+        api.node_register_nic(name, 'eth0', 'de:ad:be:ef:20:14')
+    api.port_connect_nic('sw0', 'gi1/0/1', 'node-1', 'eth0')
+    api.project_connect_node('runway', 'node-1')
+    api.network_create('runway_pxe', 'runway', 'runway', '')
+    api.network_create('pub', 'admin', '', '')
+    api.node_connect_network('node-1', 'eth0', 'runway_pxe')
+    deferred.apply_networking()
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context',
+                                     'set_admin_auth',
+                                     'populated')
+
+
+def _export():
+    """Invoke export_inventory, returning the parsed records."""
+    response = api.export_inventory()
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.response]
+
+
+def test_export_contents():
+    """The export should describe every object, in dependency order."""
+    records = _export()
+    types = [r['type'] for r in records]
+    assert types == sorted(types, key=inventory.RECORD_TYPES.index)
+
+    nodes = [r for r in records if r['type'] == 'node']
+    assert [n['label'] for n in nodes] == ['node-1', 'node-2']
+    assert nodes[0]['project'] == 'runway'
+    assert nodes[1]['project'] is None
+    assert nodes[0]['obm'] == {
+        'type': OBM_TYPE_MOCK,
+        'host': 'ipmihost',
+        'user': 'root',
+        'password': 'tapeworm',
+    }
+
+    [switch] = [r for r in records if r['type'] == 'switch']
+    assert switch['driver'] == MOCK_SWITCH_TYPE
+    assert switch['params'] == {
+        'hostname': 'switchname',
+        'username': 'switch_user',
+        'password': 'switch_pass',
+    }
+
+    [attachment] = [r for r in records if r['type'] == 'attachment']
+    assert attachment == {
+        'type': 'attachment',
+        'node': 'node-1',
+        'nic': 'eth0',
+        'network': 'runway_pxe',
+        'channel': 'vlan/native',
+    }
+    assert {'type': 'metadata',
+            'node': 'node-2',
+            'label': 'EK',
+            'value': {'pk': 'abcd'}} in records
+
+
+def test_export_requires_admin():
+    """Non-admins may not export the inventory."""
+    get_auth_backend().set_admin(False)
+    with pytest.raises(errors.AuthorizationError):
+        api.export_inventory()
+
+
+def test_round_trip():
+    """Importing an export into an empty database should reproduce it."""
+    records = _export()
+    releaseDB()
+    newDB()
+    inventory.import_records(records)
+    db.session.commit()
+    assert _export() == records
+
+    # The allocated network's vlan should have been claimed in the pool:
+    network = api.get_or_404(model.Network, 'runway_pxe')
+    with pytest.raises(errors.BlockedError):
+        api.network_create('other', 'admin', '', network.network_id)
+
+
+def test_import_duplicate():
+    """Importing on top of the existing objects should fail."""
+    with pytest.raises(errors.DuplicateError):
+        inventory.import_records(_export())
+
+
+def test_import_bad_record_type():
+    """Unknown record types are rejected."""
+    with pytest.raises(errors.BadArgumentError):
+        inventory.import_records([{'type': 'headnode', 'label': 'hn'}])
@@ -9,10 +9,11 @@
 
 from hil.model import Node, Nic, Project, Headnode, Hnic, Network, \
     NetworkingAction, Metadata
-from hil import config
+from hil import config, model
+from hil.flaskapp import app
 
 from hil.test_common import fresh_database, config_testsuite, ModelTest, \
-    fail_on_log_warnings
+    fail_on_log_warnings, config_merge
 import pytest
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
@@ -117,3 +118,57 @@ class TestNetworkingAction(ModelTest):
         return NetworkingAction(nic=nic,
                                 new_network=network,
                                 channel='null')
+
+
+def test_init_db_pool_options():
+    """init_db applies the [database] pool and timeout options."""
+    config_merge({
+        'database': {
+            'pool_size': '8',
+            'max_overflow': '2',
+            'pool_recycle': '3600',
+            'pool_pre_ping': 'True',
+            'statement_timeout': '5000',
+        },
+    })
+    uri = config.cfg.get('database', 'uri')
+    try:
+        model.init_db('postgresql://hil@localhost/hil')
+        assert app.config['SQLALCHEMY_POOL_SIZE'] == 8
+        assert app.config['SQLALCHEMY_MAX_OVERFLOW'] == 2
+        assert app.config['SQLALCHEMY_POOL_TIMEOUT'] is None
+        assert app.config['SQLALCHEMY_POOL_RECYCLE'] == 3600
+        assert app.config['HIL_ENGINE_OPTIONS'] == {
+            'pool_pre_ping': True,
+            'connect_args': {'options': '-c statement_timeout=5000'},
+        }
+
+        # sqlite doesn't have a sized pool, or statement timeouts:
+        model.init_db('sqlite:///:memory:')
+        assert app.config['SQLALCHEMY_POOL_SIZE'] is None
+        assert app.config['SQLALCHEMY_MAX_OVERFLOW'] is None
+        assert app.config['HIL_ENGINE_OPTIONS'] == {'pool_pre_ping': True}
+    finally:
+        model.init_db(uri)
+
+
+def test_pool_status():
+    """pool_status reports on pools which support it."""
+    with app.app_context():
+        status = model.pool_status()
+        if config.cfg.get('database', 'uri').startswith('sqlite'):
+            assert status is None
+        else:
+            assert set(status) == {'size', 'checked_out', 'overflow'}
+
+
+def test_write_position():
+    """write_position works on every database, though it may not know."""
+    with app.app_context():
+        position = model.write_position()
+        if config.cfg.get('database', 'uri').startswith('sqlite'):
+            assert position == model.UNKNOWN_POSITION
+        else:
+            # Old and new PostgreSQL versions name their log functions
+            # differently; either way, we should get a real position:
+            assert position != model.UNKNOWN_POSITION
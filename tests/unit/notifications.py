@@ -0,0 +1,119 @@
+"""Tests for hil.notifications."""
+import threading
+import time
+
+import pytest
+
+from hil import config, notifications
+from hil.flaskapp import app
+from hil.model import db
+from hil.test_common import config_testsuite, fresh_database, \
+    fail_on_log_warnings, server_init
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL."""
+    config_testsuite()
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+
+@pytest.yield_fixture
+def app_context():
+    """Run the test inside an app context."""
+    with app.app_context():
+        yield
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'app_context')
+
+
+def test_delivered_on_commit():
+    """A notification wakes subscribers once the transaction commits."""
+    with notifications.subscribe('test') as subscription:
+        notifications.publish('test', 'foo')
+        assert not subscription.wait(0)
+        db.session.commit()
+        assert subscription.wait(0)
+        # The notification has been consumed:
+        assert not subscription.wait(0)
+
+
+def test_discarded_on_rollback():
+    """A notification in a rolled-back transaction is never delivered."""
+    with notifications.subscribe('test') as subscription:
+        notifications.publish('test', 'foo')
+        db.session.rollback()
+        db.session.commit()
+        assert not subscription.wait(0)
+
+
+def test_payload_filter():
+    """Subscribers only hear about the payloads they asked for."""
+    with notifications.subscribe('test', ['foo']) as subscription:
+        notifications.publish('test', 'bar')
+        notifications.publish('other', 'foo')
+        db.session.commit()
+        assert not subscription.wait(0)
+        notifications.publish('test', 'foo')
+        db.session.commit()
+        assert subscription.wait(0)
+
+
+def test_keep_payloads():
+    """Subscriptions can keep the payloads they receive."""
+    with notifications.subscribe('test', keep_payloads=True) as subscription:
+        notifications.publish('test', 'foo')
+        notifications.publish('test', 'bar')
+        db.session.commit()
+        assert subscription.received() == ['foo', 'bar']
+        assert subscription.received() == []
+
+        # Notifications which may have been lost are reported as None:
+        notifications._dispatch_all()
+        notifications.publish('test', 'baz')
+        db.session.commit()
+        assert subscription.received() == [None]
+
+
+def test_wait_until_wakes_on_notification():
+    """wait_until re-checks its condition when notified from a thread."""
+    state = {'ready': False, 'checks': 0}
+
+    def ready():
+        """Count the check, and report whether we are ready."""
+        state['checks'] += 1
+        return state['ready']
+
+    def publisher():
+        """Become ready, and publish a notification saying so."""
+        time.sleep(0.2)
+        with app.app_context():
+            state['ready'] = True
+            notifications.publish('test', 'foo')
+            db.session.commit()
+
+    thread = threading.Thread(target=publisher)
+    thread.start()
+    start = time.time()
+    assert notifications.wait_until(ready, 'test', ['foo'], timeout=30)
+    thread.join()
+    assert time.time() - start < 10
+    # Once up front, and once after the notification; no polling:
+    assert state['checks'] == 2
+
+
+def test_wait_until_timeout():
+    """wait_until gives up after the timeout."""
+    start = time.time()
+    assert not notifications.wait_until(lambda: False, 'test', timeout=0.1)
+    assert time.time() - start >= 0.1
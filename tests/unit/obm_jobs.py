@@ -0,0 +1,194 @@
+"""Test the background carrying out of out of band management operations."""
+import json
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+from hil import api, config, model, obm_jobs
+from hil.model import db
+from hil.test_common import fail_on_log_warnings, with_request_context, \
+    fresh_database, config_testsuite, config_merge, server_init, newDB, \
+    releaseDB, LoggedWarningError
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+with_request_context = pytest.yield_fixture(with_request_context)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.mock': '',
+        },
+        'obm': {
+            'workers': '4',
+            'per_host_limit': '1',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def shared_database(configure, fresh_database, tmpdir):
+    """Use a database which the worker threads can share.
+
+    If the configured database is in-memory sqlite, which can't be shared,
+    a temporary file is used instead.
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+    if config.cfg.get('database', 'uri') == 'sqlite:///:memory:':
+        config_merge({
+            'database': {'uri': 'sqlite:///' + str(tmpdir.join('hil.db'))},
+        })
+    newDB()
+    yield
+    releaseDB()
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'shared_database',
+                                     'server_init',
+                                     'with_request_context')
+
+
+def _register_node(name, host):
+    """Register a mock node named `name`, whose BMC is `host`."""
+    api.node_register(
+        node=name,
+        obm={
+            "type": OBM_TYPE_MOCK,
+            "host": host,
+            "user": "root",
+            "password": "tapeworm",
+        },
+        obmd={
+            'uri': 'http://obmd.example.com/nodes/' + name,
+            'admin_token': 'secret',
+        },
+    )
+
+
+def _wait_for_job(job_id, timeout=30):
+    """Wait for all of the actions in `job_id` to finish, and return them."""
+    deadline = time.time() + timeout
+    while True:
+        # End the current transaction, so we see the workers' changes:
+        db.session.commit()
+        response = json.loads(api.show_nodes_power(job_id))
+        statuses = [n['status'] for n in response['nodes'].values()]
+        if all(s in ('DONE', 'ERROR') for s in statuses) or \
+                time.time() > deadline:
+            return response
+        time.sleep(0.05)
+
+
+def test_per_host_limit(monkeypatch):
+    """Actions run in parallel, but only one at a time per BMC."""
+    from hil.ext.obm.mock import MockObm
+    lock = threading.Lock()
+    running = defaultdict(int)
+    most_running = defaultdict(int)
+
+    def power_off(obm):
+        """Record how many actions run against `obm`'s BMC at once."""
+        with lock:
+            running[obm.host] += 1
+            most_running[obm.host] = max(most_running[obm.host],
+                                         running[obm.host])
+            most_running['total'] = max(most_running['total'],
+                                        sum(running.values()))
+        time.sleep(0.1)
+        with lock:
+            running[obm.host] -= 1
+    monkeypatch.setattr(MockObm, 'power_off', power_off)
+
+    nodes = []
+    for i in range(8):
+        nodes.append('node-%d' % i)
+        _register_node(nodes[-1], 'bmc-%d' % (i % 4))
+
+    response, status = api.nodes_power(nodes, 'power_off')
+    assert status == 202
+    obm_jobs.Server().poll()
+    response = _wait_for_job(json.loads(response)['job_id'])
+
+    assert response['nodes'] == dict((node, {'status': 'DONE', 'error': None})
+                                     for node in nodes)
+    assert max(most_running['bmc-%d' % i] for i in range(4)) == 1
+    assert most_running['total'] > 1
+
+
+def test_node_order(monkeypatch):
+    """Actions on one node run one at a time, in order, whatever the limit."""
+    from hil.ext.obm.mock import MockObm
+    config_merge({'obm': {'per_host_limit': '0'}})
+    calls = []
+
+    def set_bootdev(obm, dev):
+        """Record the order of the calls, and whether they overlap."""
+        calls.append(('start', dev))
+        time.sleep(0.05)
+        calls.append(('end', dev))
+    monkeypatch.setattr(MockObm, 'set_bootdev', set_bootdev)
+
+    _register_node('node-0', 'bmc-0')
+    status_ids = []
+    for dev in 'pxe', 'disk', 'none':
+        response, _ = api.node_set_bootdev('node-0', dev)
+        status_ids.append(json.loads(response)['status_id'])
+    obm_jobs.Server().poll()
+    db.session.commit()
+    assert json.loads(api.show_obm_action(status_ids[-1], wait=30)) == {
+        'status': 'DONE',
+        'error': None,
+        'node': 'node-0',
+        'type': 'set_bootdev',
+    }
+    assert calls == [('start', 'pxe'), ('end', 'pxe'),
+                     ('start', 'disk'), ('end', 'disk'),
+                     ('start', 'none'), ('end', 'none')]
+
+
+def test_recover():
+    """Actions left running by a previous server are marked as failed."""
+    _register_node('node-0', 'bmc-0')
+    response, _ = api.node_power_off('node-0')
+    status_id = json.loads(response)['status_id']
+    model.ObmAction.query.update({'status': 'RUNNING'})
+    db.session.commit()
+
+    # This logs a warning:
+    with pytest.raises(LoggedWarningError):
+        obm_jobs.Server().recover()
+    assert json.loads(api.show_obm_action(status_id))['status'] == 'ERROR'
+
+
+def test_prune():
+    """Old finished actions are removed."""
+    from datetime import datetime, timedelta
+    _register_node('node-0', 'bmc-0')
+    api.node_power_off('node-0')
+    api.node_power_off('node-0')
+    old, new = model.ObmAction.query.order_by(model.ObmAction.id).all()
+    old.status = new.status = 'DONE'
+    old.finished = datetime.utcnow() - timedelta(days=8)
+    new.finished = datetime.utcnow()
+    db.session.commit()
+
+    obm_jobs.Server().poll()
+    assert [a.id for a in model.ObmAction.query] == [new.id]
+
+
+def test_bmc_host():
+    """OBMs are grouped by their host."""
+    _register_node('node-0', 'bmc-0')
+    obm = api.get_or_404(model.Node, 'node-0').obm
+    assert obm_jobs.bmc_host(obm) == 'bmc-0'
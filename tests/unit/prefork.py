@@ -0,0 +1,100 @@
+"""Tests for hil.prefork."""
+import os
+import signal
+import threading
+import time
+
+import pytest
+import requests
+
+from hil.prefork import PreforkServer
+
+
+def _app(environ, start_response):
+    """A wsgi app which responds with the pid of the worker serving it.
+
+    Requests for /slow take a second.
+    """
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(1)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid())]
+
+
+@pytest.yield_fixture
+def prefork_server():
+    """Run a PreforkServer in a child process.
+
+    Yields (server, pid), where pid is that of the process running the
+    server.
+    """
+    server = PreforkServer(_app, port=0, workers=2, threads=2,
+                           graceful_timeout=5)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.run()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    server.server.server_close()
+    try:
+        yield server, pid
+    finally:
+        _stop(pid)
+
+
+def _stop(pid):
+    """Stop the server running in `pid`, and return its exit status."""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        return os.waitpid(pid, 0)[1]
+    except OSError:
+        return None
+
+
+def _get(server, path='/'):
+    """Make a request to `server`, retrying until it is up."""
+    deadline = time.time() + 10
+    while True:
+        try:
+            return requests.get('http://127.0.0.1:%d%s' % (server.port, path))
+        except requests.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def test_serve(prefork_server):
+    """Requests are served by the workers, not the parent."""
+    server, pid = prefork_server
+    pids = set()
+    for _ in range(20):
+        resp = _get(server)
+        assert resp.status_code == 200
+        pids.add(int(resp.text))
+    assert pid not in pids
+    assert os.getpid() not in pids
+    assert _stop(pid) == 0
+
+
+def test_graceful_shutdown(prefork_server):
+    """Requests in progress complete when the server is stopped."""
+    server, pid = prefork_server
+    _get(server)
+    responses = []
+    thread = threading.Thread(
+        target=lambda: responses.append(_get(server, '/slow')))
+    thread.start()
+    time.sleep(0.3)
+    assert _stop(pid) == 0
+    thread.join()
+    assert responses[0].status_code == 200
+
+
+def test_respawn(prefork_server):
+    """Workers which die are replaced."""
+    server, _ = prefork_server
+    worker = int(_get(server).text)
+    os.kill(worker, signal.SIGKILL)
+    pids = set(int(_get(server).text) for _ in range(20))
+    assert worker not in pids
@@ -10,17 +10,20 @@ to use stuff like `parametrize`.
 # will erroneously flag them as unused variables -- we disable that warning
 # locally in many places in this module.
 
-from hil import rest, config
+from hil import rest, config, model, request_stats
 
 from abc import ABCMeta, abstractmethod
 import unittest
 import json
 import logging
 
+import flask
 from schema import Schema, Optional, Use
+from sqlalchemy import create_engine
 import pytest
 
-from hil.test_common import config_testsuite, fail_on_log_warnings
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings, newDB, releaseDB
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
 
@@ -608,3 +611,154 @@ def test_dont_log(client, caplog):
             "An error occured handling the request!"
         for record in caplog.records:
             assert 'sensitive info' not in record.getMessage()
+
+
+@pytest.fixture()
+def observed_stats():
+    """Collect the (endpoint, status, stats) of each request handled."""
+    observed = []
+
+    def observer(endpoint, status, stats):
+        """Record the request."""
+        observed.append((endpoint, status, stats))
+    request_stats.observers.append(observer)
+    yield observed
+    request_stats.observers.remove(observer)
+
+
+def test_request_stats(client, observed_stats):
+    """Requests should be timed, and their SQL statements counted."""
+    engine = create_engine('sqlite://')
+
+    @rest.rest_call('GET', '/two-queries', Schema({}))
+    # pylint: disable=unused-variable
+    def two_queries():
+        """Execute two SQL statements."""
+        engine.execute('SELECT 1')
+        engine.execute('SELECT 2')
+
+    @rest.rest_call('GET', '/fails', Schema({}))
+    # pylint: disable=unused-variable
+    def fails():
+        """Raise an APIError."""
+        raise rest.APIError("Failed")
+
+    resp = client.get('/v0/two-queries')
+    assert 'Server-Timing' not in resp.headers
+    client.get('/v0/fails')
+
+    [(endpoint, status, stats), failed] = observed_stats
+    assert (endpoint, status) == ('two_queries', 200)
+    assert stats.sql_count == 2
+    assert list(stats.phases) == ['validate', 'auth', 'handler', 'serialize']
+    assert failed[:2] == ('fails', 400)
+
+
+def test_request_stats_streamed(client, observed_stats):
+    """Streamed responses are accounted for once they have been sent."""
+    engine = create_engine('sqlite://')
+
+    @rest.rest_call('GET', '/streamed-query', Schema({}))
+    # pylint: disable=unused-variable
+    def streamed_query():
+        """Execute a SQL statement while streaming the response."""
+        def _generate():
+            """Execute the statement, and yield its result."""
+            yield str(engine.execute('SELECT 1').scalar())
+        return flask.Response(flask.stream_with_context(_generate()))
+
+    resp = client.get('/v0/streamed-query', buffered=False)
+    assert observed_stats == []
+    assert resp.get_data() == '1'
+    resp.close()
+    [(endpoint, status, stats)] = observed_stats
+    assert (endpoint, status) == ('streamed_query', 200)
+    assert stats.sql_count == 1
+    assert list(stats.phases) == ['validate', 'auth', 'handler', 'serialize',
+                                  'stream']
+
+
+def test_request_stats_headers(client):
+    """If enabled, statistics should be reported in the response headers."""
+    config_merge({'devel': {'request_stats': 'True'}})
+
+    @rest.rest_call('GET', '/no-queries', Schema({}))
+    # pylint: disable=unused-variable
+    def no_queries():
+        """Do nothing."""
+
+    resp = client.get('/v0/no-queries')
+    assert resp.headers['X-HIL-SQL-Count'] == '0'
+    phases = [timing.split(';')[0]
+              for timing in resp.headers['Server-Timing'].split(', ')]
+    assert phases == ['validate', 'auth', 'handler', 'serialize', 'db']
+
+
+@pytest.fixture()
+def replica(tmpdir):
+    """Configure a read replica, separate from the (fresh) primary database.
+
+    The replica contains just the project "replica-project".
+    """
+    config_merge({
+        'database': {
+            'replica_uri': 'sqlite:///' + str(tmpdir.join('replica.db')),
+        },
+    })
+    newDB()
+    with rest.app.app_context():
+        engine = model.db.get_engine(rest.app, bind=model.REPLICA)
+        model.db.metadata.create_all(bind=engine)
+        engine.execute(model.Project.__table__.insert(),
+                       label='replica-project')
+    yield
+    releaseDB()
+
+
+@pytest.mark.usefixtures('replica')
+def test_replica_routing(client):
+    """GET requests use the replica, unless the client has written since."""
+
+    @rest.rest_call('GET', '/replica-projects', Schema({}))
+    # pylint: disable=unused-variable
+    def list_replica_projects():
+        """List the projects."""
+        return json.dumps(sorted(p.label for p in model.Project.query))
+
+    @rest.rest_call('GET', '/primary-projects', Schema({}),
+                    use_replica=False)
+    # pylint: disable=unused-variable
+    def list_primary_projects():
+        """List the projects."""
+        return json.dumps(sorted(p.label for p in model.Project.query))
+
+    @rest.rest_call('PUT', '/replica-projects/<label>',
+                    Schema({'label': basestring}))
+    # pylint: disable=unused-variable
+    def create_replica_project(label):
+        """Create a project."""
+        model.db.session.add(model.Project(label))
+        model.db.session.commit()
+
+    def _projects(path):
+        resp = client.get(path)
+        assert resp.status_code == 200
+        return json.loads(resp.get_data())
+
+    assert _projects('/v0/replica-projects') == ['replica-project']
+    assert _projects('/v0/primary-projects') == []
+
+    resp = client.put('/v0/replica-projects/new-project')
+    assert resp.status_code == 200
+    position = resp.headers[rest.WRITE_POSITION_HEADER]
+
+    # The cookie keeps this client on the primary; sqlite replicas never
+    # report having caught up:
+    assert _projects('/v0/replica-projects') == ['new-project']
+    fresh_client = rest.app.test_client()
+    assert json.loads(fresh_client.get('/v0/replica-projects').get_data()) \
+        == ['replica-project']
+    assert json.loads(fresh_client.get(
+        '/v0/replica-projects',
+        headers={rest.WRITE_POSITION_HEADER: position}).get_data()) \
+        == ['new-project']
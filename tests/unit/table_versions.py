@@ -0,0 +1,136 @@
+"""Tests for hil.table_versions, and conditional GET support in hil.rest."""
+import pytest
+
+from hil import api, config, model, rest, table_versions
+from hil.flaskapp import app
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, server_init
+
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'auth': {
+            'require_authentication': 'False',
+        },
+        'extensions': {
+            'hil.ext.auth.null': None,
+            'hil.ext.auth.mock': '',
+            'hil.ext.obm.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init')
+
+
+@pytest.fixture
+def client():
+    """Return a flask test client."""
+    return rest.app.test_client()
+
+
+def _register_node(name):
+    """Register a node directly through the api module, and commit."""
+    with app.test_request_context():
+        rest.init_auth()
+        rest.local.auth['admin'] = True
+        api.node_register(
+            node=name,
+            obm={
+                'type': OBM_TYPE_MOCK,
+                'host': 'ipmihost',
+                'user': 'root',
+                'password': 'tapeworm',
+            },
+            obmd={
+                'uri': 'http://obmd.example.com/nodes/' + name,
+                'admin_token': 'secret',
+            },
+        )
+
+
+def _versions(*tables):
+    """Return the current versions of ``tables``."""
+    with app.app_context():
+        return table_versions.versions(tables)
+
+
+def test_versions_bumped_once_per_transaction():
+    """Each transaction bumps each table it modifies exactly once."""
+    assert _versions('project', 'node') == {'project': 0, 'node': 0}
+    with app.app_context():
+        db.session.add(model.Project('runway'))
+        db.session.commit()
+    before = _versions('project', 'node')
+    assert before['project'] != 0
+    assert before['node'] == 0
+
+    with app.app_context():
+        db.session.add(model.Project('manhattan'))
+        db.session.flush()
+        db.session.add(model.Project('anvil'))
+        db.session.commit()
+    _register_node('node-1')
+    after = _versions('project', 'node')
+    assert after['project'] == before['project'] + 1
+    assert after['node'] != 0
+
+
+def test_bumped_at_commit():
+    """Versions are only bumped when the transaction commits."""
+    with app.app_context():
+        db.session.add(model.Project('runway'))
+        db.session.flush()
+        assert table_versions.versions(['project']) == {'project': 0}
+        db.session.commit()
+    assert _versions('project')['project'] != 0
+
+
+def test_rollback_undoes_bump():
+    """Rolled-back transactions don't change versions."""
+    with app.app_context():
+        db.session.add(model.Project('runway'))
+        db.session.flush()
+        db.session.rollback()
+    assert _versions('project') == {'project': 0}
+
+
+def test_conditional_get(client):
+    """Matching If-None-Match gets a 304 until the data changes."""
+    _register_node('node-1')
+    resp = client.get('/v0/nodes/all')
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    resp = client.get('/v0/nodes/all', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+    assert resp.get_data() == ''
+
+    # A different resource, or different credentials, get different ETags:
+    assert client.get('/v0/nodes/free').headers['ETag'] != etag
+    assert client.get('/v0/nodes/all', headers={
+        'If-None-Match': etag,
+        'Authorization': 'Basic Zm9vOmJhcg==',
+    }).status_code == 200
+
+    _register_node('node-2')
+    resp = client.get('/v0/nodes/all', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert '"node-2"' in resp.get_data()